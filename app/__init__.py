@@ -1,8 +1,14 @@
-from flask import Flask
+from flask import Flask, request
 
-from app.extensions import limiter, mongo, flask_uuid
+from app.extensions import limiter, mongo, flask_uuid, access_cache, count_cache, \
+    s3_urls_cache, item_cache, compress, item_layout, metrics
 from app.config import Config
+from app.assertions import compile_schemas
+from app.json_provider import json_provider_class
+from app.indexes import log_missing_indexes
+from app.services import get_session, get_pool
 from app.errors import handle_429_request, handle_wrong_method, handle_not_found
+from app.logs import JsonFormatter, RequestSampler, install_queue_handler
 
 import logging
 from logging.handlers import RotatingFileHandler
@@ -14,29 +20,31 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # logging stuff
-    formatter = logging.Formatter("[%(asctime)s] [%(pathname)s:%(lineno)d] %(levelname)s - %(message)s")
-    handler = RotatingFileHandler(app.config['LOG_FILENAME'], maxBytes=10000000, backupCount=5)
-    log_level = app.config['LOG_LEVEL']
-
-    if log_level == 'DEBUG': # pragma: no cover
-        app.logger.setLevel(logging.DEBUG) # pragma: no cover
-    elif log_level == 'INFO': # pragma: no cover
-        app.logger.setLevel(logging.INFO) # pragma: no cover
-    elif log_level == 'WARNING': # pragma: no cover
-        app.logger.setLevel(logging.WARNING) # pragma: no cover
-    elif log_level == 'ERROR': # pragma: no cover
-        app.logger.setLevel(logging.ERROR) # pragma: no cover
-    else: # pragma: no cover
-        app.logger.setLevel(logging.CRITICAL) # pragma: no cover
-
-    handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
+    sampler = configure_logging(app)
 
     # initial flask extensions
+    metrics.init_app(app)
+    app.before_request(lambda: sampler.start(request))
+    app.teardown_request(sampler.finish)
     limiter.init_app(app)
     flask_uuid.init_app(app)
     # mongo.init_app(app, uri=app.config['MONGO_URI'])
-    mongo.init_app(app)
+    # connect=False so nothing is opened until the first query - gunicorn
+    # preloads the app and mongo clients don't survive a fork
+    mongo.init_app(app, connect=False, minPoolSize=app.config['MONGO_MIN_POOL_SIZE'],
+                   event_listeners=metrics.event_listeners())
+    # has to come after flask-pymongo as it installs its own (bson) provider
+    app.json = json_provider_class(app.config['JSON_PROVIDER'])(app)
+    access_cache.init_app(app, 'ACCESS_CACHE')
+    count_cache.init_app(app, 'COUNT_CACHE')
+    s3_urls_cache.init_app(app, 'S3_URLS_CACHE')
+    item_cache.init_app(app, 'ITEM_CACHE')
+    compress.init_app(app)
+    item_layout.init_app(app)
+
+    # compile json schema validators up front. done before gunicorn forks
+    # so every worker shares them
+    compile_schemas()
 
     # blueprints
     from app.main import bp as main_bp
@@ -49,3 +57,53 @@ def create_app(config_class=Config):
 
     return app
 
+
+def warm_up(app):
+    # gets a freshly forked worker ready before it takes any traffic - called
+    # from gunicorn's post_worker_init. opens the mongo pool, builds the
+    # outbound session and thread pool and optionally moans about any indexes
+    # that haven't been created. none of it can happen before the fork. never
+    # raises - a worker that can't reach mongo yet still starts
+    with app.app_context():
+        try:
+            mongo.cx.admin.command('ping')
+        except Exception as e:
+            app.logger.error("Unable to reach mongo on warm up [%s]", e)
+        else:
+            if app.config.get('CHECK_INDEXES_ON_STARTUP'):
+                log_missing_indexes(mongo.db, app.logger, item_layout.mode)
+        # already compiled if the app was preloaded
+        compile_schemas()
+        get_session()
+        get_pool()
+
+
+def configure_logging(app):
+    # log calls only ever put the record on a queue - the file is written
+    # from a thread of its own, see app/logs.py. returns the sampler, which
+    # the app has to start at the beginning of each request
+
+    if app.config['LOG_FORMAT'] == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s] [%(pathname)s:%(lineno)d] %(levelname)s - %(message)s")
+    handler = RotatingFileHandler(app.config['LOG_FILENAME'], maxBytes=10000000, backupCount=5)
+    log_level = app.config['LOG_LEVEL']
+
+    if log_level == 'DEBUG': # pragma: no cover
+        app.logger.setLevel(logging.DEBUG) # pragma: no cover
+    elif log_level == 'INFO': # pragma: no cover
+        app.logger.setLevel(logging.INFO) # pragma: no cover
+    elif log_level == 'WARNING': # pragma: no cover
+        app.logger.setLevel(logging.WARNING) # pragma: no cover
+    elif log_level == 'ERROR': # pragma: no cover
+        app.logger.setLevel(logging.ERROR) # pragma: no cover
+    else: # pragma: no cover
+        app.logger.setLevel(logging.CRITICAL) # pragma: no cover
+
+    handler.setFormatter(formatter)
+    sampler = RequestSampler(app.config['LOG_SAMPLE_RATE'],
+                             [endpoint.strip() for endpoint in app.config['LOG_SAMPLE_ENDPOINTS'].split(',')
+                              if endpoint.strip()])
+    install_queue_handler(app.logger, [handler], app.config['LOG_QUEUE_SIZE'], sampler)
+    return sampler
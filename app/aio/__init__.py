@@ -0,0 +1,59 @@
+# app/aio/__init__.py
+from quart import Quart, request
+
+from app import configure_logging
+from app.config import Config
+from app.assertions import compile_schemas
+from app.json_provider import json_provider_class
+from app.extensions import access_cache, count_cache, s3_urls_cache, item_cache, item_layout
+from app.errors import handle_429_request, handle_wrong_method, handle_not_found
+from app.aio.extensions import motor_mongo, http_client, async_compress, async_metrics, async_limiter
+
+# -----------------------------------------------------------------------------
+# async (asgi) version of create_app. serves the same routes and json as the
+# flask app but with motor and httpx so a single worker can have lots of
+# requests waiting on mongo, authy or aws at once. run it with something like
+# 'hypercorn items_asgi:app'
+# -----------------------------------------------------------------------------
+
+def create_async_app(config_class=Config):
+
+    app = Quart(__name__)
+    # set app configs
+    app.config.from_object(config_class)
+    app.json = json_provider_class(app.config['JSON_PROVIDER'])(app)
+
+    # logging stuff. the hook has to be async - quart runs sync ones in a
+    # thread, and what the sampler sets there wouldn't be seen by the view
+    sampler = configure_logging(app)
+
+    @app.before_request
+    async def start_request_log():
+        sampler.start(request)
+
+    # extensions - mongo and http clients are opened when the server starts
+    # so they belong to the server's event loop
+    async_metrics.init_app(app)
+    async_limiter.init_app(app)
+    motor_mongo.init_app(app, event_listeners=async_metrics.event_listeners())
+    http_client.init_app(app)
+    access_cache.init_app(app, 'ACCESS_CACHE')
+    count_cache.init_app(app, 'COUNT_CACHE')
+    s3_urls_cache.init_app(app, 'S3_URLS_CACHE')
+    item_cache.init_app(app, 'ITEM_CACHE')
+    async_compress.init_app(app)
+    item_layout.init_app(app)
+
+    # compile json schema validators up front
+    compile_schemas()
+
+    # blueprints
+    from app.aio.views import bp as aio_bp
+    app.register_blueprint(aio_bp)
+
+    # register custom errors
+    app.register_error_handler(429, handle_429_request)
+    app.register_error_handler(405, handle_wrong_method)
+    app.register_error_handler(404, handle_not_found)
+
+    return app
@@ -0,0 +1,44 @@
+# app/aio/decorators.py
+from app.aio.services import call_requests
+from app.extensions import access_cache
+from app.decorators import access_cache_key, access_result, access_url, access_headers
+from functools import wraps
+from quart import jsonify, g
+
+# -----------------------------------------------------------------------------
+# async version of app/decorators.py - shares the same access cache
+# -----------------------------------------------------------------------------
+
+def require_access_level(access_level,request): # pragma: no cover
+    def actual_decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+
+            token = request.headers.get('x-access-token')
+
+            if not token:
+                return jsonify({ 'message': 'Naughty one!'}), 401
+
+            pub_id, message, status = await check_access(token, access_level)
+
+            if pub_id is None:
+                return jsonify({ 'message': message}), status
+
+            # for per user rate limits
+            g.public_id = pub_id
+            return await f(pub_id, request, *args, **kwargs)
+
+        return decorated
+    return actual_decorator
+
+# -----------------------------------------------------------------------------
+
+async def check_access(token, access_level):
+
+    key = access_cache_key(token, access_level)
+    cached = access_cache.get(key)
+    if cached is not None:
+        return cached
+
+    r = await call_requests(access_url(access_level), access_headers(token))
+    return access_result(key, r)
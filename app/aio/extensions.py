@@ -0,0 +1,192 @@
+# app/aio/extensions.py
+import httpx
+import logging
+import time
+from functools import wraps
+from limits import parse_many
+from limits.storage import storage_from_string
+from limits.aio.strategies import FixedWindowRateLimiter
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import request, g, abort
+from quart.wrappers.response import DataBody, IterableBody
+from app.compression import Compress, compress_bytes, compress_chunks_async
+from app.metrics import Metrics, observe_request, route_label
+from app.ratelimit import DEFAULT_RATE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# set up motor - the async counterpart of flask_pymongo's PyMongo
+
+class MotorMongo(object):
+
+    def __init__(self):
+        self.cx = None
+        self.db = None
+
+    def init_app(self, app, **kwargs):
+        # kwargs go to the client
+
+        @app.before_serving
+        async def open_mongo():
+            self.cx = AsyncIOMotorClient(app.config['MONGO_URI'], **kwargs)
+            self.db = self.cx.get_default_database()
+
+        @app.after_serving
+        async def close_mongo():
+            self.cx.close()
+
+motor_mongo = MotorMongo()
+
+# -----------------------------------------------------------------------------
+# set up a pooled async http client for calls to authy and aws
+
+class HttpClient(object):
+
+    def __init__(self):
+        self.client = None
+
+    def init_app(self, app):
+
+        @app.before_serving
+        async def open_client():
+            limits = httpx.Limits(max_connections=int(app.config['HTTP_POOL_MAXSIZE']),
+                                  max_keepalive_connections=int(app.config['HTTP_POOL_MAXSIZE']))
+            timeout = httpx.Timeout(float(app.config['HTTP_READ_TIMEOUT']),
+                                    connect=float(app.config['HTTP_CONNECT_TIMEOUT']))
+            # transport retries only cover failed connects, which are always
+            # safe to retry
+            transport = httpx.AsyncHTTPTransport(retries=int(app.config['HTTP_RETRIES']),
+                                                 limits=limits)
+            self.client = httpx.AsyncClient(timeout=timeout, transport=transport)
+
+        @app.after_serving
+        async def close_client():
+            await self.client.aclose()
+
+http_client = HttpClient()
+
+# -----------------------------------------------------------------------------
+# response compression - same rules as app/compression.py but quart bodies
+# have to be read and replaced asynchronously
+
+class AsyncCompress(Compress):
+
+    async def after_request(self, response):
+        encoding = self.choose_encoding(request, response)
+        if encoding is None:
+            return response
+
+        level = self.levels[encoding]
+        if isinstance(response.response, IterableBody):
+            response.response = IterableBody(compress_chunks_async(encoding, level, response.response))
+            response.headers.pop('Content-Length', None)
+        elif isinstance(response.response, DataBody):
+            data = await response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress_bytes(encoding, level, data))
+        else:
+            # files - leave them be
+            return response
+
+        return self.encoded(response, encoding)
+
+async_compress = AsyncCompress()
+
+# -----------------------------------------------------------------------------
+# request metrics - same as app/metrics.py with quart's request and g
+
+class AsyncMetrics(Metrics):
+
+    async def before_request(self):
+        g.metrics_started = time.perf_counter()
+
+    async def after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            observe_request(request.method, route_label(request), response.status_code,
+                            time.perf_counter() - started)
+        return response
+
+async_metrics = AsyncMetrics()
+
+# -----------------------------------------------------------------------------
+# rate limiting - the same limits flask-limiter puts on the flask app, keyed
+# the same way (per ip, or per user once require_access_level has let them
+# in). the defaults are checked per route before every request and the
+# RATE_LIMIT_* ones by limit() on the routes that have them. the counts are
+# kept with limits' async storage so a hit never blocks the loop.
+# RATELIMIT_STORAGE_URI is read as for the flask app, but batched+ storage
+# is flask only - here every hit goes straight to the store under it
+
+def async_rate_limit_key():
+    public_id = g.get('public_id')
+    if public_id is not None:
+        return 'user:' + public_id
+    return 'ip:' + (request.remote_addr or '127.0.0.1')
+
+
+def async_storage_uri(uri):
+    # i.e. batched+mongodb://host -> async+mongodb://host
+    if uri.startswith('batched+'):
+        uri = uri.split('+', 1)[1]
+    if not uri.startswith('async+'):
+        uri = 'async+' + uri
+    return uri
+
+
+def async_storage_options(options):
+    # RATELIMIT_STORAGE_OPTIONS less the batched storage's own settings
+    return {key: value for key, value in options.items() if key not in ('sync_batch', 'sync_interval')}
+
+
+class AsyncLimiter(object):
+
+    def __init__(self, key_func, default_limits=()):
+        self.key_func = key_func
+        self.default_limits = list(default_limits)
+        self.swallow_errors = False
+        self.strategy = None
+
+    def init_app(self, app):
+        self.swallow_errors = app.config.get('RATELIMIT_SWALLOW_ERRORS', False)
+        uri = async_storage_uri(app.config.get('RATELIMIT_STORAGE_URI', 'memory://'))
+        options = async_storage_options(app.config.get('RATELIMIT_STORAGE_OPTIONS', {}))
+
+        # opened when the server starts so it belongs to the server's loop
+        @app.before_serving
+        async def open_storage():
+            self.strategy = FixedWindowRateLimiter(storage_from_string(uri, **options))
+
+        @app.before_request
+        async def check_default_limits():
+            if request.endpoint is not None:
+                for limit_value in self.default_limits:
+                    await self.check(limit_value)
+
+    def limit(self, limit_value):
+        # limit_value is a callable that returns the limit, i.e. '60 per minute'
+        def actual_decorator(f):
+            @wraps(f)
+            async def decorated(*args, **kwargs):
+                await self.check(limit_value())
+                return await f(*args, **kwargs)
+            return decorated
+        return actual_decorator
+
+    async def check(self, limit_value):
+        # 429s if any of the limits is used up for this caller on this route
+        key = self.key_func()
+        for item in parse_many(limit_value):
+            try:
+                allowed = await self.strategy.hit(item, key, request.endpoint)
+            except Exception as e:
+                if not self.swallow_errors:
+                    raise
+                logger.warning("Rate limit storage failed [%s]", str(e))
+                return
+            if not allowed:
+                abort(429)
+
+async_limiter = AsyncLimiter(async_rate_limit_key, DEFAULT_RATE_LIMITS)
@@ -0,0 +1,56 @@
+# app/aio/services.py
+import asyncio
+import httpx
+import json
+import time
+from quart import current_app as app
+from app.aio.extensions import http_client
+from app.metrics import observe_outbound
+
+# -----------------------------------------------------------------------------
+# async versions of app/services.py. same rules - gets are retried with
+# backoff, posts are not and failures come back as None
+# -----------------------------------------------------------------------------
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+async def call_requests(url, headers, service='auth'):
+
+    retries = int(app.config['HTTP_RETRIES'])
+    backoff = float(app.config['HTTP_BACKOFF'])
+    started = time.perf_counter()
+    r = None
+
+    for attempt in range(retries + 1):
+        try:
+            r = await http_client.client.get(url, headers=headers)
+        except httpx.HTTPError as err:
+            app.logger.error("Error calling [%s]: %s", url, str(err))
+            r = None
+        if r is not None and r.status_code not in RETRY_STATUSES:
+            break
+        if attempt < retries:
+            await asyncio.sleep(backoff * (2 ** attempt))
+
+    # retries and all - the same as the requests version
+    observe_outbound(service, started, r)
+    return r
+
+# -----------------------------------------------------------------------------
+
+async def get_s3_urls(foto_ids, token):
+
+    headers = { 'Content-Type': 'application/json', 'x-access-token': token }
+    url = app.config['AWS_S3_URL']
+
+    started = time.perf_counter()
+    try:
+        r = await http_client.client.post(url, content=json.dumps({'objects': foto_ids}),
+                                          headers=headers)
+    except httpx.HTTPError as err:
+        app.logger.error(str(err))
+        r = None
+
+    observe_outbound('s3', started, r)
+    return r
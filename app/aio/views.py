@@ -0,0 +1,819 @@
+# app/aio/views.py
+from app.aio.extensions import motor_mongo as mongo, async_metrics, async_limiter as limiter
+from app.extensions import count_cache, s3_urls_cache, item_cache, item_layout
+from quart import Blueprint, jsonify, request, abort, stream_with_context
+from quart import current_app as app
+from app.assertions import assert_valid_schema
+from app.aio.decorators import require_access_level
+from app.aio.services import get_s3_urls
+from app.layout import item_value
+from app.metrics import metrics_output, observe_events_deferred
+from app.sampling import sample_category_async, new_random_key
+from app.events import EVENTS, CREATED, UPDATED, DELETED, new_marker, marked, with_marker, delete_request, carrying, \
+    live, relay_events_async, parse_feed_args, token_expired, feed_query, feed_line
+from app.main.helpers import SORT_DIRECTIONS, reshape_item, format_document, valid_category, \
+    parse_page_args, offset_page_links, cursor_page_query, cursor_page_result, \
+    new_foto_ids, bucket_url, s3_urls_from, created_response, remember_s3_urls, \
+    prepare_bulk_items, bulk_write_failures, bulk_create_response, \
+    chunked, order_by_request, stream_chunk, stream_tail, \
+    utcnow_ms, item_etag, bulk_etag, item_validators, not_modified, is_conditional, if_match_dates, \
+    parse_fields, fields_arg, item_projection, \
+    parse_search_args, search_pipeline, search_page_result, \
+    prepare_bulk_updates, bulk_update_requests, bulk_update_response, bulk_delete_response, \
+    owned_filter, put_update, patch_updates, edit_failure
+from jsonschema.exceptions import ValidationError as JsonValidationError
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+import asyncio
+import uuid
+import datetime
+import time
+import os
+
+# -----------------------------------------------------------------------------
+# async copy of app/main/views.py. keep the two in step - anything that
+# doesn't do i/o belongs in app/main/helpers.py so it's only written once
+# -----------------------------------------------------------------------------
+
+bp = Blueprint('aio', __name__)
+
+# presign requests still running after we've responded - asyncio only keeps
+# weak references to tasks so we hang on to them here
+_background_tasks = set()
+
+# --------------------------------------------------------------------------- #
+
+
+# reject any non-json requests - bar the metrics, which prometheus scrapes
+# as plain text
+@bp.before_request
+async def only_json():
+    if not request.is_json and request.endpoint != 'aio.get_metrics':
+        abort(400)
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items', methods=['POST'])
+@require_access_level(10, request)
+@limiter.limit(lambda: app.config['RATE_LIMIT_CREATE'])
+async def create_item(public_id, request):
+
+    app.logger.debug("In create_item")
+
+    # validate input against json schemas
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'item')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    item_id = str(uuid.uuid4())
+    data['public_id'] = public_id
+    data['created'] = datetime.datetime.utcnow()
+    data['modified'] = datetime.datetime.utcnow()
+
+    # ask aws for the upload urls while we do the insert
+    token = request.headers.get('x-access-token')
+    foto_ids = new_foto_ids(app.config['FOTO_LIMIT'])
+    s3_task = asyncio.ensure_future(get_s3_urls(foto_ids, token))
+
+    marker = _marker(CREATED, public_id)
+    try:
+        await mongo.db.items.insert_one(marked(item_layout.stored(item_id, data, new_random_key()), marker))
+    except Exception as e:
+        app.logger.error(e)
+        s3_task.cancel()
+        return jsonify({'message': 'unable to insert'}), 500
+
+    count_cache.delete(public_id)
+    await _relay_events([(item_id, marker)])
+
+    s3_urls = await _wait_for_s3_urls(item_id, s3_task)
+
+    return jsonify(created_response(item_id, public_id, s3_urls)), 201
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/bulk', methods=['POST'])
+@require_access_level(10, request)
+@limiter.limit(lambda: app.config['RATE_LIMIT_BULK_CREATE'])
+async def create_items(public_id, request):
+
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'bulk_create')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    max_items = int(app.config['BULK_CREATE_LIMIT'])
+    if len(data['items']) > max_items:
+        return jsonify({'message': 'Too many items, the most you can send is '+str(max_items)}), 400
+
+    results, docs = prepare_bulk_items(data['items'], public_id)
+    if len(docs) == 0:
+        return jsonify({'message': 'Check ya inputs mate.', 'items': results}), 400
+
+    token = request.headers.get('x-access-token')
+    foto_ids = new_foto_ids(int(app.config['FOTO_LIMIT']) * len(docs))
+    s3_task = asyncio.ensure_future(get_s3_urls(foto_ids, token))
+
+    markers = [_marker(CREATED, public_id) for doc in docs]
+    failures = {}
+    try:
+        await mongo.db.items.insert_many([marked(doc, marker) for (index, doc), marker in zip(docs, markers)],
+                                         ordered=False)
+    except BulkWriteError as err:
+        failures = bulk_write_failures(err)
+        app.logger.error("Bulk insert failed for [%d] items", len(failures))
+    except Exception as e:
+        app.logger.error(e)
+        s3_task.cancel()
+        return jsonify({'message': 'unable to insert'}), 500
+
+    count_cache.delete(public_id)
+    await _relay_events([(doc['_id'], marker) for position, ((index, doc), marker) in enumerate(zip(docs, markers))
+                         if position not in failures])
+
+    s3_urls = await _wait_for_s3_urls(None, s3_task)
+
+    return_data, status = bulk_create_response(results, docs, failures, s3_urls,
+                                               app.config['FOTO_LIMIT'], public_id)
+    return jsonify(return_data), status
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/bulk/update', methods=['POST'])
+@require_access_level(10, request)
+@limiter.limit(lambda: app.config['RATE_LIMIT_BULK_UPDATE'])
+async def update_items(public_id, request):
+
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'bulk_update')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    max_items = int(app.config['BULK_UPDATE_LIMIT'])
+    if len(data['items']) > max_items:
+        return jsonify({'message': 'Too many items, the most you can send is '+str(max_items)}), 400
+
+    modified = utcnow_ms()
+    results, updates = prepare_bulk_updates(data['items'], public_id, modified)
+    if len(updates) == 0:
+        return jsonify({'message': 'Check ya inputs mate.', 'items': results}), 400
+
+    markers = {item_id: _marker(UPDATED, public_id) for index, item_id, item, query in updates}
+    current = None
+    failures = {}
+    try:
+        try:
+            result = await mongo.db.items.bulk_write(bulk_update_requests(updates, markers), ordered=False)
+            matched = result.matched_count
+        except BulkWriteError as err:
+            failures = bulk_write_failures(err)
+            app.logger.error("Bulk update failed for [%d] items", len(failures))
+            matched = err.details.get('nMatched', 0)
+        if matched + len(failures) < len(updates):
+            current = await _owner_and_modified([item_id for index, item_id, item, query in updates])
+    except Exception as e:
+        app.logger.error("Error updating items [%s]", e)
+        return jsonify({'message': 'Unable to save items to db'}), 500
+
+    for index, item_id, item, query in updates:
+        await item_cache.delete_async(item_id)
+
+    return_data, status, updated = bulk_update_response(results, updates, current, public_id, modified,
+                                                                failures)
+    await _relay_events([(item_id, markers[item_id]) for item_id in updated])
+    return jsonify(return_data), status
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/bulk/delete', methods=['POST'])
+@require_access_level(10, request)
+@limiter.limit(lambda: app.config['RATE_LIMIT_BULK_DELETE'])
+async def delete_items(public_id, request):
+
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'bulk_delete')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    item_ids = data['item_ids']
+    max_items = int(app.config['BULK_DELETE_LIMIT'])
+    if len(item_ids) == 0 or len(item_ids) > max_items:
+        return jsonify({'message': 'Send between 1 and '+str(max_items)+' item_ids'}), 400
+
+    # one unordered write for the items that are ours. if it deleted as many
+    # as we sent they're all ours, otherwise another request got to some
+    # first and we have to look which
+    deleted = []
+    failures = {}
+    try:
+        owned = await _owned_ids(item_ids, public_id)
+        markers = {item_id: _marker(DELETED, public_id) for item_id in owned}
+        owner = item_layout.match('public_id', public_id)
+        requests = [delete_request({'$and': [{'_id': item_id}, owner]}, markers[item_id]) for item_id in owned]
+        try:
+            result = (await mongo.db.items.bulk_write(requests, ordered=False)).bulk_api_result if requests else {}
+        except BulkWriteError as err:
+            failures = {owned[position]: message for position, message in bulk_write_failures(err).items()}
+            app.logger.error("Bulk delete failed for [%d] items", len(failures))
+            result = err.details
+        if result.get('nRemoved', 0) + result.get('nModified', 0) == len(owned):
+            deleted = owned
+        elif owned:
+            deleted = await _deleted_by_us(owned, markers)
+    except Exception as e:
+        app.logger.error("Error deleting items [%s]", e)
+        return jsonify({'message': 'Unable to delete items'}), 500
+
+    if deleted:
+        count_cache.delete(public_id)
+    for item_id in deleted:
+        await item_cache.delete_async(item_id)
+    await _relay_events([(item_id, markers[item_id]) for item_id in deleted])
+
+    return_data, status = bulk_delete_response(item_ids, set(deleted), failures)
+    return jsonify(return_data), status
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/bulk/fetch', methods=['POST'])
+@limiter.limit(lambda: app.config['RATE_LIMIT_BULK_FETCH'])
+async def fetch_items():
+
+    # validate input against json schemas
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'bulk_items')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    try:
+        fields = parse_fields(data['fields'], app.config['ITEM_FIELDS']) if 'fields' in data else None
+    except ValueError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': str(err)}), 400
+
+    item_ids = data['item_ids']
+    batch_size = int(app.config['BULK_FETCH_BATCH_SIZE'])
+    headers = {}
+
+    if request.if_none_match:
+        try:
+            etag = bulk_etag(item_ids, await _modified_by_id(item_ids, batch_size), fields)
+        except Exception as e:
+            app.logger.error("Error fetching doc [%s]", str(e))
+            return jsonify({'message': 'something went bang, sorry'}), 500
+        headers['ETag'] = '"'+etag+'"'
+        if not_modified(request, etag):
+            return '', 304, headers
+
+    if len(item_ids) > int(app.config['BULK_FETCH_MAX']) or request.args.get('stream') == '1':
+        # quart's stream_with_context grabs the request context when it's
+        # called so it has to be wrapped here rather than used as a decorator
+        stream = stream_with_context(_stream_items)(item_ids, batch_size, fields)
+        headers['Content-Type'] = 'application/json'
+        return stream, 200, headers
+
+    try:
+        # modified is always fetched for the etag
+        results = await mongo.db.items.find(live({'_id': {'$in': item_ids}}), item_projection(fields, 'modified')) \
+                                      .to_list(length=None)
+        output, missing = order_by_request(item_ids, results, fields)
+    except Exception as e:
+        app.logger.error("Error fetching doc [%s]", str(e))
+        return jsonify({'message': 'something went bang, sorry'}), 500
+
+    modified_by_id = {record['_id']: item_value(record, 'modified') for record in results}
+    headers['ETag'] = '"'+bulk_etag(item_ids, modified_by_id, fields)+'"'
+
+    return jsonify({'items': output, 'missing': missing}), 200, headers
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/<uuid:item_id>', methods=['GET'])
+async def get_item(item_id):
+
+    item_id = str(item_id)
+
+    try:
+        fields = fields_arg(request.args, app.config['ITEM_FIELDS'])
+    except ValueError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': str(err)}), 400
+
+    # polling clients - only the modified date is needed to say nowt's changed
+    if is_conditional(request):
+        modified = await _item_modified(item_id)
+        if modified is not None and not_modified(request, item_etag(modified, fields), modified):
+            return '', 304, item_validators(modified, fields)
+
+    record = await _find_document(item_id, fields)
+
+    if isinstance(record, dict):
+        return jsonify(format_document(record, fields)), 200, \
+               item_validators(item_value(record, 'modified'), fields)
+
+    mess = {'message': 'Could not find the item ['+item_id+']'}
+
+    return jsonify(mess), 404
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items', methods=['GET'])
+@require_access_level(10, request)
+async def get_items_by_user(public_id, request):
+
+    try:
+        offset, limit, sort, cursor = parse_page_args(request.args, app.config['PAGE_LIMIT'])
+    except Exception as e:
+        app.logger.error("Error: [%s]", e)
+        return jsonify({'message': 'Problem with your args'}), 400
+
+    if limit < 1 or sort not in SORT_DIRECTIONS:
+        return jsonify({'message': 'Problem with your args'}), 400
+
+    try:
+        fields = fields_arg(request.args, app.config['ITEM_FIELDS'])
+    except ValueError as err:
+        return jsonify({'message': 'Problem with your args', 'error': str(err)}), 400
+
+    if offset is not None and offset < 0:
+        return jsonify({'message': 'offset cannot be negative'}), 400
+
+    if offset is not None:
+        return_data = await _page_by_offset(public_id, offset, limit, sort, fields)
+    else:
+        return_data = await _page_by_cursor(public_id, cursor, limit, sort, fields)
+
+    if return_data is None:
+        return jsonify({'message': 'There\'s a problem with your arguments or the planets are misaligned. try sacrificing a goat or something...'}), 400
+
+    if len(return_data['items']) == 0:
+        return jsonify({'message': 'Nowt ere chap'}), 404
+
+    if request.args.get('count') in ('1', 'true'):
+        total = await _count_items_by_user(public_id)
+        if total is not None:
+            return_data['total_count'] = total
+
+    return jsonify(return_data), 200
+
+# --------------------------------------------------------------------------- #
+# brings back a random selection of items by category
+
+
+@bp.route('/items/cat/<category>', methods=['GET'])
+async def get_items_by_category(category):
+
+    if not valid_category(category):
+        return jsonify({'message': 'Invalid category'}), 400
+
+    try:
+        fields = fields_arg(request.args, app.config['ITEM_FIELDS'])
+    except ValueError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': str(err)}), 400
+
+    try:
+        items = await sample_category_async(mongo.db.items, category,
+                                            int(app.config['CATEGORY_SAMPLE_SIZE']),
+                                            projection=item_projection(fields))
+    except Exception as e:
+        app.logger.info(e)
+        return jsonify({'message': 'There\'s a problem with your arguments or mongo or both or something else ;)'}), 400
+
+    if len(items) == 0:
+        return jsonify({'message': 'Nowt in that category lass'}), 404
+
+    return jsonify({'items': [reshape_item(item, fields) for item in items]}), 200
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/search', methods=['GET'])
+@limiter.limit(lambda: app.config['RATE_LIMIT_SEARCH'])
+async def search_items():
+
+    try:
+        terms, category, limit, cursor = parse_search_args(request.args, app.config['PAGE_LIMIT'],
+                                                           app.config['SEARCH_MAX_LENGTH'],
+                                                           app.config['SEARCH_MAX_LIMIT'])
+        fields = fields_arg(request.args, app.config['ITEM_FIELDS'])
+    except ValueError as err:
+        return jsonify({'message': 'Problem with your args', 'error': str(err)}), 400
+
+    if category is not None and not valid_category(category):
+        return jsonify({'message': 'Invalid category'}), 400
+
+    try:
+        docs = await mongo.db.items.aggregate(search_pipeline(terms, category, cursor, limit,
+                                                              item_projection(fields))).to_list(length=limit + 1)
+    except Exception as e:
+        app.logger.error("Error searching items [%s]", e)
+        return jsonify({'message': 'Unable to search right now'}), 500
+
+    if len(docs) == 0:
+        return jsonify({'message': 'Nowt matched that'}), 404
+
+    return jsonify(search_page_result(docs, terms, category, limit, fields)), 200
+
+# -----------------------------------------------------------------------------
+
+
+@bp.route('/items/<uuid:item_id>', methods=['PUT'])
+@require_access_level(10, request)
+async def edit_item(public_id, request, item_id):
+
+    # validate input against json schemas
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'item')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    # If-Match turns into part of the update filter so a lost update is
+    # caught by mongo rather than by a read followed by a write
+    expected = if_match_dates(request)
+    if expected is not None and not expected:
+        return jsonify({'message': 'Item has been changed since you fetched it'}), 412
+
+    # the stored created date and the id in the url are kept whatever they send
+    data.pop('created', None)
+    data.pop('item_id', None)
+    data['public_id'] = public_id
+    data['modified'] = utcnow_ms()
+
+    return await _edit_document(str(item_id), public_id, expected, [({}, put_update(data))])
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/<uuid:item_id>', methods=['PATCH'])
+@require_access_level(10, request)
+async def patch_item(public_id, request, item_id):
+
+    # only the fields being changed - null removes one
+    try:
+        data = await request.get_json()
+        assert_valid_schema(data, 'item_patch')
+    except JsonValidationError as err:
+        return jsonify({'message': 'Check ya inputs mate.', 'error': err.message}), 400
+
+    expected = if_match_dates(request)
+    if expected is not None and not expected:
+        return jsonify({'message': 'Item has been changed since you fetched it'}), 412
+
+    return await _edit_document(str(item_id), public_id, expected, patch_updates(data, utcnow_ms()))
+
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/<uuid:item_id>', methods=['DELETE'])
+@require_access_level(10, request)
+async def delete_item(public_id, request, item_id):
+
+    marker = _marker(DELETED, public_id)
+    query = {'$and': [{'_id': str(item_id)}, item_layout.match('public_id', public_id)]}
+    try:
+        del_result = await mongo.db.items.bulk_write([delete_request(query, marker)])
+    except Exception as e:
+        app.logger.error(e)
+        return jsonify({'message': 'Unable to delete item'}), 500
+
+    deleted_count = del_result.deleted_count + del_result.modified_count
+    app.logger.info(deleted_count)
+    count_cache.delete(public_id)
+    await item_cache.delete_async(str(item_id))
+    if deleted_count:
+        await _relay_events([(str(item_id), marker)])
+
+    return jsonify({'deleted_count': deleted_count}), 204
+
+# --------------------------------------------------------------------------- #
+# upload urls for items created without them
+
+
+@bp.route('/items/<uuid:item_id>/s3urls', methods=['GET'])
+@require_access_level(10, request)
+async def get_item_s3_urls(public_id, request, item_id):
+
+    item_id = str(item_id)
+    try:
+        owned = await mongo.db.items.find_one(dict(item_layout.match('public_id', public_id), _id=item_id), {'_id': 1})
+    except Exception as e:
+        app.logger.error("Error fetching doc [%s]", str(e))
+        return jsonify({'message': 'something went bang, sorry'}), 500
+
+    if owned is None:
+        return jsonify({'message': 'Item not found'}), 404
+
+    s3_urls = s3_urls_cache.get(item_id)
+    if s3_urls:
+        s3_urls_cache.delete(item_id)
+    else:
+        r = await get_s3_urls(new_foto_ids(app.config['FOTO_LIMIT']), request.headers.get('x-access-token'))
+        s3_urls = s3_urls_from(r)
+
+    if not s3_urls:
+        return jsonify({'message': 'Unable to get upload urls right now'}), 503
+
+    return jsonify({'item_id': item_id,
+                    'bucket_url': bucket_url(public_id),
+                    's3_urls': s3_urls}), 200
+
+# --------------------------------------------------------------------------- #
+# item change feed
+
+
+@bp.route('/items/events', methods=['GET'])
+async def get_events():
+
+    try:
+        after, after_at, limit, wait = parse_feed_args(request.args, app.config['EVENTS_BATCH_SIZE'],
+                                                       app.config['EVENTS_MAX_WAIT'])
+    except ValueError as err:
+        return jsonify({'message': 'Problem with your args', 'error': str(err)}), 400
+
+    if token_expired(after_at, app.config['EVENTS_RETENTION']):
+        return jsonify({'message': 'Events after that token have gone, resync and start again'}), 410
+
+    stream = stream_with_context(_event_feed)(after, request.args.get('after'), limit, wait)
+    return stream, 200, {'Content-Type': 'application/x-ndjson'}
+
+# --------------------------------------------------------------------------- #
+# system routes
+# --------------------------------------------------------------------------- #
+
+
+@bp.route('/items/status', methods=['GET'])
+async def system_running():
+    app.logger.debug("Logging is working...")
+    return jsonify({'message': 'System running...', 'version': os.getenv('VERSION')}), 200
+
+
+@bp.route('/items/metrics', methods=['GET'])
+async def get_metrics():
+    if not async_metrics.enabled:
+        abort(404)
+    body, content_type = metrics_output()
+    return body, 200, {'Content-Type': content_type}
+
+# --------------------------------------------------------------------------- #
+# debug and helper functions
+# --------------------------------------------------------------------------- #
+
+
+async def _wait_for_s3_urls(item_id, s3_task):
+
+    budget = 0 if app.config['S3_URLS_MODE'] == 'deferred' else float(app.config['S3_URLS_TIME_BUDGET'])
+    try:
+        r = await asyncio.wait_for(asyncio.shield(s3_task), timeout=budget)
+    except asyncio.TimeoutError:
+        app.logger.info("No upload urls within [%ss] for [%s]", budget, item_id)
+        _background_tasks.add(s3_task)
+        s3_task.add_done_callback(_background_tasks.discard)
+        if item_id is not None:
+            s3_task.add_done_callback(lambda t: remember_s3_urls(item_id, t))
+        return []
+    except Exception as e:
+        app.logger.error("Error getting upload urls [%s]", e)
+        return []
+
+    return s3_urls_from(r)
+
+
+async def _item_modified(item_id):
+
+    record = await item_cache.get_async(item_id)
+    if record is None:
+        try:
+            record = await mongo.db.items.find_one(live({'_id': item_id}), item_projection(['modified']))
+        except Exception as e:
+            app.logger.error("Error fetching doc [%s]", str(e))
+            return None
+
+    if record is None:
+        return None
+
+    return item_value(record, 'modified')
+
+
+async def _edit_document(item_id, public_id, expected, updates):
+
+    # one round trip when the edit goes through - updates are tried in turn
+    # until one matches, see patch_updates
+    query = owned_filter(item_id, public_id, expected)
+    marker = _marker(UPDATED, public_id)
+    try:
+        record = None
+        for extra, update in updates:
+            record = await mongo.db.items.find_one_and_update(dict(query, **extra), with_marker(update, marker),
+                                                              return_document=ReturnDocument.AFTER)
+            if record is not None:
+                break
+        if record is None:
+            current = (await _owner_and_modified([item_id])).get(item_id)
+    except Exception as e:
+        app.logger.error("Error editing item [%s]", e)
+        return jsonify({'message': 'Unable to save item to db'}), 500
+
+    await item_cache.delete_async(item_id)
+
+    if record is None:
+        message, status = edit_failure(current, public_id)
+        return jsonify({'message': message}), status
+
+    await _relay_events([(item_id, marker)])
+
+    return jsonify(format_document(record)), 200, item_validators(item_value(record, 'modified'))
+
+
+async def _owner_and_modified(item_ids):
+
+    results = mongo.db.items.find(live({'_id': {'$in': item_ids}}), item_projection(['public_id', 'modified']))
+    return {record['_id']: (item_value(record, 'public_id'), item_value(record, 'modified'))
+            async for record in results}
+
+
+async def _owned_ids(item_ids, public_id):
+
+    results = mongo.db.items.find(live(dict(item_layout.match('public_id', public_id), _id={'$in': item_ids})),
+                                  {'_id': 1})
+    found = {record['_id'] async for record in results}
+    return [item_id for item_id in item_ids if item_id in found]
+
+
+async def _deleted_by_us(owned, markers):
+
+    # our tombstones still have our markers on them. with events off there
+    # are no markers, so all we can go on is which of them have gone
+    if any(markers.values()):
+        results = mongo.db.items.find(carrying(owned, markers.values()), {'_id': 1})
+        found = {record['_id'] async for record in results}
+        return [item_id for item_id in owned if item_id in found]
+    results = mongo.db.items.find(live({'_id': {'$in': owned}}), {'_id': 1})
+    found = {record['_id'] async for record in results}
+    return [item_id for item_id in owned if item_id not in found]
+
+
+async def _modified_by_id(item_ids, batch_size):
+
+    modified_by_id = {}
+    for chunk in chunked(item_ids, batch_size):
+        results = mongo.db.items.find(live({'_id': {'$in': chunk}}), item_projection(['modified']))\
+                                .batch_size(batch_size)
+        async for record in results:
+            modified_by_id[record['_id']] = item_value(record, 'modified')
+
+    return modified_by_id
+
+
+async def _stream_items(item_ids, batch_size, fields=None):
+
+    dumps = app.json.dumps
+    missing = []
+    first = True
+
+    yield '{"items":['
+    try:
+        for chunk in chunked(item_ids, batch_size):
+            results = await mongo.db.items.find(live({'_id': {'$in': chunk}}), item_projection(fields)) \
+                                          .batch_size(batch_size).to_list(length=None)
+            items, chunk_missing = order_by_request(chunk, results, fields)
+            missing.extend(chunk_missing)
+            if items:
+                yield stream_chunk(items, dumps, first)
+                first = False
+    except Exception as e:
+        app.logger.error("Error streaming docs [%s]", str(e))
+        yield stream_tail(missing, dumps, error='something went bang part way through, sorry')
+        return
+
+    yield stream_tail(missing, dumps)
+
+
+async def _page_by_offset(public_id, offset, limit, sort, fields=None):
+
+    try:
+        results = mongo.db.items.find(item_layout.match('public_id', public_id), item_projection(fields))\
+                                .sort('_id', SORT_DIRECTIONS[sort])\
+                                .skip(offset).limit(limit + 1)
+        output = [reshape_item(item, fields) async for item in results]
+    except Exception as e:
+        app.logger.error("Error [%s]", e)
+        return None
+
+    return offset_page_links({'items': output[:limit]}, len(output) > limit, offset, limit, sort, fields)
+
+
+async def _page_by_cursor(public_id, cursor, limit, sort, fields=None):
+
+    query, direction = cursor_page_query(public_id, cursor, sort)
+    try:
+        results = mongo.db.items.find(query, item_projection(fields)).sort('_id', direction).limit(limit + 1)
+        output = [reshape_item(item, fields) async for item in results]
+    except Exception as e:
+        app.logger.error("Error [%s]", e)
+        return None
+
+    return cursor_page_result(output, cursor, limit, sort, fields)
+
+
+async def _count_items_by_user(public_id):
+
+    total = count_cache.get(public_id)
+    if total is not None:
+        return total
+
+    try:
+        total = await mongo.db.items.count_documents(item_layout.match('public_id', public_id))
+    except Exception as e:
+        app.logger.error("Error counting items [%s]", e)
+        return None
+
+    count_cache.set(public_id, total)
+    return total
+
+
+def _marker(op, public_id):
+
+    if not app.config['EVENTS_ENABLED']:
+        return None
+    return new_marker(op, public_id)
+
+
+async def _relay_events(pending):
+
+    pending = [(item_id, marker) for item_id, marker in pending if marker is not None]
+    if not pending:
+        return
+    try:
+        await relay_events_async(mongo.db, pending)
+    except Exception as e:
+        # the markers wait on the items for relay-events - see app/events.py
+        observe_events_deferred(getattr(e, 'count', len(pending)))
+        app.logger.warning("Events for %s left for relay-events [%s]", [item[0] for item in pending], e)
+
+
+async def _event_feed(after, token, limit, wait):
+
+    dumps = app.json.dumps
+    deadline = time.monotonic() + wait
+    sent = False
+
+    while True:
+        try:
+            docs = await mongo.db[EVENTS].find(feed_query(after)).sort('_id', ASCENDING).limit(limit) \
+                                         .to_list(length=limit)
+        except Exception as e:
+            app.logger.error("Error reading events [%s]", e)
+            yield dumps({'error': 'something went bang, sorry', 'resume_token': token}) + '\n'
+            return
+
+        if docs:
+            line, token = feed_line(docs, token, dumps)
+            after = docs[-1]['_id']
+            sent = True
+            yield line
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if len(docs) < limit:
+            await asyncio.sleep(min(float(app.config['EVENTS_POLL_INTERVAL']), remaining))
+
+    if not sent:
+        yield feed_line([], token, dumps)[0]
+
+
+async def _find_document(item_id, fields=None):
+
+    # cached docs are whole so they'll do for any fields
+    record = await item_cache.get_async(item_id)
+    if record is not None:
+        return record
+
+    try:
+        record = await mongo.db.items.find_one(live({'_id': item_id}), item_projection(fields, 'modified'))
+    except Exception as e:
+        app.logger.error("Error fetching doc [%s]", str(e))
+        return False
+
+    if record is None:
+        return False
+
+    # only whole docs go in the cache
+    if fields is None:
+        await item_cache.set_async(item_id, record)
+
+    return record
+
+# --------------------------------------------------------------------------- #
@@ -1,17 +1,62 @@
 import os.path
 import json
-from jsonschema import validate, Draft7Validator
+import re
+import threading
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
 from jsonschema.exceptions import ValidationError as JsonValidationError
 
+SCHEMA_FILES = {'item': 'schemas/item.json',
+                'bulk_items': 'schemas/items_array.json',
+                'bulk_delete': 'schemas/items_delete_array.json',
+                'bulk_create': 'schemas/items_create_array.json',
+                'bulk_update': 'schemas/items_update_array.json',
+                'item_patch': 'schemas/item_patch.json'}
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+
 def assert_valid_schema(data, schema_type):
     # checks whether the given data matches the schema
 
-    if schema_type == 'item':
-        schema = _load_json_schema('schemas/item.json')
-    elif schema_type == 'bulk_items':
-        schema = _load_json_schema('schemas/items_array.json')
+    if schema_type in ('bulk_items', 'bulk_delete') and _bulk_items_fast_check(data, schema_type):
+        return None
+
+    error = validation_error(data, schema_type)
+    if error is not None:
+        raise error
+
+
+def validation_error(data, schema_type):
+    # same as assert_valid_schema but hands back the error (or None) rather
+    # than raising - handy when checking lots of things in one go
+    return best_match(get_validator(schema_type).iter_errors(data))
+
+
+def get_validator(schema_type):
+    # validators are compiled once per process and then reused
+    validator = _validators.get(schema_type)
+    if validator is None:
+        with _validators_lock:
+            validator = _validators.get(schema_type)
+            if validator is None:
+                validator = _compile_validator(schema_type)
+                _validators[schema_type] = validator
+    return validator
+
+
+def compile_schemas():
+    # warm up all the validators - called from create_app so the first
+    # request doesn't have to pay for it
+    for schema_type in SCHEMA_FILES:
+        get_validator(schema_type)
+
 
-    return validate(data, schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+def _compile_validator(schema_type):
+    schema = _load_json_schema(SCHEMA_FILES[schema_type])
+    Draft7Validator.check_schema(schema)
+    return Draft7Validator(schema, format_checker=Draft7Validator.FORMAT_CHECKER)
 
 
 def _load_json_schema(filename):
@@ -20,3 +65,53 @@ def _load_json_schema(filename):
 
     with open(filepath) as schema_file:
         return json.loads(schema_file.read())
+
+# -----------------------------------------------------------------------------
+# fast path for the bulk fetch and delete schemas. the generic validator
+# checks uniqueItems pairwise and runs the pattern through its own regex
+# machinery for every id, which adds up at 100 ids. this does the same checks with a
+# set and a precompiled regex. it only ever says yes - anything it doesn't
+# like goes through the full validator so the error messages are identical
+# -----------------------------------------------------------------------------
+
+_bulk_items_rules = {}
+
+
+def _get_bulk_items_rules(schema_type):
+    if schema_type not in _bulk_items_rules:
+        item_ids = get_validator(schema_type).schema['properties']['item_ids']
+        rules = item_ids['items']
+        _bulk_items_rules[schema_type] = {'min_items': item_ids.get('minItems', 0),
+                                          'max_items': item_ids.get('maxItems'),
+                                          'min_length': rules.get('minLength', 0),
+                                          'max_length': rules.get('maxLength'),
+                                          'pattern': re.compile(rules['pattern'])}
+    return _bulk_items_rules[schema_type]
+
+
+def _bulk_items_fast_check(data, schema_type='bulk_items'):
+    if not isinstance(data, dict) or len(data) != 1 or 'item_ids' not in data:
+        return False
+
+    item_ids = data['item_ids']
+    if not isinstance(item_ids, list):
+        return False
+
+    rules = _get_bulk_items_rules(schema_type)
+    if len(item_ids) < rules['min_items']:
+        return False
+    if rules['max_items'] is not None and len(item_ids) > rules['max_items']:
+        return False
+
+    search = rules['pattern'].search
+    for item_id in item_ids:
+        if type(item_id) is not str:
+            return False
+        if len(item_id) < rules['min_length']:
+            return False
+        if rules['max_length'] is not None and len(item_id) > rules['max_length']:
+            return False
+        if search(item_id) is None:
+            return False
+
+    return len(set(item_ids)) == len(item_ids)
@@ -0,0 +1,273 @@
+# app/cache.py
+from collections import OrderedDict
+import asyncio
+import bson
+import logging
+import threading
+import time
+from app.metrics import cache_lookups
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# small in-process ttl + lru cache. each gunicorn worker gets its own copy so
+# there's no cross process invalidation - only use it for stuff that's ok
+# to be a little bit stale (i.e. for up to ttl seconds)
+# -----------------------------------------------------------------------------
+
+class TTLCache(object):
+
+    def __init__(self, maxsize=1024, ttl=60, negative_ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # prometheus counters, once init_app has given us a name
+        self._lookups = None
+
+    def init_app(self, app, prefix):
+        # pull sizes and ttls from the app config using the given prefix
+        # i.e. ACCESS_CACHE_SIZE, ACCESS_CACHE_TTL, ACCESS_CACHE_NEGATIVE_TTL
+        self.maxsize = int(app.config.get(prefix+'_SIZE', self.maxsize))
+        self.ttl = float(app.config.get(prefix+'_TTL', self.ttl))
+        self.negative_ttl = float(app.config.get(prefix+'_NEGATIVE_TTL', self.negative_ttl))
+        self._lookups = cache_lookups(prefix.lower())
+        self.clear()
+
+    def get(self, key, default=None):
+        now = self._timer()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if self._lookups is not None:
+            self._lookups['miss' if entry is None else 'hit'].inc()
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, negative=False):
+        if self.maxsize <= 0:
+            return
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, self._timer() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': hit_rate(self.hits, self.misses)}
+
+    def __len__(self):
+        return len(self._data)
+
+
+def hit_rate(hits, misses):
+    lookups = hits + misses
+    return hits / lookups if lookups else 0.0
+
+# -----------------------------------------------------------------------------
+# cache shared by every worker (i.e. redis) so entries and invalidations are
+# seen everywhere. the store only needs get(key), set(key, value, ex=seconds)
+# and delete(key) - redis.Redis fits, as does MemoryStore below. values are
+# stored as bson so mongo docs round trip with their dates intact. if the
+# store is down we log it and carry on as if it was a miss
+# -----------------------------------------------------------------------------
+
+class SharedCache(object):
+
+    def __init__(self, store=None, ttl=60, negative_ttl=None, namespace=''):
+        self.store = store
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._lookups = None
+
+    def init_app(self, app, prefix):
+        # PREFIX_URL picks the store, i.e. redis://cache:6379/0 or memory://
+        self.ttl = float(app.config.get(prefix+'_TTL', self.ttl))
+        self.negative_ttl = float(app.config.get(prefix+'_NEGATIVE_TTL', self.negative_ttl))
+        self.namespace = prefix.lower()+':'
+        self._lookups = cache_lookups(prefix.lower())
+        if self.store is None:
+            self.store = store_from_url(app.config.get(prefix+'_URL', 'memory://'))
+        self.clear()
+
+    def get(self, key, default=None):
+        try:
+            raw = self.store.get(self.namespace+key)
+        except Exception as e:
+            logger.warning("Shared cache get failed [%s]", str(e))
+            raw = None
+            self._count('errors')
+        if raw is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return bson.decode(raw)['v']
+
+    def set(self, key, value, negative=False):
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        try:
+            self.store.set(self.namespace+key, bson.encode({'v': value}), ex=max(int(ttl), 1))
+        except Exception as e:
+            logger.warning("Shared cache set failed [%s]", str(e))
+            self._count('errors')
+
+    def delete(self, key):
+        # a failed delete leaves a stale entry for up to ttl seconds
+        try:
+            self.store.delete(self.namespace+key)
+        except Exception as e:
+            logger.error("Shared cache delete failed [%s]", str(e))
+            self._count('errors')
+
+    def clear(self):
+        # only resets our own counters - other workers share the entries
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.errors = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'errors': self.errors,
+                    'hit_rate': hit_rate(self.hits, self.misses)}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self._lookups is not None:
+            self._lookups[{'hits': 'hit', 'misses': 'miss', 'errors': 'error'}[counter]].inc()
+
+
+class MemoryStore(object):
+    # in-process stand in for redis - for tests and running locally
+
+    def __init__(self, timer=time.monotonic):
+        self._timer = timer
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self._timer():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ex=None):
+        expires = self._timer() + ex if ex else float('inf')
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def store_from_url(url):
+    if url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis package is needed for a shared cache at ["+url+"]")
+        return redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+    raise ValueError("Unknown shared cache url ["+url+"]")
+
+# -----------------------------------------------------------------------------
+# a cache whose backend is picked from the config when the app starts up, so
+# views can import it as a module level object like the other extensions.
+# PREFIX_BACKEND is 'local' (TTLCache), 'shared' (SharedCache) or 'none'.
+# the async app uses the *_async methods - a shared store's client blocks
+# (redis.Redis), so its calls are run in a thread rather than on the loop
+# -----------------------------------------------------------------------------
+
+class PluggableCache(object):
+
+    def __init__(self):
+        self.backend = TTLCache(maxsize=0)
+
+    def init_app(self, app, prefix):
+        backend = app.config.get(prefix+'_BACKEND', 'local')
+        if backend == 'none':
+            self.backend = TTLCache(maxsize=0)
+            return
+        if backend == 'local':
+            self.backend = TTLCache()
+        elif backend == 'shared':
+            self.backend = SharedCache()
+        else:
+            raise ValueError("Unknown "+prefix+"_BACKEND ["+backend+"]")
+        self.backend.init_app(app, prefix)
+
+    def get(self, key, default=None):
+        return self.backend.get(key, default)
+
+    def set(self, key, value, negative=False):
+        self.backend.set(key, value, negative=negative)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+    async def get_async(self, key, default=None):
+        if isinstance(self.backend, SharedCache):
+            return await asyncio.to_thread(self.backend.get, key, default)
+        return self.backend.get(key, default)
+
+    async def set_async(self, key, value, negative=False):
+        if isinstance(self.backend, SharedCache):
+            await asyncio.to_thread(self.backend.set, key, value, negative)
+        else:
+            self.backend.set(key, value, negative=negative)
+
+    async def delete_async(self, key):
+        if isinstance(self.backend, SharedCache):
+            await asyncio.to_thread(self.backend.delete, key)
+        else:
+            self.backend.delete(key)
@@ -0,0 +1,136 @@
+# app/compression.py
+import zlib
+from flask import request
+
+try:
+    import zstandard
+except ImportError: # pragma: no cover
+    zstandard = None
+
+# -----------------------------------------------------------------------------
+# response compression picked from the client's Accept-Encoding. gzip always
+# works, zstd as well if the zstandard package is installed - it's a lot
+# quicker than gzip for about the same size. streamed responses are
+# compressed a chunk at a time and flushed after each chunk so the client
+# still gets them as they're written
+# -----------------------------------------------------------------------------
+
+class GzipCodec(object):
+
+    def __init__(self, level):
+        # wbits of 31 gets us a gzip header rather than a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class ZstdCodec(object):
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+CODECS = {'gzip': GzipCodec}
+if zstandard is not None:
+    CODECS['zstd'] = ZstdCodec
+
+
+def compress_bytes(encoding, level, data):
+    codec = CODECS[encoding](level)
+    return codec.compress(data) + codec.finish()
+
+
+def compress_chunks(encoding, level, chunks):
+    codec = CODECS[encoding](level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = codec.compress(chunk) + codec.flush()
+        if data:
+            yield data
+    yield codec.finish()
+
+
+async def compress_chunks_async(encoding, level, chunks):
+    codec = CODECS[encoding](level)
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = codec.compress(chunk) + codec.flush()
+        if data:
+            yield data
+    yield codec.finish()
+
+
+class Compress(object):
+
+    def __init__(self):
+        self.encodings = []
+        self.levels = {}
+        self.min_size = 500
+        self.mimetypes = set()
+
+    def init_app(self, app):
+        # COMPRESS_ALGORITHMS is in order of preference. anything we don't
+        # have a codec for is quietly dropped
+        wanted = [encoding.strip() for encoding in app.config.get('COMPRESS_ALGORITHMS', 'zstd,gzip').split(',')]
+        self.encodings = [encoding for encoding in wanted if encoding in CODECS]
+        self.levels = {'gzip': int(app.config.get('COMPRESS_LEVEL', 4)),
+                       'zstd': int(app.config.get('COMPRESS_ZSTD_LEVEL', 3))}
+        self.min_size = int(app.config.get('COMPRESS_MIN_SIZE', 500))
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', 'application/json').split(','))
+        if self.encodings:
+            app.after_request(self.after_request)
+
+    def choose_encoding(self, request, response):
+        # None if this response shouldn't be compressed
+        if response.mimetype not in self.mimetypes:
+            return None
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return None
+        if 'Content-Encoding' in response.headers:
+            return None
+        return request.accept_encodings.best_match(self.encodings)
+
+    def encoded(self, response, encoding):
+        response.headers['Content-Encoding'] = encoding
+        # the bytes differ from the uncompressed ones so the etag can't be
+        # strong anymore. If-None-Match uses weak comparison so 304s still work
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def after_request(self, response):
+        encoding = self.choose_encoding(request, response)
+        if encoding is None or response.direct_passthrough:
+            return response
+
+        level = self.levels[encoding]
+        if response.is_streamed:
+            response.response = compress_chunks(encoding, level, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress_bytes(encoding, level, data))
+
+        return self.encoded(response, encoding)
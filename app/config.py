@@ -10,15 +10,118 @@ class Config(object):
     CHECK_ACCESS_URL = os.getenv('CHECK_ACCESS_URL')
     LOG_FILENAME = os.getenv('LOG_FILENAME')
     LOG_LEVEL = os.getenv('LOG_LEVEL')
+    # json lines or the old text format
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    # records waiting to be written before new ones get dropped
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    # share of requests to LOG_SAMPLE_ENDPOINTS (comma separated view names,
+    # i.e. get_item,fetch_items) whose debug and info lines are kept
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+    LOG_SAMPLE_ENDPOINTS = os.getenv('LOG_SAMPLE_ENDPOINTS', '')
     FERNET_KEY = os.getenv('FERNET_KEY')
     MONGO_URI = os.getenv('MONGO_URI')
+    # connections each worker opens up front - see warm_up in app/__init__.py
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 2))
     PAGE_LIMIT = os.getenv('PAGE_LIMIT')
     FOTO_LIMIT = os.getenv('FOTO_LIMIT')
     AWS_S3_URL = os.getenv('AWS_S3_URL')
     FOTOS_URL = os.getenv('FOTOS_URL')
+    BULK_CREATE_LIMIT = int(os.getenv('BULK_CREATE_LIMIT', 100))
+    BULK_UPDATE_LIMIT = int(os.getenv('BULK_UPDATE_LIMIT', 100))
+    BULK_DELETE_LIMIT = int(os.getenv('BULK_DELETE_LIMIT', 100))
+    BULK_FETCH_MAX = int(os.getenv('BULK_FETCH_MAX', 100))
+    BULK_FETCH_BATCH_SIZE = int(os.getenv('BULK_FETCH_BATCH_SIZE', 500))
+    CATEGORY_SAMPLE_SIZE = int(os.getenv('CATEGORY_SAMPLE_SIZE', 20))
+    # longest search terms we'll take for GET /items/search
+    SEARCH_MAX_LENGTH = int(os.getenv('SEARCH_MAX_LENGTH', 100))
+    # most results a search page can ask for with ?limit=
+    SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 50))
+    # fields clients can pick with ?fields=
+    ITEM_FIELDS = os.getenv('ITEM_FIELDS', 'name,description,category,price,public_id,created,modified')
+    # 'orjson' or 'std' - see app/json_provider.py
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'orjson')
+    # 'nested', 'dual' or 'flat' item docs - see app/layout.py
+    ITEM_LAYOUT = os.getenv('ITEM_LAYOUT', 'nested')
+    CHECK_INDEXES_ON_STARTUP = os.getenv('CHECK_INDEXES_ON_STARTUP', 'false').lower() == 'true'
+    # rate limits - see app/ratelimit.py. RATELIMIT_* are flask-limiter's own.
+    # only the batched storage takes the sync settings. the async app reads
+    # RATELIMIT_STORAGE_URI and the mongo options too - see app/aio/extensions.py
+    RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+    # ms to find and connect to a mongo store. errors are swallowed, so a
+    # dead store should cost a request this rather than pymongo's 30s default
+    RATELIMIT_STORAGE_TIMEOUT = int(os.getenv('RATELIMIT_STORAGE_TIMEOUT', 500))
+    RATELIMIT_STORAGE_OPTIONS = dict(
+        {'serverSelectionTimeoutMS': RATELIMIT_STORAGE_TIMEOUT, 'connectTimeoutMS': RATELIMIT_STORAGE_TIMEOUT}
+        if 'mongodb' in RATELIMIT_STORAGE_URI else {},
+        **({'sync_batch': int(os.getenv('RATELIMIT_SYNC_BATCH', 10)),
+            'sync_interval': float(os.getenv('RATELIMIT_SYNC_INTERVAL', 1))}
+           if RATELIMIT_STORAGE_URI.startswith('batched+') else {}))
+    RATELIMIT_STRATEGY = 'fixed-window'
+    # let requests through rather than 500 if the shared storage is down
+    RATELIMIT_SWALLOW_ERRORS = True
+    RATE_LIMIT_CREATE = os.getenv('RATE_LIMIT_CREATE', '60 per minute')
+    RATE_LIMIT_BULK_CREATE = os.getenv('RATE_LIMIT_BULK_CREATE', '10 per minute')
+    RATE_LIMIT_BULK_UPDATE = os.getenv('RATE_LIMIT_BULK_UPDATE', '30 per minute')
+    RATE_LIMIT_BULK_DELETE = os.getenv('RATE_LIMIT_BULK_DELETE', '30 per minute')
+    RATE_LIMIT_BULK_FETCH = os.getenv('RATE_LIMIT_BULK_FETCH', '120 per minute')
+    RATE_LIMIT_SEARCH = os.getenv('RATE_LIMIT_SEARCH', '120 per minute')
+    # prometheus metrics at /items/metrics - see app/metrics.py
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    # item change events and the feed at /items/events - see app/events.py.
+    # times are in seconds
+    EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', 'true').lower() == 'true'
+    # how old a change's marker has to be before relay-events moves it into
+    # the feed, so it doesn't race the request that made it
+    EVENTS_RELAY_AFTER = float(os.getenv('EVENTS_RELAY_AFTER', 60))
+    EVENTS_RETENTION = int(os.getenv('EVENTS_RETENTION', 7 * 24 * 3600))
+    EVENTS_COMPACT_AFTER = int(os.getenv('EVENTS_COMPACT_AFTER', 3600))
+    EVENTS_BATCH_SIZE = int(os.getenv('EVENTS_BATCH_SIZE', 500))
+    EVENTS_MAX_WAIT = float(os.getenv('EVENTS_MAX_WAIT', 30))
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 0.5))
+    # access token cache - negative results are cached for a shorter time
+    ACCESS_CACHE_SIZE = int(os.getenv('ACCESS_CACHE_SIZE', 10000))
+    ACCESS_CACHE_TTL = float(os.getenv('ACCESS_CACHE_TTL', 60))
+    ACCESS_CACHE_NEGATIVE_TTL = float(os.getenv('ACCESS_CACHE_NEGATIVE_TTL', 5))
+    # per user item counts for GET /items?count=1
+    COUNT_CACHE_SIZE = int(os.getenv('COUNT_CACHE_SIZE', 10000))
+    COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', 30))
+    # single item docs - 'local' (per worker), 'shared' (ITEM_CACHE_URL, i.e.
+    # redis://host:6379/0) or 'none'. writes invalidate, ttl bounds staleness.
+    # a local cache is only cleared in the worker that did the write, so
+    # with more than one worker the others can serve the old (or deleted)
+    # doc, and 304s for it, for up to ITEM_CACHE_TTL. so local is only the
+    # default with a single worker - gunicorn.conf.py and run_asgi.sh set
+    # APP_WORKERS to the number they start
+    ITEM_CACHE_URL = os.getenv('ITEM_CACHE_URL', 'memory://')
+    ITEM_CACHE_BACKEND = os.getenv('ITEM_CACHE_BACKEND',
+                                   'local' if int(os.getenv('APP_WORKERS', 1)) <= 1 else
+                                   'none' if ITEM_CACHE_URL.startswith('memory://') else 'shared')
+    ITEM_CACHE_SIZE = int(os.getenv('ITEM_CACHE_SIZE', 10000))
+    ITEM_CACHE_TTL = float(os.getenv('ITEM_CACHE_TTL', 30))
+    # response compression - COMPRESS_ALGORITHMS is in order of preference,
+    # zstd needs the zstandard package. smaller responses are sent as is
+    COMPRESS_ALGORITHMS = os.getenv('COMPRESS_ALGORITHMS', 'zstd,gzip')
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 4))
+    COMPRESS_ZSTD_LEVEL = int(os.getenv('COMPRESS_ZSTD_LEVEL', 3))
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+    # photo upload urls - 'inline' waits up to S3_URLS_TIME_BUDGET seconds for
+    # them during create_item, 'deferred' never waits
+    S3_URLS_MODE = os.getenv('S3_URLS_MODE', 'inline')
+    S3_URLS_TIME_BUDGET = float(os.getenv('S3_URLS_TIME_BUDGET', 1.5))
+    S3_URLS_CACHE_SIZE = int(os.getenv('S3_URLS_CACHE_SIZE', 1000))
+    S3_URLS_CACHE_TTL = float(os.getenv('S3_URLS_CACHE_TTL', 300))
+    # outbound http - timeouts are in seconds, retries only apply to gets
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 2))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 5))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))
+    HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.1))
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+    OUTBOUND_POOL_SIZE = int(os.getenv('OUTBOUND_POOL_SIZE', 8))
 
 class TestConfig(Config):
     LOG_LEVEL = "DEBUG"
     TESTING = True
     MONGO_URI = os.getenv('MONGO_TEST_URI')
     DEBUG = True
+    CHECK_INDEXES_ON_STARTUP = False
@@ -1,9 +1,11 @@
 # app/decorators.py
 from app.services import call_requests
+from app.extensions import access_cache
 from functools import wraps
+import hashlib
 import os
 from dotenv import load_dotenv
-from flask import jsonify
+from flask import jsonify, g
 from flask import current_app as appy
 
 load_dotenv()
@@ -22,20 +24,70 @@ def require_access_level(access_level,request): # pragma: no cover
             if not token:
                 return jsonify({ 'message': 'Naughty one!'}), 401
 
-            headers = { 'Content-Type': 'application/json', 'x-access-token': token }
-            url = os.getenv('CHECK_ACCESS_URL')+str(access_level)
-            r = call_requests(url, headers)
+            pub_id, message, status = check_access(token, access_level)
 
-            if r.status_code != 200:
-                return jsonify({ 'message': 'Ooh you are naughty!'}), 401
+            if pub_id is None:
+                return jsonify({ 'message': message}), status
 
-            returned_json = r.json()
+            # for per user rate limits
+            g.public_id = pub_id
+            return f(pub_id, request, *args, **kwargs)
 
-            if 'public_id' in returned_json:
-                pub_id = returned_json['public_id']
-                return f(pub_id, request, *args, **kwargs)
+        return decorated
+    return actual_decorator
 
-            return jsonify({ 'message': 'No public_id returned'}), 401
+# -----------------------------------------------------------------------------
+# returns a (public_id, message, status) tuple - public_id is None if access
+# is denied. results are cached against a hash of the token so we only hit authy when
+# the cache misses. denials are cached too but for a much shorter time
 
-        return decorated
-    return actual_decorator 
+def check_access(token, access_level):
+
+    key = access_cache_key(token, access_level)
+    cached = access_cache.get(key)
+    if cached is not None:
+        return cached
+
+    r = call_requests(access_url(access_level), access_headers(token))
+    return access_result(key, r)
+
+
+def access_result(key, r):
+    # works out (and caches) the answer from authy's response. shared with
+    # the async decorators, httpx and requests responses look the same here
+
+    if r is None:
+        # authy is down or too slow - fail fast and don't cache it
+        return None, 'Unable to check access right now', 503
+
+    if r.status_code != 200:
+        result = (None, 'Ooh you are naughty!', 401)
+        # don't cache authy falling over - only a definite no
+        if 400 <= r.status_code < 500:
+            access_cache.set(key, result, negative=True)
+        return result
+
+    returned_json = r.json()
+
+    if 'public_id' in returned_json:
+        result = (returned_json['public_id'], None, 200)
+        access_cache.set(key, result)
+        return result
+
+    result = (None, 'No public_id returned', 401)
+    access_cache.set(key, result, negative=True)
+    return result
+
+# -----------------------------------------------------------------------------
+
+def access_cache_key(token, access_level):
+    # never keep raw tokens in memory longer than we have to
+    return hashlib.sha256((str(access_level)+':'+token).encode('utf-8')).hexdigest()
+
+
+def access_url(access_level):
+    return os.getenv('CHECK_ACCESS_URL')+str(access_level)
+
+
+def access_headers(token):
+    return { 'Content-Type': 'application/json', 'x-access-token': token }
@@ -0,0 +1,310 @@
+# app/events.py
+import asyncio
+import datetime
+import math
+import time
+import uuid
+from pymongo import DESCENDING, DeleteOne, DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.pagination import encode_cursor, decode_cursor, NEXT
+
+# -----------------------------------------------------------------------------
+# item change events for downstream services, so they can follow what's
+# changed instead of re-polling every item.
+#
+# a standalone mongo has no multi doc transactions but a single doc write is
+# atomic, so the outbox lives in the item docs. every create, edit and delete
+# pushes a marker ({id, op, public_id, at}) onto the item's _pending list in
+# the same write that makes the change - the change and its event are saved
+# together or not at all. a delete can't leave a marker on a doc that's
+# gone, so it strips the doc down to a tombstone ({_id, _pending, _deleted})
+# instead. tombstones have no owner or fields so queries on those never find
+# them, and reads by _id skip them with live().
+#
+# the relay then moves markers into item_events and clears them off the
+# items, deleting tombstones that have nothing left pending. each request
+# relays its own markers straight after its write. if that fails, or the
+# process dies first, the markers stay where they are until 'python
+# manage.py relay-events' (run from cron) picks up anything older than
+# EVENTS_RELAY_AFTER. nothing is lost, only late.
+#
+# an event's _id is its number and the feed is a range query on _id from
+# the consumer's resume token. the relay numbers events from the last one in
+# item_events and inserts them in order, so numbers are never skipped - two
+# relays that pick the same number can't both insert it (it's the _id) and
+# the loser goes again with the next one. the feed can hand out everything
+# it finds without waiting on gaps. markers are relayed at least once and
+# the unique index on marker makes a second insert of one a no-op, so each
+# change turns up once. events for one item are in order, bar two requests
+# changing it at the same moment.
+#
+# old events go two ways. the at_ttl index drops anything older than
+# EVENTS_RETENTION - a consumer further behind than that gets a 410 and has
+# to resync. 'python manage.py compact-events' deletes events that are older
+# than EVENTS_COMPACT_AFTER and have a newer event for the same item, so a
+# slow consumer still sees the latest change to every item but not all the
+# ones in between. the newest event is always kept by compaction, and by the
+# ttl index unless the token it would be handed out in has expired anyway,
+# so numbering carries on from where consumers are
+# -----------------------------------------------------------------------------
+
+EVENTS = 'item_events'
+PENDING = '_pending'
+TOMBSTONE = '_deleted'
+EPOCH = datetime.datetime(1970, 1, 1)
+# seconds before retrying a failed relay, doubled each time
+RETRY_DELAY = 0.05
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+
+def new_marker(op, public_id, at=None):
+    return {'id': uuid.uuid4().hex, 'op': op, 'public_id': public_id, 'at': at or datetime.datetime.utcnow()}
+
+
+def with_marker(update, marker):
+    # adds a marker to an update - either operators or a pipeline. None (events
+    # are off) leaves it as it is. $literal stops mongo reading the marker's
+    # values as expressions
+    if marker is None:
+        return update
+    if isinstance(update, list):
+        pending = {'$concatArrays': [{'$ifNull': ['$'+PENDING, []]}, {'$literal': [marker]}]}
+        return update + [{'$set': {PENDING: pending}}]
+    return dict(update, **{'$push': {PENDING: marker}})
+
+
+def marked(doc, marker):
+    # a new item doc with its created marker
+    if marker is not None:
+        doc[PENDING] = [marker]
+    return doc
+
+
+def delete_request(query, marker):
+    # a DeleteOne, or with events on an update that leaves a tombstone for the
+    # relay to delete. either way the result's deleted_count + modified_count
+    # is the number deleted
+    if marker is None:
+        return DeleteOne(query)
+    return UpdateOne(query, with_marker([{'$project': {PENDING: 1}}, {'$set': {TOMBSTONE: True}}], marker))
+
+
+def carrying(item_ids, markers):
+    # those of item_ids that still have one of these markers on them - so
+    # the change was ours, as nothing else relays a request's markers until
+    # EVENTS_RELAY_AFTER has passed
+    return {'_id': {'$in': item_ids}, PENDING+'.id': {'$in': [marker['id'] for marker in markers]}}
+
+
+def live(query):
+    # query plus not being a tombstone, for reads by _id
+    return dict(query, **{TOMBSTONE: {'$exists': False}})
+
+
+def event_docs(pending, last_seq, at):
+    # pending is [(item_id, marker)] and last_seq the number of the last event
+    return [{'_id': last_seq + 1 + index, 'op': marker['op'], 'item_id': item_id,
+             'public_id': marker['public_id'], 'at': at, 'marker': marker['id']}
+            for index, (item_id, marker) in enumerate(pending)]
+
+
+def clear_requests(relayed):
+    # takes relayed markers off their items in one ordered bulk write. an item
+    # with nothing else pending loses its _pending, or if it's a tombstone,
+    # goes altogether
+    ids_by_item = {}
+    for item_id, marker in relayed:
+        ids_by_item.setdefault(item_id, []).append(marker['id'])
+
+    requests = []
+    for item_id, ids in ids_by_item.items():
+        requests.append(UpdateOne({'_id': item_id}, {'$pull': {PENDING: {'id': {'$in': ids}}}}))
+        requests.append(DeleteOne({'_id': item_id, TOMBSTONE: True, PENDING: {'$size': 0}}))
+        requests.append(UpdateOne({'_id': item_id, TOMBSTONE: {'$exists': False}, PENDING: {'$size': 0}},
+                                  {'$unset': {PENDING: ''}}))
+    return requests
+
+
+class EventsNotRelayed(Exception):
+    # some markers are still on their items for relay-events to pick up
+
+    def __init__(self, count, error):
+        super().__init__("%d events not relayed [%s]" % (count, error))
+        self.count = count
+
+
+def _last_seq_query():
+    return {'filter': {}, 'projection': {'_id': 1}, 'sort': [('_id', DESCENDING)]}
+
+
+def _duplicate(err):
+    errors = err.details.get('writeErrors', [])
+    return bool(errors) and errors[0].get('code') == 11000
+
+
+def relay_events(db, pending, attempts=5):
+    # moves pending [(item_id, marker)] into item_events, in that order, and
+    # clears them off the items. returns the events written by this call or
+    # raises EventsNotRelayed. a number someone else got to first or a
+    # marker that's already in the feed is a duplicate key - the first is
+    # tried again straight away with the next number, the second is dropped
+    written, relayed, remaining = [], [], list(pending)
+    error = None
+    for attempt in range(attempts):
+        if not remaining:
+            break
+        last = db[EVENTS].find_one(**_last_seq_query())
+        docs = event_docs(remaining, last['_id'] if last else 0, datetime.datetime.utcnow())
+        try:
+            db[EVENTS].insert_many(docs)
+            written += docs
+            relayed += remaining
+            remaining = []
+            break
+        except BulkWriteError as err:
+            inserted = err.details.get('nInserted', 0)
+            written += docs[:inserted]
+            relayed += remaining[:inserted]
+            remaining = remaining[inserted:]
+            error = err
+            if _duplicate(err):
+                if db[EVENTS].find_one({'marker': remaining[0][1]['id']}, {'_id': 1}) is not None:
+                    relayed.append(remaining.pop(0))
+                continue
+        except PyMongoError as err:
+            error = err
+        time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    if relayed:
+        db.items.bulk_write(clear_requests(relayed))
+    if remaining:
+        raise EventsNotRelayed(len(remaining), error)
+    return written
+
+
+async def relay_events_async(db, pending, attempts=5):
+    # same as above for motor dbs
+    written, relayed, remaining = [], [], list(pending)
+    error = None
+    for attempt in range(attempts):
+        if not remaining:
+            break
+        last = await db[EVENTS].find_one(**_last_seq_query())
+        docs = event_docs(remaining, last['_id'] if last else 0, datetime.datetime.utcnow())
+        try:
+            await db[EVENTS].insert_many(docs)
+            written += docs
+            relayed += remaining
+            remaining = []
+            break
+        except BulkWriteError as err:
+            inserted = err.details.get('nInserted', 0)
+            written += docs[:inserted]
+            relayed += remaining[:inserted]
+            remaining = remaining[inserted:]
+            error = err
+            if _duplicate(err):
+                if await db[EVENTS].find_one({'marker': remaining[0][1]['id']}, {'_id': 1}) is not None:
+                    relayed.append(remaining.pop(0))
+                continue
+        except PyMongoError as err:
+            error = err
+        await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+    if relayed:
+        await db.items.bulk_write(clear_requests(relayed))
+    if remaining:
+        raise EventsNotRelayed(len(remaining), error)
+    return written
+
+
+def pending_markers(collection, before, limit=500):
+    # [(item_id, marker)] for up to limit items with a marker from before
+    # 'before', oldest first. all of an item's markers come along so they
+    # stay in order
+    query = {PENDING: {'$exists': True}, PENDING+'.at': {'$lt': before}}
+    pending = [(doc['_id'], marker) for doc in collection.find(query, {PENDING: 1}).limit(limit)
+               for marker in doc[PENDING]]
+    return sorted(pending, key=lambda entry: entry[1]['at'])
+
+# -----------------------------------------------------------------------------
+# the feed
+# -----------------------------------------------------------------------------
+
+def resume_token(seq, at):
+    # at is when the event was written so we can tell a token that's older
+    # than anything we've kept
+    return encode_cursor({'k': seq, 't': (at - EPOCH) // datetime.timedelta(milliseconds=1), 'd': NEXT})
+
+
+def parse_feed_args(args, batch_size, max_wait):
+    # returns (after, after_at, limit, wait) or raises ValueError. after is
+    # the last event number the consumer has, 0 to start from the oldest
+    # event we've kept
+    after, after_at = 0, None
+    if 'after' in args:
+        token = decode_cursor(args['after'])
+        if not isinstance(token.get('k'), int) or not isinstance(token.get('t'), int):
+            raise ValueError('invalid resume token')
+        after = token['k']
+        after_at = EPOCH + datetime.timedelta(milliseconds=token['t'])
+
+    limit = min(int(args.get('limit', batch_size)), int(batch_size))
+    if limit < 1:
+        raise ValueError("'limit' has to be at least 1")
+
+    # nan gets past both min() and the < 0 check and would hold the
+    # response open forever
+    wait = float(args.get('wait', 0))
+    if not math.isfinite(wait) or wait < 0:
+        raise ValueError("'wait' has to be a number of seconds")
+    wait = min(wait, float(max_wait))
+
+    return after, after_at, limit, wait
+
+
+def token_expired(after_at, retention, now=None):
+    # events after the token may have been dropped by the ttl index
+    if after_at is None:
+        return False
+    now = now or datetime.datetime.utcnow()
+    return after_at < now - datetime.timedelta(seconds=float(retention))
+
+
+def feed_query(after):
+    return {'_id': {'$gt': after}}
+
+
+def feed_line(docs, token, dumps):
+    # one batch of the ndjson feed and the token to carry on from. token is
+    # the one the consumer sent (None if they didn't) for empty batches
+    events = [{'seq': doc['_id'], 'op': doc['op'], 'item_id': doc['item_id'],
+               'public_id': doc['public_id'], 'at': doc['at']} for doc in docs]
+    if docs:
+        token = resume_token(docs[-1]['_id'], docs[-1]['at'])
+    return dumps({'events': events, 'resume_token': token}) + '\n', token
+
+# -----------------------------------------------------------------------------
+# compaction
+# -----------------------------------------------------------------------------
+
+def compact_events(collection, before, batch_size=1000):
+    # deletes events from before 'before' that have a newer event for the
+    # same item. returns the number deleted
+    pipeline = [{'$match': {'at': {'$lt': before}}},
+                {'$group': {'_id': '$item_id', 'last': {'$max': '$_id'}, 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}}]
+
+    deleted = 0
+    requests = []
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        requests.append(DeleteMany({'item_id': group['_id'], '_id': {'$lt': group['last']}}))
+        if len(requests) == batch_size:
+            deleted += collection.bulk_write(requests, ordered=False).deleted_count
+            requests = []
+    if requests:
+        deleted += collection.bulk_write(requests, ordered=False).deleted_count
+    return deleted
@@ -1,14 +1,19 @@
 # app/extensions.py
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flask_uuid import FlaskUUID
 from flask_pymongo import PyMongo
+from app.cache import TTLCache, PluggableCache
+from app.compression import Compress
+from app.layout import Layout
+from app.metrics import Metrics
+from app.ratelimit import rate_limit_key, DEFAULT_RATE_LIMITS
 import os
 
 # -----------------------------------------------------------------------------
-# set up rate limiting
-limiter = Limiter(key_func=get_remote_address,
-                  default_limits=["500 per minute", "50 per second"])
+# set up rate limiting - per ip, or per user once they've been let in. the
+# counts are shared between workers with RATELIMIT_STORAGE_URI=batched+...
+limiter = Limiter(key_func=rate_limit_key,
+                  default_limits=DEFAULT_RATE_LIMITS)
 
 # -----------------------------------------------------------------------------
 # set up flask uuid regex in url finder
@@ -17,3 +22,32 @@ flask_uuid = FlaskUUID()
 # -----------------------------------------------------------------------------
 # set up pymongo
 mongo = PyMongo()
+
+# -----------------------------------------------------------------------------
+# set up access token cache - saves a round trip to authy for every request
+access_cache = TTLCache()
+
+# -----------------------------------------------------------------------------
+# set up per user item count cache - counts are only returned when asked for
+count_cache = TTLCache()
+
+# -----------------------------------------------------------------------------
+# presigned upload urls that turned up after create_item had responded
+s3_urls_cache = TTLCache()
+
+# -----------------------------------------------------------------------------
+# read-through cache of item docs for single item reads. local to each worker
+# by default, or shared between them - see ITEM_CACHE_BACKEND
+item_cache = PluggableCache()
+
+# -----------------------------------------------------------------------------
+# compress json responses for clients that say they can take it
+compress = Compress()
+
+# -----------------------------------------------------------------------------
+# nested or flat item docs - see app/layout.py
+item_layout = Layout()
+
+# -----------------------------------------------------------------------------
+# prometheus metrics - see app/metrics.py
+metrics = Metrics()
@@ -0,0 +1,201 @@
+# app/indexes.py
+from pymongo import ASCENDING, TEXT, IndexModel
+from app.layout import Layout, NESTED, DUAL, FLAT
+from app.config import Config
+from app.events import EPOCH
+
+# -----------------------------------------------------------------------------
+# every index the views rely on lives here. use 'python manage.py
+# create-indexes' to build them and 'python manage.py check-indexes' to see
+# what's missing. name and keys are what we compare on, so changing the keys
+# of an index means giving it a new name too. layouts says which
+# ITEM_LAYOUTs need the index - dual needs both sets
+# -----------------------------------------------------------------------------
+
+INDEXES = {
+    'items': [
+        # listing a user's items in _id order and checking ownership
+        {'name': 'public_id_id',
+         'keys': [('details.public_id', ASCENDING), ('_id', ASCENDING)],
+         'layouts': (NESTED, DUAL)},
+        {'name': 'flat_public_id_id',
+         'keys': [('public_id', ASCENDING), ('_id', ASCENDING)],
+         'layouts': (DUAL, FLAT)},
+        # category sampling - see app/sampling.py
+        {'name': 'category_rand',
+         'keys': [('details.category', ASCENDING), ('rand', ASCENDING)],
+         'layouts': (NESTED, DUAL)},
+        {'name': 'flat_category_rand',
+         'keys': [('category', ASCENDING), ('rand', ASCENDING)],
+         'layouts': (DUAL, FLAT)},
+        # text search - see search_pipeline in app/main/helpers.py. a
+        # collection can only have one text index so this covers both
+        # layouts' paths, whichever is in use
+        {'name': 'item_text',
+         'keys': [('details.name', TEXT), ('details.description', TEXT),
+                  ('name', TEXT), ('description', TEXT)],
+         'options': {'weights': {'details.name': 5, 'name': 5,
+                                 'details.description': 1, 'description': 1},
+                     'default_language': 'english'}},
+        # relay-events finds changes whose event is still on the item - see
+        # app/events.py. only docs with something pending are in it
+        {'name': 'pending_at',
+         'keys': [('_pending.at', ASCENDING)],
+         'options': {'partialFilterExpression': {'_pending': {'$exists': True}}}},
+    ],
+    'item_events': [
+        # retention - see app/events.py. mongo won't change the expiry of an
+        # existing index, it has to be dropped and made again
+        {'name': 'at_ttl',
+         'keys': [('at', ASCENDING)],
+         'options': {'expireAfterSeconds': Config.EVENTS_RETENTION}},
+        # compaction deletes an item's older events
+        {'name': 'item_id_id',
+         'keys': [('item_id', ASCENDING), ('_id', ASCENDING)]},
+        # an item change only goes in the feed once however many times it's
+        # relayed. events from before there were markers don't have one
+        {'name': 'marker',
+         'keys': [('marker', ASCENDING)],
+         'options': {'unique': True, 'sparse': True}},
+    ],
+}
+
+
+def indexes_for(layout):
+    # the INDEXES a given ITEM_LAYOUT needs
+    return {collection: [spec for spec in specs if layout in spec.get('layouts', (layout,))]
+            for collection, specs in INDEXES.items()}
+
+# -----------------------------------------------------------------------------
+# the query shapes used in app/main/views.py, as raw commands so we can run
+# explain on them. values are just placeholders - only the shape matters
+# -----------------------------------------------------------------------------
+
+_SOME_ID = '00000000-0000-4000-8000-000000000000'
+
+
+def query_shapes(layout=NESTED):
+    # the filters depend on where the fields live. the helpers are imported
+    # here as they need the app package, which imports us
+    from app.main.helpers import search_pipeline
+    layout = Layout(layout)
+    by_user = layout.match('public_id', _SOME_ID)
+    by_category = layout.match('category', 'cars:2000')
+    return {
+        'get_item': {'find': 'items', 'filter': {'_id': _SOME_ID}},
+        'fetch_items': {'find': 'items', 'filter': {'_id': {'$in': [_SOME_ID]}}},
+        'items_by_user': {'find': 'items',
+                          'filter': by_user,
+                          'sort': {'_id': 1}, 'limit': 6},
+        'items_by_user_cursor': {'find': 'items',
+                                 'filter': dict(by_user, _id={'$gt': _SOME_ID}),
+                                 'sort': {'_id': 1}, 'limit': 6},
+        'count_items_by_user': {'count': 'items', 'query': by_user},
+        'items_by_category': {'find': 'items',
+                              'filter': dict(by_category, rand={'$gte': 0.5}),
+                              'sort': {'rand': 1}, 'limit': 20},
+        'items_by_category_legacy': {'aggregate': 'items',
+                                     'pipeline': [{'$match': by_category},
+                                                  {'$sample': {'size': 20}}],
+                                     'cursor': {}},
+        'delete_item': {'find': 'items',
+                        'filter': {'$and': [{'_id': _SOME_ID}, by_user]}},
+        'pending_events': {'find': 'items',
+                           'filter': {'_pending': {'$exists': True}, '_pending.at': {'$lt': EPOCH}},
+                           'limit': 500},
+        'events_feed': {'find': 'item_events',
+                        'filter': {'_id': {'$gt': 0}},
+                        'sort': {'_id': 1}, 'limit': 500},
+        'search_items': {'aggregate': 'items',
+                         'pipeline': search_pipeline('vintage console', 'cars:2000', limit=20,
+                                                     layout=layout),
+                         'cursor': {}},
+    }
+
+
+def ensure_indexes(db, layout=NESTED):
+    # creating an index that already exists is a no-op in mongo
+    created = []
+    for collection, specs in indexes_for(layout).items():
+        models = [IndexModel(spec['keys'], name=spec['name'], **spec.get('options', {}))
+                  for spec in specs]
+        created.extend(db[collection].create_indexes(models))
+    return created
+
+
+def missing_indexes(db, layout=NESTED):
+    # returns (collection, spec) for every declared index we can't find
+    missing = []
+    for collection, specs in indexes_for(layout).items():
+        existing = db[collection].index_information()
+        existing_keys = [_normalise_keys(info['key']) for info in existing.values()]
+        for spec in specs:
+            if _normalise_keys(spec['keys']) not in existing_keys:
+                missing.append((collection, spec))
+    return missing
+
+
+def log_missing_indexes(db, logger, layout=NESTED):
+    try:
+        missing = missing_indexes(db, layout)
+    except Exception as e:
+        logger.error("Unable to check indexes [%s]", e)
+        return None
+
+    for collection, spec in missing:
+        logger.warning("Missing index [%s] on [%s] - run 'python manage.py create-indexes'",
+                       spec['name'], collection)
+    return missing
+
+
+def explain_report(db, layout=NESTED):
+    # runs explain on each query shape and flags any that end up scanning
+    # the whole collection
+    report = []
+    for name, command in query_shapes(layout).items():
+        explained = db.command('explain', command, verbosity='queryPlanner')
+        stages = plan_stages(explained)
+        report.append({'query': name,
+                       'stages': stages,
+                       'collscan': 'COLLSCAN' in stages})
+    return report
+
+
+def plan_stages(explained):
+    # collects every stage name in the winning plan(s) of an explain result.
+    # aggregates and newer servers nest the plan in different places so we
+    # just walk the lot and skip the plans mongo didn't pick
+    stages = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'rejectedPlans':
+                    continue
+                if key == 'stage' and isinstance(value, str):
+                    stages.append(value)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explained)
+    return stages
+
+
+def _normalise_keys(keys):
+    # mongo lists the fields of a text index as _fts/_ftsx (the fields
+    # themselves are in its weights) so ours are folded down to match
+    if isinstance(keys, dict):
+        keys = keys.items()
+    normalised = []
+    for field, direction in keys:
+        if field == '_ftsx':
+            continue
+        if direction == TEXT:
+            if ('_fts', TEXT) not in normalised:
+                normalised.extend([('_fts', TEXT), ('_ftsx', 1)])
+            continue
+        normalised.append((field, int(direction) if isinstance(direction, (int, float)) else direction))
+    return normalised
@@ -0,0 +1,95 @@
+# app/json_provider.py
+import datetime
+import decimal
+import json
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+# -----------------------------------------------------------------------------
+# json providers for app.json - used by jsonify, request.get_json and the
+# streamed responses. both write dates the same way (isoformat, i.e.
+# 2024-01-31T10:15:00.123000, with the microseconds even when they're all
+# zero) so every route returns the same date format
+# whichever provider is in use. set JSON_PROVIDER to pick one. these replace
+# the bson.json_util one flask-pymongo installs, which is slow and writes
+# dates as {"$date": ...}
+# -----------------------------------------------------------------------------
+
+def _default(o):
+    # anything the encoders don't know about natively
+    # isoformat and orjson both leave the fraction off whole seconds, which
+    # would break clients parsing the old %Y-%m-%dT%H:%M:%S.%f format
+    if isinstance(o, datetime.datetime):
+        return o.isoformat(timespec='microseconds')
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, ObjectId)):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+
+class StdJSONProvider(JSONProvider):
+    # the standard library json module
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('default', _default)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj)+"\n", mimetype=self.mimetype)
+
+
+class OrjsonProvider(StdJSONProvider):
+    # orjson does the work and we drop back to the standard library for the
+    # few things it won't do - ints bigger than 64 bits, lone surrogates and
+    # NaN/Infinity in request bodies. that way the output and the errors are
+    # the same as with StdJSONProvider, only quicker
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode('utf-8')
+
+    def dumpb(self, obj):
+        try:
+            # dates go through _default so they come out the same as with json
+            return orjson.dumps(obj, default=_default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj).encode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return super().loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj)+b"\n", mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {'std': StdJSONProvider,
+                  'orjson': OrjsonProvider if orjson is not None else StdJSONProvider}
+
+
+def json_provider_class(name):
+    try:
+        return JSON_PROVIDERS[name]
+    except KeyError:
+        raise ValueError("Unknown JSON_PROVIDER [%s], expected one of %s" % (name, sorted(JSON_PROVIDERS)))
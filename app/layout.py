@@ -0,0 +1,121 @@
+# app/layout.py
+from pymongo import ASCENDING, ReplaceOne
+
+# -----------------------------------------------------------------------------
+# how item docs are stored. originally everything the client sent went in a
+# details subdoc - {_id, details: {...}, rand} - which meant rebuilding every
+# doc on the way out and details. paths in every index. flat docs keep the
+# item's fields at the top level - {_id, name, ..., rand} - so reads only
+# have to rename _id. ITEM_LAYOUT picks one of:
+#
+#   nested - the old layout, read and written
+#   dual   - writes flat docs, reads and queries both. used while
+#            'python manage.py migrate-layout' converts the existing docs
+#   flat   - only flat docs left, the nested indexes can go
+# -----------------------------------------------------------------------------
+
+NESTED = 'nested'
+DUAL = 'dual'
+FLAT = 'flat'
+LAYOUTS = (NESTED, DUAL, FLAT)
+
+# top level keys that are ours rather than the item's. _pending and _deleted
+# are the change event outbox - see app/events.py
+RESERVED = ('_id', 'rand', 'details', 'item_id', '_pending', '_deleted')
+
+
+class Layout(object):
+
+    def __init__(self, mode=NESTED):
+        self.mode = mode
+
+    def init_app(self, app):
+        mode = app.config.get('ITEM_LAYOUT', NESTED)
+        if mode not in LAYOUTS:
+            raise ValueError("Unknown ITEM_LAYOUT [%s], expected one of %s" % (mode, list(LAYOUTS)))
+        self.mode = mode
+
+    @property
+    def writes_flat(self):
+        return self.mode != NESTED
+
+    def paths(self, field):
+        # where an item field might be stored
+        if self.mode == NESTED:
+            return ['details.'+field]
+        if self.mode == FLAT:
+            return [field]
+        return [field, 'details.'+field]
+
+    def match(self, field, value):
+        # query for docs whose field matches value. in dual mode that's an
+        # $or of both paths, which mongo answers with an index scan on each
+        paths = self.paths(field)
+        if len(paths) == 1:
+            return {paths[0]: value}
+        return {'$or': [{path: value} for path in paths]}
+
+    def projection(self, fields, *always):
+        # None means the whole doc
+        if fields is None:
+            return None
+        projection = {}
+        for field in list(fields) + list(always):
+            for path in self.paths(field):
+                projection[path] = 1
+        return projection
+
+    def stored(self, item_id, data, rand):
+        # the doc we insert (or replace with) for an item
+        if not self.writes_flat:
+            return {'_id': item_id, 'details': data, 'rand': rand}
+        doc = {'_id': item_id}
+        doc.update(item_fields(data))
+        doc['rand'] = rand
+        return doc
+
+
+def item_fields(data):
+    return {key: value for key, value in data.items() if key not in RESERVED}
+
+
+def item_value(doc, field):
+    # reads a field from a doc in either layout
+    if 'details' in doc:
+        return doc['details'].get(field)
+    return doc.get(field)
+
+# -----------------------------------------------------------------------------
+# migration. goes through the nested docs in _id order a batch at a time.
+# each doc is replaced only if its details are still what we read, so an
+# edit that lands mid batch is never overwritten - the doc just gets picked
+# up on the next run. the last _id of each batch is where to carry on from
+# -----------------------------------------------------------------------------
+
+def flatten(doc):
+    flat = {'_id': doc['_id']}
+    flat.update(item_fields(doc.get('details', {})))
+    for key in ('rand', '_pending'):
+        if key in doc:
+            flat[key] = doc[key]
+    return flat
+
+
+def migrate_batch(collection, after=None, batch_size=500):
+    # returns (docs converted, last _id looked at) - the _id is None once
+    # there's nothing left after 'after'
+    query = {'details': {'$exists': True}}
+    if after is not None:
+        query['_id'] = {'$gt': after}
+
+    docs = list(collection.find(query).sort('_id', ASCENDING).limit(batch_size))
+    if not docs:
+        return 0, None
+
+    requests = [ReplaceOne({'_id': doc['_id'], 'details': doc['details']}, flatten(doc)) for doc in docs]
+    result = collection.bulk_write(requests, ordered=False)
+    return result.modified_count, docs[-1]['_id']
+
+
+def nested_count(collection):
+    return collection.count_documents({'details': {'$exists': True}})
@@ -0,0 +1,192 @@
+# app/logs.py
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import weakref
+from logging.handlers import QueueHandler, QueueListener
+
+from app.metrics import observe_log_dropped
+
+# -----------------------------------------------------------------------------
+# logging that never waits on the disk. the app logger only has a
+# LogQueueHandler, which puts records on a bounded in-memory queue. a
+# listener thread in each worker takes them off and writes them out through
+# the real handlers (the rotating file and whatever flask or quart set up
+# for stderr). if the writer falls behind and the queue fills, new records
+# are dropped and counted rather than making the request wait - see
+# items_log_records_dropped in /items/metrics.
+#
+# gunicorn preloads the app and threads don't survive a fork, so every
+# forked worker gets a fresh queue and listener (see _after_fork).
+#
+# debug and info records from busy endpoints can be sampled. the decision is
+# made once per request so a request's lines are all kept or all dropped.
+# warnings and worse are always kept
+# -----------------------------------------------------------------------------
+
+# (method, route, keep) for the request being handled
+_request = contextvars.ContextVar('log_request', default=None)
+
+# every live queue handler, so they can be restarted after a fork and
+# flushed on exit
+_handlers = weakref.WeakSet()
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line
+
+    def format(self, record):
+        line = {'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                                          .isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'logger': record.name,
+                'where': '%s:%d' % (record.pathname, record.lineno),
+                'pid': record.process,
+                'message': record.getMessage()}
+        for field in ('method', 'route'):
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        return json.dumps(line, default=str)
+
+
+class RequestSampler(logging.Filter):
+    # keeps rate of the requests to endpoints (the view function names,
+    # i.e. get_item) for debug and info records
+
+    def __init__(self, rate=1.0, endpoints=()):
+        super().__init__()
+        self.rate = float(rate)
+        self.endpoints = frozenset(endpoints)
+
+    def start(self, request):
+        # called at the start of every request
+        endpoint = (request.endpoint or '').rsplit('.', 1)[-1]
+        keep = self.rate >= 1 or endpoint not in self.endpoints or random.random() < self.rate
+        route = request.url_rule.rule if request.url_rule is not None else None
+        _request.set((request.method, route, keep))
+
+    def finish(self, exc=None):
+        _request.set(None)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        state = _request.get()
+        return state is None or state[2]
+
+
+class LogQueueHandler(QueueHandler):
+
+    def __init__(self, handlers, capacity=10000, inherited=()):
+        # handlers are ours and closed with us, inherited ones were taken
+        # off the logger and are handed on to whatever replaces us
+        super().__init__(queue.Queue(capacity))
+        self.handlers = list(handlers)
+        self.inherited = list(inherited)
+        self.capacity = capacity
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.listener = None
+        self.start()
+        _handlers.add(self)
+
+    def start(self):
+        self.listener = _Listener(self.queue, *(self.handlers + self.inherited), respect_handler_level=True)
+        self.listener.start()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            observe_log_dropped()
+
+    def prepare(self, record):
+        # done on the logging thread. the message is merged and any traceback
+        # formatted here as the args and exc_info might not survive until the
+        # listener gets to them. the request it came from is added as the
+        # listener can't see it
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.exc_info, record.exc_text = message, None, None, exc_text
+        state = _request.get()
+        if state is not None:
+            record.method, record.route = state[0], state[1]
+        return record
+
+    def stop(self):
+        # writes out what's queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def close(self):
+        self.stop()
+        for handler in self.handlers:
+            handler.close()
+        _handlers.discard(self)
+        super().close()
+
+    def after_fork(self):
+        # the parent's listener thread didn't come with us, and the queue's
+        # lock may have been held by it when we forked
+        self.queue = queue.Queue(self.capacity)
+        self.start()
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # wait for room rather than losing the stop signal when the queue is
+        # full
+        self.queue.put(self._sentinel, timeout=5)
+
+
+def install_queue_handler(logger, handlers, capacity, sampler=None):
+    # swaps the logger's handlers for a LogQueueHandler that passes records
+    # on to them plus the ones the logger already had. calling it again (a
+    # new app with the same logger) replaces the last one
+    inherited = []
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if isinstance(handler, LogQueueHandler):
+            handler.close()
+            inherited.extend(handler.inherited)
+        else:
+            inherited.append(handler)
+
+    queue_handler = LogQueueHandler(handlers, capacity, inherited)
+    if sampler is not None:
+        queue_handler.addFilter(sampler)
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+
+def _after_fork():
+    for handler in list(_handlers):
+        handler.after_fork()
+
+
+def _flush_all():
+    for handler in list(_handlers):
+        handler.stop()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_flush_all)
@@ -0,0 +1,635 @@
+# app/main/helpers.py
+from app.pagination import encode_cursor, decode_cursor, NEXT, PREV
+from app.extensions import s3_urls_cache, item_layout
+from app.assertions import validation_error
+from app.layout import item_fields, NESTED, FLAT
+from app.sampling import new_random_key
+from app.events import PENDING, with_marker
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from werkzeug.http import http_date
+import hashlib
+import uuid
+import datetime
+import re
+from urllib.parse import quote
+
+# -----------------------------------------------------------------------------
+# the bits of the views that don't do any i/o. shared by the sync blueprint in
+# app/main/views.py and the async one in app/aio/views.py so both serve
+# exactly the same json
+# -----------------------------------------------------------------------------
+
+SORT_DIRECTIONS = {'id_asc': ASCENDING, 'id_desc': DESCENDING}
+
+
+def reshape_item(item, fields=None):
+    # turns a stored doc into what we return to clients. nested {_id, details}
+    # docs have to be rebuilt, flat ones are already the right shape so we
+    # just rename _id in place. rand and any pending events are ours and stay
+    # hidden either way
+    if 'details' in item:
+        output = {'item_id': str(item['_id'])}
+        output.update(pick_fields(item['details'], fields))
+        return output
+    if fields is not None:
+        output = pick_fields(item, fields)
+        output['item_id'] = str(item['_id'])
+        return output
+    item['item_id'] = str(item.pop('_id'))
+    item.pop('rand', None)
+    item.pop(PENDING, None)
+    return item
+
+
+def format_document(record, fields=None):
+    # dates are left as datetimes - the json provider writes them out in the
+    # same format for every route. copies rather than changes the record as
+    # it might be sitting in the item cache
+    if 'details' in record:
+        item_details = pick_fields(record['details'], fields)
+        item_details['item_id'] = record['_id']
+        return item_details
+    return reshape_item(dict(record), fields)
+
+
+def valid_category(category):
+    # basic data sanitation checks for category in format like 'cars:2000'
+    return re.search("^[a-z0-9_-]{1,20}:[0-9]{2,5}$", category) is not None
+
+# -----------------------------------------------------------------------------
+# field projection. clients can ask for just the bits of details they need
+# (i.e. ?fields=name,category,price for a listing card) and we only pull
+# those out of mongo. the fields have to be in ITEM_FIELDS - item_id always
+# comes back
+# -----------------------------------------------------------------------------
+
+def parse_fields(fields, allowed):
+    # takes 'name,category' or ['name', 'category'] and returns a list of
+    # fields, or raises ValueError for anything not allowed
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    allowed = allowed.split(',') if isinstance(allowed, str) else allowed
+
+    picked = []
+    for field in fields:
+        field = field.strip()
+        if field not in allowed:
+            raise ValueError("'"+field+"' is not a field you can ask for")
+        if field not in picked:
+            picked.append(field)
+    return picked
+
+
+def fields_arg(args, allowed):
+    # None if the client didn't ask for particular fields
+    if 'fields' not in args:
+        return None
+    return parse_fields(args['fields'], allowed)
+
+
+def item_projection(fields, *always):
+    # None means the whole doc
+    return item_layout.projection(fields, *always)
+
+
+def pick_fields(details, fields):
+    if fields is None:
+        return dict(details)
+    return {field: details[field] for field in fields if field in details}
+
+
+def fields_query(fields):
+    # to carry fields through to the paging links
+    if fields is None:
+        return ''
+    return '&fields='+','.join(fields)
+
+
+# -----------------------------------------------------------------------------
+# conditional requests. an item's etag is its modified time (in microseconds,
+# as hex) so an If-Match on a PUT can be turned back into a date and checked
+# as part of the update itself. mongo only keeps milliseconds so anything we
+# write has to be trimmed to match or the etag we hand out won't be the one
+# we read back. a response cut down with ?fields= is a different body for
+# the same item, so its etag carries a hash of the (sorted) fields too
+# -----------------------------------------------------------------------------
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def utcnow_ms():
+    now = datetime.datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def fields_tag(fields):
+    # '' for the whole item
+    if fields is None:
+        return ''
+    return hashlib.sha1(','.join(sorted(fields)).encode('utf-8')).hexdigest()[:8]
+
+
+def item_etag(modified, fields=None):
+    etag = 'm' + format((modified - EPOCH) // datetime.timedelta(microseconds=1), 'x')
+    if fields is not None:
+        etag += '-' + fields_tag(fields)
+    return etag
+
+
+def modified_from_etag(etag):
+    # None if it isn't one of ours. the fields part doesn't matter here - it's
+    # the same item whichever fields it was fetched with
+    if not etag.startswith('m'):
+        return None
+    try:
+        return EPOCH + datetime.timedelta(microseconds=int(etag[1:].split('-', 1)[0], 16))
+    except (ValueError, OverflowError):
+        return None
+
+
+def bulk_etag(item_ids, modified_by_id, fields=None):
+    # one etag for a whole bulk fetch - changes if any item changes, turns up
+    # or goes away, or different fields are asked for
+    digest = hashlib.sha1(fields_tag(fields).encode('utf-8'))
+    for item_id in item_ids:
+        modified = modified_by_id.get(item_id, 'missing')
+        digest.update((item_id+':'+str(modified)+';').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def item_validators(modified, fields=None):
+    # response headers for an item with the given modified date
+    if modified is None:
+        return {}
+    return {'ETag': '"'+item_etag(modified, fields)+'"',
+            'Last-Modified': http_date(modified.replace(tzinfo=datetime.timezone.utc))}
+
+
+def not_modified(request, etag, modified=None):
+    # If-None-Match wins over If-Modified-Since when a client sends both
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None and modified is not None:
+        last_modified = modified.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def is_conditional(request):
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def if_match_dates(request):
+    # the modified dates a PUT is allowed to overwrite - None if there's no
+    # If-Match (or it's *), an empty list if none of the etags are any good.
+    # weak etags count too - compressed responses weaken ours but it's still
+    # exactly the modified date underneath
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    dates = [modified_from_etag(etag) for etag in request.if_match.as_set(include_weak=True)]
+    return [modified for modified in dates if modified is not None]
+
+# -----------------------------------------------------------------------------
+# paging
+# -----------------------------------------------------------------------------
+
+def parse_page_args(args, default_limit):
+    # returns (offset, limit, sort, cursor) or raises ValueError
+    offset, sort, cursor = None, 'id_asc', None
+    limit = int(default_limit)
+
+    if 'offset' in args:
+        offset = int(args['offset'])
+    if 'limit' in args:
+        limit = int(args['limit'])
+    if 'sort' in args:
+        sort = args['sort']
+    if 'cursor' in args:
+        cursor = decode_cursor(args['cursor'])
+
+    return offset, limit, sort, cursor
+
+
+def offset_page_links(return_data, has_more, offset, limit, sort, fields=None):
+
+    if has_more:
+        return_data['next_url'] = '/items?limit='+str(limit)+'&offset='+str(offset+limit)+'&sort='+sort+\
+                                  fields_query(fields)
+
+    if offset > 0:
+        url_offset_prev = max(offset-limit, 0)
+        return_data['prev_url'] = '/items?limit='+str(limit)+'&offset='+str(url_offset_prev)+'&sort='+sort+\
+                                  fields_query(fields)
+
+    return return_data
+
+
+def cursor_page_query(public_id, cursor, sort):
+    # returns the (query, sort direction) for a single indexed range query
+    # on (public_id, _id)
+    direction = SORT_DIRECTIONS[sort]
+    going_back = cursor is not None and cursor['d'] == PREV
+    query = item_layout.match('public_id', public_id)
+
+    if cursor is not None:
+        forwards = '$gt' if direction == ASCENDING else '$lt'
+        backwards = '$lt' if direction == ASCENDING else '$gt'
+        query['_id'] = {backwards if going_back else forwards: cursor['k']}
+
+    return query, -direction if going_back else direction
+
+
+def cursor_page_result(output, cursor, limit, sort, fields=None):
+    # output is the items from cursor_page_query, fetched with limit + 1 so
+    # we know if there's another page
+    going_back = cursor is not None and cursor['d'] == PREV
+
+    more = len(output) > limit
+    output = output[:limit]
+    if going_back:
+        output.reverse()
+
+    return_data = {'items': output}
+    if len(output) == 0:
+        return return_data
+
+    if going_back or more:
+        token = encode_cursor({'k': output[-1]['item_id'], 'd': NEXT})
+        return_data['next_url'] = '/items?limit='+str(limit)+'&cursor='+token+'&sort='+sort+fields_query(fields)
+
+    if (cursor is not None and not going_back) or (going_back and more):
+        token = encode_cursor({'k': output[0]['item_id'], 'd': PREV})
+        return_data['prev_url'] = '/items?limit='+str(limit)+'&cursor='+token+'&sort='+sort+fields_query(fields)
+
+    return return_data
+
+# -----------------------------------------------------------------------------
+# text search over item names and descriptions, backed by the item_text index
+# in app/indexes.py. results come back best match first (ties in _id order)
+# and page with cursors holding the (score, _id) of the last item, so each
+# page is a single aggregate however deep the client goes. mongo still has to
+# score every item matching the terms to rank them - the cost follows how
+# many items match, not how many there are
+# -----------------------------------------------------------------------------
+
+SCORE = '_score'
+
+
+def parse_search_args(args, default_limit, max_length, max_limit):
+    # returns (terms, category, limit, cursor) or raises ValueError. limit is
+    # capped at max_limit
+    terms = args.get('q', '').strip()
+    if not terms:
+        raise ValueError("'q' is needed")
+    if len(terms) > int(max_length):
+        raise ValueError("'q' can't be more than "+str(max_length)+" characters")
+
+    limit = int(args.get('limit', default_limit))
+    if limit < 1:
+        raise ValueError("'limit' has to be at least 1")
+    limit = min(limit, int(max_limit))
+
+    cursor = None
+    if 'cursor' in args:
+        cursor = decode_cursor(args['cursor'])
+        if cursor['d'] != NEXT or not isinstance(cursor['k'], list) or len(cursor['k']) != 2:
+            raise ValueError('invalid cursor')
+        # the score and id go straight into a $match, so anything but a
+        # number and a string (i.e. {"$gt": 0}) would be read as an operator
+        score, item_id = cursor['k']
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not isinstance(item_id, str):
+            raise ValueError('invalid cursor')
+
+    return terms, args.get('category'), limit, cursor
+
+
+def search_pipeline(terms, category=None, cursor=None, limit=20, projection=None, layout=item_layout):
+    # fetches limit + 1 so we know if there's another page
+    match = {'$text': {'$search': terms}}
+    if category is not None:
+        match.update(layout.match('category', category))
+
+    pipeline = [{'$match': match},
+                {'$addFields': {SCORE: {'$meta': 'textScore'}}}]
+
+    if cursor is not None:
+        score, item_id = cursor['k']
+        pipeline.append({'$match': {'$or': [{SCORE: {'$lt': score}},
+                                            {SCORE: score, '_id': {'$gt': item_id}}]}})
+
+    # sort and limit together only keep the top limit + 1 in memory
+    pipeline.append({'$sort': {SCORE: -1, '_id': 1}})
+    pipeline.append({'$limit': limit + 1})
+
+    if projection is not None:
+        pipeline.append({'$project': dict(projection, **{SCORE: 1})})
+
+    return pipeline
+
+
+def search_page_result(docs, terms, category, limit, fields=None):
+    # docs are from search_pipeline and still have their scores on - they
+    # go into the cursor and then come off
+    more = len(docs) > limit
+    docs = docs[:limit]
+    scores = [doc.pop(SCORE) for doc in docs]
+
+    return_data = {'items': [reshape_item(doc, fields) for doc in docs]}
+
+    if more:
+        token = encode_cursor({'k': [scores[-1], return_data['items'][-1]['item_id']], 'd': NEXT})
+        url = '/items/search?q='+quote(terms)+'&limit='+str(limit)+'&cursor='+token
+        if category is not None:
+            url += '&category='+quote(category)
+        return_data['next_url'] = url + fields_query(fields)
+
+    return return_data
+
+# -----------------------------------------------------------------------------
+# bulk fetch. big requests are streamed - we look the ids up a chunk at a
+# time and write each chunk out before fetching the next one, so a worker
+# only ever holds one chunk of docs no matter how many ids were asked for
+# -----------------------------------------------------------------------------
+
+def chunked(item_ids, size):
+    for start in range(0, len(item_ids), size):
+        yield item_ids[start:start+size]
+
+
+def order_by_request(item_ids, docs, fields=None):
+    # returns (items in the order they were asked for, ids we didn't find)
+    found = {doc['_id']: doc for doc in docs}
+    items = [reshape_item(found[item_id], fields) for item_id in item_ids if item_id in found]
+    missing = [item_id for item_id in item_ids if item_id not in found]
+    return items, missing
+
+
+def stream_chunk(items, dumps, first):
+    # the json for one chunk of items, with a leading comma if it isn't the
+    # first thing in the array
+    body = ','.join(dumps(item) for item in items)
+    if body and not first:
+        body = ','+body
+    return body
+
+
+def stream_tail(missing, dumps, error=None):
+    # closes the items array. if the stream broke part way through we can't
+    # change the status code anymore so we say so in the body instead
+    tail = {'missing': missing}
+    if error is not None:
+        tail['error'] = error
+    return '],'+dumps(tail)[1:]
+
+# -----------------------------------------------------------------------------
+# photo upload urls
+# -----------------------------------------------------------------------------
+
+def new_foto_ids(foto_limit):
+    # need to generate a list of foto ids
+    # that we can pass to aws microservice
+    return [str(uuid.uuid4()) for i in range(int(foto_limit))]
+
+
+def bucket_url(public_id):
+    collection_name = 'z'+public_id.replace('-', '')
+    return "https://"+collection_name.lower()+".s3.amazonaws.com"
+
+
+def s3_urls_from(r):
+    if r is not None and r.status_code == 201:
+        return r.json().get('aws_urls')
+    return []
+
+
+def created_response(item_id, public_id, s3_urls):
+    return_data = {'item_id': item_id,
+                   'bucket_url': bucket_url(public_id),
+                   's3_urls': s3_urls}
+    if not s3_urls:
+        # aws was too slow (or we didn't wait) - the client can pick them up here
+        return_data['s3_urls_url'] = '/items/'+item_id+'/s3urls'
+    return return_data
+
+
+def remember_s3_urls(item_id, future):
+    # done callback for presign requests that finish after we've responded.
+    # works for both thread pool and asyncio futures
+    if future.cancelled() or future.exception() is not None:
+        return
+    s3_urls = s3_urls_from(future.result())
+    if s3_urls:
+        s3_urls_cache.set(item_id, s3_urls)
+
+# -----------------------------------------------------------------------------
+# bulk creation
+# -----------------------------------------------------------------------------
+
+def prepare_bulk_items(items, public_id):
+    # validates each item on its own so one bad item doesn't sink the batch.
+    # returns the per item results so far and (index, doc) for the good ones
+    results = [None] * len(items)
+    docs = []
+    now = datetime.datetime.utcnow()
+
+    for index, data in enumerate(items):
+        error = validation_error(data, 'item')
+        if error is not None:
+            results[index] = {'index': index, 'status': 'invalid', 'error': error.message}
+            continue
+        data['public_id'] = public_id
+        data['created'] = now
+        data['modified'] = now
+        docs.append((index, item_layout.stored(str(uuid.uuid4()), data, new_random_key())))
+
+    return results, docs
+
+
+def bulk_write_failures(err):
+    # maps a BulkWriteError to {position in the batch: error message}
+    return {write_error['index']: write_error.get('errmsg', 'unable to insert')
+            for write_error in err.details.get('writeErrors', [])}
+
+
+def bulk_create_response(results, docs, failures, s3_urls, foto_limit, public_id):
+    # fills in the results for the docs we tried to insert and picks a status.
+    # s3_urls is one flat list for the whole batch, in foto id order, so each
+    # item gets its own slice of it
+    foto_limit = int(foto_limit)
+    if len(s3_urls) != len(docs) * foto_limit:
+        s3_urls = []
+
+    created = 0
+    for position, (index, doc) in enumerate(docs):
+        if position in failures:
+            results[index] = {'index': index, 'status': 'failed', 'error': failures[position]}
+            continue
+        created += 1
+        item_urls = s3_urls[position*foto_limit:(position+1)*foto_limit]
+        results[index] = {'index': index, 'status': 'created', 'item_id': doc['_id'], 's3_urls': item_urls}
+        if not item_urls:
+            results[index]['s3_urls_url'] = '/items/'+doc['_id']+'/s3urls'
+
+    if created == len(results):
+        status = 201
+    elif created > 0:
+        status = 207
+    else:
+        status = 400
+
+    return {'items': results,
+            'created_count': created,
+            'bucket_url': bucket_url(public_id)}, status
+
+# -----------------------------------------------------------------------------
+# single item edits. the item has to exist, be theirs and (with If-Match) be
+# at the modified date they fetched, and all of that goes in the filter of
+# one find_one_and_update - no read first, no gap for another edit to land
+# in, and mongo hands back the new doc. only when nothing matched do we go
+# back and look at why
+# -----------------------------------------------------------------------------
+
+def put_update(data, layout=item_layout):
+    # an update pipeline that swaps the item's fields for data but keeps its
+    # created date and pending events. $literal stops mongo reading values
+    # like '$name' as field paths
+    if not layout.writes_flat:
+        fields = {'details.'+key: {'$literal': value} for key, value in data.items()}
+        return [{'$project': {'rand': 1, 'details.created': 1, PENDING: 1}},
+                {'$set': fields}]
+
+    # created comes out of details first so a nested doc ends up flat, and
+    # older docs without a rand get one like any other flat doc
+    fields = {key: {'$literal': value} for key, value in item_fields(data).items()}
+    return [{'$set': {'created': {'$ifNull': ['$created', '$details.created']},
+                      'rand': {'$ifNull': ['$rand', new_random_key()]}}},
+            {'$project': {'rand': 1, 'created': 1, PENDING: 1}},
+            {'$set': fields}]
+
+
+def patch_updates(changes, modified, layout=item_layout):
+    # [(extra filter, update)] to try in turn. a None value removes the field.
+    # dual mode can't tell from here which layout the doc is in so it tries
+    # the flat one first, leaving nested docs for the migration to move
+    def update(prefix):
+        sets = {prefix+key: value for key, value in changes.items() if value is not None}
+        sets[prefix+'modified'] = modified
+        unsets = {prefix+key: '' for key, value in changes.items() if value is None}
+        return dict({'$set': sets}, **({'$unset': unsets} if unsets else {}))
+
+    if layout.mode == NESTED:
+        return [({}, update('details.'))]
+    if layout.mode == FLAT:
+        return [({}, update(''))]
+    return [({'details': {'$exists': False}}, update('')),
+            ({'details': {'$exists': True}}, update('details.'))]
+
+
+def edit_failure(current, public_id):
+    # (message, status) for an edit that didn't match. current is the
+    # (public_id, modified) of the item as it is now, or None if it's gone
+    if current is None:
+        return 'Item not found', 404
+    if current[0] != public_id:
+        return 'bad bad ting', 401
+    return 'Item has been changed since you fetched it', 412
+
+# -----------------------------------------------------------------------------
+# bulk updates and deletes. ownership (and an item's etag, if it came with
+# one) goes in each write's filter, so a write that doesn't match tells us
+# the item isn't there, isn't theirs or has changed
+# -----------------------------------------------------------------------------
+
+def owned_filter(item_id, public_id, expected=None):
+    # the filter for writing to one of public_id's items. expected is the
+    # modified dates it can be at, None for any
+    conditions = [item_layout.match('public_id', public_id)]
+    if expected is not None:
+        conditions.append(item_layout.match('modified', {'$in': expected}))
+    return {'_id': item_id, '$and': conditions}
+
+
+def etag_dates(etag):
+    # the If-Match of a single item in a bulk update - an empty list if the
+    # etag isn't one of ours
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    modified = modified_from_etag(etag.strip('"'))
+    return [] if modified is None else [modified]
+
+
+def prepare_bulk_updates(items, public_id, modified):
+    # validates each item on its own like prepare_bulk_items. returns the
+    # per item results so far and (index, item_id, data, filter) for the
+    # good ones
+    results = [None] * len(items)
+    updates = []
+    seen = set()
+
+    for index, data in enumerate(items):
+        item_id = data.pop('item_id')
+        etag = data.pop('etag', None)
+        data.pop('created', None)
+        if item_id in seen:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'invalid',
+                              'error': 'item is in the batch more than once'}
+            continue
+        seen.add(item_id)
+        error = validation_error(data, 'item')
+        if error is not None:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'invalid', 'error': error.message}
+            continue
+        data['public_id'] = public_id
+        data['modified'] = modified
+        expected = etag_dates(etag) if etag is not None else None
+        updates.append((index, item_id, data, owned_filter(item_id, public_id, expected)))
+
+    return results, updates
+
+
+def bulk_update_requests(updates, markers):
+    # same writes as edit_item, one per item. markers is {item_id: marker}
+    return [UpdateOne(query, with_marker(put_update(data), markers[item_id]))
+            for index, item_id, data, query in updates]
+
+
+def bulk_update_response(results, updates, current, public_id, modified, failures=None):
+    # fills in the results for the items we tried to write. current is
+    # {item_id: (public_id, modified)} read back after the write, or None if
+    # every write matched so there was no need to look. failures is
+    # {position in updates: error message} for writes mongo refused - those
+    # matched but failed, so they aren't a conflict whatever modified says
+    failures = failures or {}
+    updated = []
+    for position, (index, item_id, data, query) in enumerate(updates):
+        owner, now = current.get(item_id, (None, None)) if current is not None else (public_id, modified)
+        if position in failures:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'failed', 'error': failures[position]}
+        elif owner != public_id:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'not_found'}
+        elif now != modified:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'conflict',
+                              'error': 'Item has been changed since you fetched it'}
+        else:
+            results[index] = {'index': index, 'item_id': item_id, 'status': 'updated',
+                              'etag': item_etag(modified)}
+            updated.append(item_id)
+
+    status = 200 if len(updated) == len(results) else 207
+    return {'items': results, 'updated_count': len(updated)}, status, updated
+
+
+def bulk_delete_response(item_ids, deleted, failures=None):
+    # deleted is the ids this request actually deleted and failures
+    # {item_id: error message} for deletes mongo refused
+    failures = failures or {}
+    results = []
+    for index, item_id in enumerate(item_ids):
+        if item_id in failures:
+            results.append({'index': index, 'item_id': item_id, 'status': 'failed', 'error': failures[item_id]})
+        else:
+            results.append({'index': index, 'item_id': item_id,
+                            'status': 'deleted' if item_id in deleted else 'not_found'})
+    status = 200 if len(deleted) == len(item_ids) else 207
+    return {'items': results, 'deleted_count': len(deleted)}, status
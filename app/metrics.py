@@ -0,0 +1,158 @@
+# app/metrics.py
+import os
+import time
+from flask import request, g
+from pymongo import monitoring
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError: # pragma: no cover
+    prometheus_client = None
+
+# -----------------------------------------------------------------------------
+# prometheus metrics - per route request latency, mongo command timings (from
+# pymongo's command monitoring), calls out to authy and aws and cache hits. served at
+# /items/metrics. under gunicorn each worker has its own numbers, so set
+# PROMETHEUS_MULTIPROC_DIR to a fresh directory before starting and every
+# worker writes to files in there that get added up on each scrape (see
+# run_app.sh and gunicorn.conf.py). without prometheus_client installed
+# everything here does nothing
+# -----------------------------------------------------------------------------
+
+# seconds - most of our requests should land in the first few
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+if prometheus_client is not None:
+    REQUEST_SECONDS = Histogram('items_request_seconds', 'Time spent handling requests',
+                                ['method', 'route', 'status'], buckets=BUCKETS)
+    MONGO_SECONDS = Histogram('items_mongo_command_seconds', 'Time spent on mongo commands',
+                              ['command', 'collection'], buckets=BUCKETS)
+    MONGO_ERRORS = Counter('items_mongo_command_errors', 'Mongo commands that failed',
+                           ['command', 'collection'])
+    OUTBOUND_SECONDS = Histogram('items_outbound_seconds', 'Time spent calling other services',
+                                 ['service'], buckets=BUCKETS)
+    OUTBOUND_ERRORS = Counter('items_outbound_errors', 'Calls to other services that failed or 5xx-ed',
+                              ['service'])
+    CACHE_LOOKUPS = Counter('items_cache_lookups', 'Cache lookups by result (hit, miss or error)',
+                            ['cache', 'result'])
+    LOG_DROPPED = Counter('items_log_records_dropped', 'Log records dropped because the log queue was full')
+    EVENTS_DEFERRED = Counter('items_events_deferred',
+                              'Item changes whose event was left on the item for relay-events')
+
+
+def route_label(request):
+    # the url rule rather than the path so item ids don't make a new series
+    # for every item
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+
+def observe_request(method, route, status, seconds):
+    if prometheus_client is not None:
+        REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def observe_outbound(service, started, response):
+    # response is None when the call didn't get an answer at all
+    if prometheus_client is None:
+        return
+    OUTBOUND_SECONDS.labels(service).observe(time.perf_counter() - started)
+    if response is None or response.status_code >= 500:
+        OUTBOUND_ERRORS.labels(service).inc()
+
+
+def cache_lookups(cache):
+    # {result: counter} for one cache, or None without prometheus_client.
+    # the labels are bound up front as these go up on every lookup
+    if prometheus_client is None:
+        return None
+    return {result: CACHE_LOOKUPS.labels(cache, result) for result in ('hit', 'miss', 'error')}
+
+
+def observe_log_dropped():
+    if prometheus_client is not None:
+        LOG_DROPPED.inc()
+
+
+def observe_events_deferred(count):
+    if prometheus_client is not None:
+        EVENTS_DEFERRED.inc(count)
+
+
+def metrics_output():
+    # returns (body, content type) in prometheus text format
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    # pymongo only hands us the command when it starts and the duration when
+    # it ends so we hang on to the labels in between, keyed by request id.
+    # called from whichever thread ran the command - dict get/pop are atomic
+
+    def __init__(self):
+        self._labels = {}
+
+    def started(self, event):
+        self._labels[(event.connection_id, event.request_id)] = \
+            (event.command_name, command_collection(event.command_name, event.command))
+
+    def succeeded(self, event):
+        labels = self._labels.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            MONGO_SECONDS.labels(*labels).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self._labels.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            MONGO_SECONDS.labels(*labels).observe(event.duration_micros / 1e6)
+            MONGO_ERRORS.labels(*labels).inc()
+
+
+def command_collection(command_name, command):
+    # find, insert etc. name the collection as the command's value. getMore
+    # has the cursor id there and the collection separately
+    if command_name == 'getMore':
+        return command.get('collection', '')
+    collection = command.get(command_name)
+    return collection if isinstance(collection, str) else ''
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.mongo_listener = None
+
+    def init_app(self, app):
+        # has to come before anything else that registers before_request
+        # hooks (i.e. the limiter) so every request gets timed
+        self.enabled = prometheus_client is not None and app.config.get('METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        if self.mongo_listener is None:
+            self.mongo_listener = MongoCommandTimer()
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def event_listeners(self):
+        # for the mongo client
+        return [self.mongo_listener] if self.enabled else []
+
+    def before_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def after_request(self, response):
+        # streamed responses are timed to when we start sending them
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            observe_request(request.method, route_label(request), response.status_code,
+                            time.perf_counter() - started)
+        return response
@@ -0,0 +1,32 @@
+# app/pagination.py
+import base64
+import json
+
+# -----------------------------------------------------------------------------
+# opaque cursor tokens for keyset pagination. a token is just url safe base64
+# of a small json object holding the last seen sort key(s) and the direction
+# to page in. clients should treat them as opaque - we're free to change
+# what goes in them
+# -----------------------------------------------------------------------------
+
+NEXT = 'n'
+PREV = 'p'
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    # raises ValueError for anything that isn't one of ours
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('invalid cursor')
+
+    if not isinstance(data, dict) or data.get('d') not in (NEXT, PREV) or 'k' not in data:
+        raise ValueError('invalid cursor')
+
+    return data
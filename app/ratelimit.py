@@ -0,0 +1,118 @@
+# app/ratelimit.py
+import threading
+import time
+from flask import g
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage, storage_from_string
+
+# -----------------------------------------------------------------------------
+# rate limiting shared between workers. RATELIMIT_STORAGE_URI of
+# batched+mongodb://... keeps the counts in mongo (limits' own mongodb
+# storage) and batched+memory:// in the worker, which is handy for tests.
+# each worker counts hits locally and only adds them to the shared count
+# every RATELIMIT_SYNC_BATCH hits or RATELIMIT_SYNC_INTERVAL seconds, so most
+# requests never wait on mongo. the price is that between syncs a worker
+# only knows about other workers' hits as of the last sync - a limit can be
+# overshot by up to a batch per worker. the first hit on a key in each window
+# always goes to the shared store so a new window starts from the right count
+# -----------------------------------------------------------------------------
+
+# on every route, on top of any RATE_LIMIT_* a route has
+DEFAULT_RATE_LIMITS = ["500 per minute", "50 per second"]
+
+
+def rate_limit_key():
+    # the user for requests that have got past require_access_level, the
+    # client's ip for everything else
+    public_id = g.get('public_id')
+    if public_id is not None:
+        return 'user:' + public_id
+    return 'ip:' + get_remote_address()
+
+
+class _Counter(object):
+
+    def __init__(self, expires):
+        self.expires = expires
+        self.shared = 0
+        self.pending = 0
+        self.synced = time.time()
+
+
+class BatchedStorage(Storage):
+
+    STORAGE_SCHEME = ['batched+mongodb', 'batched+mongodb+srv', 'batched+memory']
+
+    def __init__(self, uri, wrap_exceptions=False, sync_batch=10, sync_interval=1.0, max_keys=100000, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        self.shared = storage_from_string(uri.split('+', 1)[1], **options)
+        self.sync_batch = int(sync_batch)
+        self.sync_interval = float(sync_interval)
+        self.max_keys = int(max_keys)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_exceptions(self):
+        return self.shared.base_exceptions
+
+    def _current(self, key, now):
+        # the counter for key if its window hasn't ended - call with the lock
+        counter = self._counters.get(key)
+        if counter is not None and now < counter.expires:
+            return counter
+        return None
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._lock:
+            counter = self._current(key, now)
+            if counter is not None:
+                counter.pending += amount
+                if counter.pending < self.sync_batch and now - counter.synced < self.sync_interval:
+                    return counter.shared + counter.pending
+                amount, counter.pending, counter.synced = counter.pending, 0, now
+
+        # new window or time to sync. done outside the lock so other keys
+        # (and other hits on this one) don't wait on the round trip
+        total = self.shared.incr(key, expiry, amount)
+        expires = self.shared.get_expiry(key) if counter is None else counter.expires
+
+        with self._lock:
+            if counter is None:
+                if len(self._counters) >= self.max_keys:
+                    self._prune(now)
+                counter = self._counters.setdefault(key, _Counter(expires))
+            counter.shared = max(counter.shared, total)
+            return counter.shared + counter.pending
+
+    def _prune(self, now):
+        for key in [key for key, counter in self._counters.items() if counter.expires <= now]:
+            del self._counters[key]
+
+    def get(self, key):
+        with self._lock:
+            counter = self._current(key, time.time())
+            if counter is not None:
+                return counter.shared + counter.pending
+        return self.shared.get(key)
+
+    def get_expiry(self, key):
+        with self._lock:
+            counter = self._current(key, time.time())
+            if counter is not None:
+                return counter.expires
+        return self.shared.get_expiry(key)
+
+    def check(self):
+        return self.shared.check()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+        return self.shared.reset()
+
+    def clear(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+        return self.shared.clear(key)
@@ -0,0 +1,86 @@
+# app/sampling.py
+import random
+from pymongo import ASCENDING
+from app.extensions import item_layout
+
+# -----------------------------------------------------------------------------
+# random sampling by category without $sample. every item gets a random float
+# in 'rand' when it's created. to sample we pick a random pivot and walk the
+# (category, rand) index from there, wrapping round to the start if
+# we run off the end. cost depends on the sample size, not the category size.
+# the trade off is that a sample is a run of neighbours in rand order rather
+# than fully independent picks - fine for a 'have a browse' endpoint.
+#
+# items from before random keys have no 'rand' and are never picked by the
+# index walk, so 'python manage.py backfill-rand' has to run before this is
+# deployed (see README). the $sample fallback only covers a category with
+# nothing but old items in it, not one with a mix
+# -----------------------------------------------------------------------------
+
+def sample_category(collection, category, size, pivot=None, projection=None):
+
+    upper, lower = sample_queries(category, pivot)
+
+    items = list(collection.find(upper, projection).sort('rand', ASCENDING).limit(size))
+
+    if len(items) < size:
+        items.extend(collection.find(lower, projection).sort('rand', ASCENDING).limit(size - len(items)))
+
+    if len(items) == 0:
+        # a category of only items from before random keys - see above
+        items = list(collection.aggregate(legacy_sample_pipeline(category, size, projection)))
+
+    return items
+
+
+async def sample_category_async(collection, category, size, pivot=None, projection=None):
+    # same as above for motor collections
+
+    upper, lower = sample_queries(category, pivot)
+
+    items = await collection.find(upper, projection).sort('rand', ASCENDING).limit(size).to_list(length=size)
+
+    if len(items) < size:
+        remaining = size - len(items)
+        items.extend(await collection.find(lower, projection).sort('rand', ASCENDING)
+                                     .limit(remaining).to_list(length=remaining))
+
+    if len(items) == 0:
+        items = await collection.aggregate(legacy_sample_pipeline(category, size, projection)) \
+                                .to_list(length=size)
+
+    return items
+
+
+def sample_queries(category, pivot=None):
+    # the query from the pivot up to the end and the one that wraps round
+    if pivot is None:
+        pivot = random.random()
+    upper = item_layout.match('category', category)
+    upper['rand'] = {'$gte': pivot}
+    lower = item_layout.match('category', category)
+    lower['rand'] = {'$lt': pivot}
+    return upper, lower
+
+
+def legacy_sample_pipeline(category, size, projection=None):
+    pipeline = [{'$match': item_layout.match('category', category)},
+                {'$sample': {'size': size}}]
+    if projection is not None:
+        pipeline.append({'$project': projection})
+    return pipeline
+
+
+def new_random_key():
+    return random.random()
+
+
+def missing_random_keys(collection):
+    return collection.count_documents({'rand': {'$exists': False}})
+
+
+def backfill_random_keys(collection):
+    # one server side update - needs mongo 4.4.2+ for $rand
+    result = collection.update_many({'rand': {'$exists': False}},
+                                    [{'$set': {'rand': {'$rand': {}}}}])
+    return result.modified_count
@@ -1,12 +1,105 @@
 # app/services.py
 import requests
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app as app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.metrics import observe_outbound
 
 # -----------------------------------------------------------------------------
+# one pooled session per worker process. sessions can't be shared across a
+# fork so we rebuild it if the pid changes (i.e. gunicorn preloading the app)
+# -----------------------------------------------------------------------------
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session, _session_pid
+
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _build_session(app.config)
+            _session_pid = os.getpid()
+
+    return _session
+
+
+def _build_session(config):
+    # only retry idempotent calls - a retried post could create a second
+    # batch of s3 urls that nobody ever uses
+    retries = Retry(total=int(config.get('HTTP_RETRIES', 2)),
+                    backoff_factor=float(config.get('HTTP_BACKOFF', 0.1)),
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=int(config.get('HTTP_POOL_CONNECTIONS', 4)),
+                          pool_maxsize=int(config.get('HTTP_POOL_MAXSIZE', 10)),
+                          max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# -----------------------------------------------------------------------------
+# small thread pool so slow outbound calls (i.e. aws) can run alongside our
+# own mongo work. same fork rules as the session
+# -----------------------------------------------------------------------------
+
+_pool = None
+_pool_pid = None
 
-def call_requests(url, headers):
-    r = requests.get(url, headers=headers)
+
+def get_pool():
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _session_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=int(app.config.get('OUTBOUND_POOL_SIZE', 8)),
+                                       thread_name_prefix='outbound')
+            _pool_pid = os.getpid()
+
+    return _pool
+
+
+def submit_with_app_context(fn, *args):
+    # runs fn in the pool with an app context so it can use config and logging
+    flask_app = app._get_current_object()
+
+    def run():
+        with flask_app.app_context():
+            return fn(*args)
+
+    return get_pool().submit(run)
+
+
+def _timeout():
+    return (float(app.config.get('HTTP_CONNECT_TIMEOUT', 2)),
+            float(app.config.get('HTTP_READ_TIMEOUT', 5)))
+
+# -----------------------------------------------------------------------------
+
+def call_requests(url, headers, service='auth'):
+    started = time.perf_counter()
+    try:
+        r = get_session().get(url, headers=headers, timeout=_timeout())
+    except requests.exceptions.RequestException as err:
+        app.logger.error("Error calling [%s]: %s", url, str(err))
+        r = None
+    observe_outbound(service, started, r)
     return r
 
 # -----------------------------------------------------------------------------
@@ -19,10 +112,13 @@ def get_s3_urls(foto_ids, token):
     #app.logger.info("S3 URL [%s]", app.config['AWS_S3_URL'])
     #app.logger.info(json.dumps({'objects': foto_ids}))
 
-    #r = requests
+    started = time.perf_counter()
     try:
-        r = requests.post(url, data=json.dumps({'objects': foto_ids}), headers=headers)
-    except Exception as err:
+        r = get_session().post(url, data=json.dumps({'objects': foto_ids}),
+                               headers=headers, timeout=_timeout())
+    except requests.exceptions.RequestException as err:
         app.logger.error(str(err))
+        r = None
 
+    observe_outbound('s3', started, r)
     return r
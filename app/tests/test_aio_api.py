@@ -0,0 +1,289 @@
+# app/tests/test_aio_api.py
+import uuid
+import gzip
+import json
+import asyncio
+import datetime
+from unittest import IsolatedAsyncioTestCase
+from mock import patch, MagicMock
+from .fixtures import getPublicID, getSpecificPublicID
+from app.aio import create_async_app
+from app.aio.extensions import motor_mongo
+from app.config import TestConfig
+
+
+async def fake_check_access(token, access_level):
+    return getSpecificPublicID(), None, 200
+
+
+async def fake_get_s3_urls(foto_ids, token):
+    return None
+
+
+async def slow_get_s3_urls(foto_ids, token):
+    await asyncio.sleep(0.2)
+    r = MagicMock()
+    r.status_code = 201
+    r.json.return_value = {'aws_urls': ['https://some.s3.url/1']}
+    return r
+
+
+###############################################################################
+#                        async (asgi) app test case                           #
+###############################################################################
+
+class AsyncApiTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.patches = [patch('app.aio.decorators.check_access', fake_check_access),
+                        patch('app.aio.views.get_s3_urls', fake_get_s3_urls)]
+        for p in self.patches:
+            p.start()
+        self.app = create_async_app(TestConfig)
+        self.serving = self.app.test_app()
+        await self.serving.__aenter__()
+        self.client = self.app.test_client()
+        await motor_mongo.db.items.drop()
+
+    async def asyncTearDown(self):
+        await motor_mongo.db.items.drop()
+        await self.serving.__aexit__(None, None, None)
+        for p in self.patches:
+            p.stop()
+
+    async def create_item(self, **kwargs):
+        datein = datetime.datetime.utcnow()
+        data = {'name': 'my test item 1',
+                'description': 'blah lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                'category': 'consoles-vintage:3341',
+                'public_id': getPublicID(),
+                'created': datein,
+                'modified': datein}
+        data.update(kwargs)
+        item_id = str(uuid.uuid4())
+        await motor_mongo.db.items.insert_one({"_id": item_id, "details": data})
+        return item_id, data
+
+    # --------------------------------------------------------------------------- #
+    #                                tests                                        #
+    # --------------------------------------------------------------------------- #
+
+    async def test_status_ok(self):
+        response = await self.client.get('/items/status', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_reject_non_json(self):
+        response = await self.client.get('/items/status', headers={'Content-type': 'text/html'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_metrics(self):
+        await self.client.get('/items/status', headers={'Content-type': 'application/json'})
+        response = await self.client.get('/items/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'route="/items/status"', await response.get_data())
+
+    async def test_404(self):
+        response = await self.client.get('/items/non-existent-url', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual((await response.get_json()).get('message'), 'nowt ere for what you want')
+
+    async def test_create_and_fetch_item_ok(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        response = await self.client.post('/items', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        item_id = (await response.get_json()).get('item_id')
+
+        response2 = await self.client.get('/items/'+item_id, headers=headers)
+        self.assertEqual(response2.status_code, 200)
+        returned_data = await response2.get_json()
+        self.assertEqual(returned_data.get('name'), 'my test item')
+        self.assertEqual(returned_data.get('public_id'), getSpecificPublicID())
+
+    async def test_create_item_slow_s3_urls_fetched_later(self):
+        self.app.config['S3_URLS_TIME_BUDGET'] = 0.05
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        with patch('app.aio.views.get_s3_urls', slow_get_s3_urls):
+            response = await self.client.post('/items', json=create_json, headers=headers)
+            returned_data = await response.get_json()
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(returned_data.get('s3_urls'), [])
+
+            await asyncio.sleep(0.3)
+            response2 = await self.client.get(returned_data.get('s3_urls_url'), headers=headers)
+            self.assertEqual(response2.status_code, 200)
+            self.assertEqual((await response2.get_json()).get('s3_urls'), ['https://some.s3.url/1'])
+
+    async def test_create_item_fail_no_name(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:8880'}
+        response = await self.client.post('/items', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await response.get_json()).get('error'), "'name' is a required property")
+
+    async def test_fetch_item_conditional(self):
+        item_id, data = await self.create_item(name="name 1")
+        headers = {'Content-type': 'application/json'}
+        response = await self.client.get('/items/'+item_id, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        response = await self.client.get('/items/'+item_id, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+    async def test_bulk_fetch_items_compressed(self):
+        item_ids = [(await self.create_item(name="name " + str(x), description='lorem ipsum ' * 400))[0]
+                    for x in range(3)]
+        for stream in ('', '?stream=1'):
+            response = await self.client.post('/items/bulk/fetch'+stream, json={'item_ids': item_ids},
+                                              headers={'Content-type': 'application/json', 'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+            returned_data = json.loads(gzip.decompress(await response.get_data()))
+            self.assertEqual([item['item_id'] for item in returned_data['items']], item_ids)
+
+    async def test_fetch_item_fields(self):
+        item_id, data = await self.create_item(name="name 1")
+        response = await self.client.get('/items/'+item_id+'?fields=name', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(await response.get_json(), {'item_id': item_id, 'name': 'name 1'})
+        full = await self.client.get('/items/'+item_id, headers={'Content-type': 'application/json'})
+        self.assertNotEqual(response.headers.get('ETag'), full.headers.get('ETag'))
+
+    async def test_bulk_fetch_items_ok(self):
+        item1_id, data1 = await self.create_item(name="name 1")
+        item2_id, data2 = await self.create_item(name="name 2")
+        response = await self.client.post('/items/bulk/fetch', headers={'Content-type': 'application/json'},
+                                          json={'item_ids': [item1_id, item2_id, str(uuid.uuid4())]})
+        self.assertEqual(response.status_code, 200)
+        returned_ids = sorted(item['item_id'] for item in (await response.get_json()).get('items'))
+        self.assertEqual(returned_ids, sorted([item1_id, item2_id]))
+
+    async def test_bulk_fetch_items_streamed(self):
+        self.app.config['BULK_FETCH_BATCH_SIZE'] = 2
+        item_ids = [(await self.create_item(name="name " + str(x)))[0] for x in range(5)]
+        missing_id = str(uuid.uuid4())
+        wanted = list(reversed(item_ids))
+        wanted.insert(2, missing_id)
+        response = await self.client.post('/items/bulk/fetch?stream=1', headers={'Content-type': 'application/json'},
+                                          json={'item_ids': wanted})
+        self.assertEqual(response.status_code, 200)
+        returned_data = await response.get_json()
+        self.assertEqual([item['item_id'] for item in returned_data.get('items')], list(reversed(item_ids)))
+        self.assertEqual(returned_data.get('missing'), [missing_id])
+
+    async def test_get_items_by_user_pagination_ok(self):
+        for x in range(7):
+            await self.create_item(name="name " + str(x), public_id=getSpecificPublicID())
+        await self.create_item(name="someone else's")
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = await self.client.get('/items', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        page1 = await response.get_json()
+        self.assertEqual(len(page1.get('items')), 5)
+        response2 = await self.client.get(page1.get('next_url'), headers=headers)
+        page2 = await response2.get_json()
+        self.assertEqual(len(page2.get('items')), 2)
+        for item in page1.get('items') + page2.get('items'):
+            self.assertEqual(item.get('public_id'), getSpecificPublicID())
+
+    async def test_get_items_by_category_ok(self):
+        for x in range(3):
+            await self.create_item(name="name " + str(x), category="sofas-new:881")
+        await self.create_item(name="fridge", category="fridges-old:1677")
+        response = await self.client.get('/items/cat/sofas-new:881', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len((await response.get_json()).get('items')), 3)
+
+    async def test_search_items_fail_no_terms(self):
+        response = await self.client.get('/items/search?q=', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_item_events_feed(self):
+        await motor_mongo.db.item_events.drop()
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = await self.client.post('/items', json={'name': 'my test item',
+                                                          'description': 'lorem ipsum lorem ipsum',
+                                                          'category': 'computers-vintage:89898'}, headers=headers)
+        item_id = (await response.get_json())['item_id']
+        # waits for a second as there's nothing after the create
+        response = await self.client.get('/items/events?wait=1', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in (await response.get_data(as_text=True)).splitlines()]
+        self.assertEqual([(event['op'], event['item_id']) for line in lines for event in line['events']],
+                         [('created', item_id)])
+        self.assertNotIn('_pending', await motor_mongo.db.items.find_one({'_id': item_id}))
+        await motor_mongo.db.item_events.drop()
+
+    async def test_patch_item(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        item_id, data = await self.create_item(public_id=getSpecificPublicID())
+        response = await self.client.patch('/items/'+item_id, headers=headers, json={'name': 'patched name'})
+        self.assertEqual(response.status_code, 200)
+        returned_data = await response.get_json()
+        self.assertEqual(returned_data['name'], 'patched name')
+        self.assertEqual(returned_data['description'], data['description'])
+        response = await self.client.patch('/items/'+str(uuid.uuid4()), headers=headers, json={'name': 'not there'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_bulk_update_and_delete_items(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        mine, data = await self.create_item(public_id=getSpecificPublicID())
+        theirs, data = await self.create_item()
+        edit = {'name': 'new name 1', 'description': 'relisted lorem ipsum', 'category': 'consoles-vintage:3341'}
+        response = await self.client.post('/items/bulk/update', headers=headers,
+                                          json={'items': [dict(edit, item_id=mine), dict(edit, item_id=theirs)]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['status'] for item in (await response.get_json())['items']], ['updated', 'not_found'])
+        response = await self.client.post('/items/bulk/delete', headers=headers, json={'item_ids': [mine, theirs]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((await response.get_json())['deleted_count'], 1)
+        self.assertIsNone(await motor_mongo.db.items.find_one({'_id': mine}))
+
+    async def test_delete_item_ok(self):
+        item_id, data = await self.create_item(public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = await self.client.delete('/items/'+item_id, headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(await motor_mongo.db.items.find_one({'_id': item_id}))
+
+
+class AsyncRouteLimitTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        config = type('LimitedConfig', (TestConfig,), {'RATE_LIMIT_BULK_FETCH': '2 per minute',
+                                                       'RATE_LIMIT_BULK_DELETE': '1 per minute'})
+        self.patch = patch('app.aio.decorators.check_access', fake_check_access)
+        self.patch.start()
+        self.app = create_async_app(config)
+        self.serving = self.app.test_app()
+        await self.serving.__aenter__()
+        self.client = self.app.test_client()
+
+    async def asyncTearDown(self):
+        await self.serving.__aexit__(None, None, None)
+        self.patch.stop()
+
+    async def test_bulk_fetch_limited(self):
+        headers = {'Content-type': 'application/json'}
+        fetch_json = {'item_ids': [str(uuid.uuid4())]}
+        for _ in range(2):
+            response = await self.client.post('/items/bulk/fetch', headers=headers, json=fetch_json)
+            self.assertEqual(response.status_code, 200)
+        response = await self.client.post('/items/bulk/fetch', headers=headers, json=fetch_json)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual((await response.get_json())['message'], 'chill out and give it a rest man')
+
+    async def test_limited_per_user(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        delete_json = {'item_ids': [str(uuid.uuid4())]}
+        response = await self.client.post('/items/bulk/delete', headers=headers, json=delete_json)
+        self.assertEqual(response.status_code, 207)
+        # same user from another address
+        response = await self.client.post('/items/bulk/delete', headers=headers, json=delete_json,
+                                          scope_base={'client': ('10.0.0.2', 1234)})
+        self.assertEqual(response.status_code, 429)
@@ -3,11 +3,16 @@
 # from unittest import mock
 import uuid
 
-from mock import patch
+from mock import patch, MagicMock
 from functools import wraps
 from .fixtures import getPublicID, getSpecificPublicID
 from flask import jsonify
 import datetime
+import time
+import gzip
+import json
+import zstandard
+from pymongo.errors import BulkWriteError
 
 # have to mock the require_access_level decorator here before it
 # gets attached to any classes or functions
@@ -33,7 +38,12 @@ patch('app.decorators.require_access_level', mock_dec).start()
 
 # from app import create_app, mongo
 from app import create_app, mongo
+from app.extensions import item_cache, item_layout
+from app.layout import DUAL, flatten
 from app.config import TestConfig
+from app.sampling import sample_category, missing_random_keys
+from app.indexes import ensure_indexes
+from app.events import EVENTS, DELETED, EventsNotRelayed, pending_markers, relay_events, resume_token
 from flask_testing import TestCase as FlaskTestCase
 
 
@@ -76,6 +86,18 @@ def create_item(**kwargs):
     return item_id, data
 
 
+def fake_s3_response(foto_ids, token):
+    r = MagicMock()
+    r.status_code = 201
+    r.json.return_value = {'aws_urls': ['https://some.s3.url/'+foto_id for foto_id in foto_ids]}
+    return r
+
+
+def slow_s3_response(foto_ids, token):
+    time.sleep(0.3)
+    return fake_s3_response(foto_ids, token)
+
+
 class MyTest(FlaskTestCase):
 
     def create_app(self):
@@ -146,6 +168,228 @@ class MyTest(FlaskTestCase):
         returned_data = response.json
         self.assertTrue(is_valid_uuid(returned_data.get('item_id')), "Invalid item UUID returned")
 
+    @patch('app.main.views.get_s3_urls', side_effect=fake_s3_response)
+    def test_create_item_with_s3_urls_ok(self, mock_s3):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        response = self.client.post('/items', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json.get('s3_urls')), int(self.app.config['FOTO_LIMIT']))
+        self.assertIsNone(response.json.get('s3_urls_url'))
+        self.assertEqual(len(mock_s3.call_args[0][0]), int(self.app.config['FOTO_LIMIT']))
+
+    @patch('app.main.views.get_s3_urls', side_effect=slow_s3_response)
+    def test_create_item_slow_s3_urls_fetched_later(self, mock_s3):
+        self.app.config['S3_URLS_TIME_BUDGET'] = 0.05
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        response = self.client.post('/items', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json.get('s3_urls'), [])
+        item_id = response.json.get('item_id')
+        self.assertEqual(response.json.get('s3_urls_url'), '/items/'+item_id+'/s3urls')
+
+        # the background request finishes and gets picked up without asking aws again
+        time.sleep(0.5)
+        response2 = self.client.get(response.json.get('s3_urls_url'), headers=headers)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(len(response2.json.get('s3_urls')), int(self.app.config['FOTO_LIMIT']))
+        self.assertEqual(mock_s3.call_count, 1)
+
+    @patch('app.main.views.get_s3_urls', side_effect=fake_s3_response)
+    def test_create_item_deferred_s3_urls(self, mock_s3):
+        self.app.config['S3_URLS_MODE'] = 'deferred'
+        mock_s3.side_effect = slow_s3_response
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        started = time.time()
+        response = self.client.post('/items', json=create_json, headers=headers)
+        self.assertLess(time.time() - started, 0.3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json.get('s3_urls'), [])
+        self.assertIsNotNone(response.json.get('s3_urls_url'))
+
+    @patch('app.main.views.get_s3_urls', side_effect=fake_s3_response)
+    def test_get_item_s3_urls_fail_not_owner(self, mock_s3):
+        item_id, data = create_item(name="name 1", public_id=getPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items/'+item_id+'/s3urls', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        mock_s3.assert_not_called()
+
+    @patch('app.main.views.get_s3_urls', side_effect=fake_s3_response)
+    def test_bulk_create_items_ok(self, mock_s3):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'items': [{'name': 'my test item ' + str(x),
+                                  'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                                  'category': 'computers-vintage:89898'} for x in range(3)]}
+        response = self.client.post('/items/bulk', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        returned_data = response.json
+        self.assertEqual(returned_data.get('created_count'), 3)
+        self.assertEqual(mock_s3.call_count, 1)
+
+        foto_limit = int(self.app.config['FOTO_LIMIT'])
+        all_urls = []
+        for x, result in enumerate(returned_data.get('items')):
+            self.assertEqual(result.get('index'), x)
+            self.assertEqual(result.get('status'), 'created')
+            self.assertEqual(len(result.get('s3_urls')), foto_limit)
+            all_urls.extend(result.get('s3_urls'))
+            stored = mongo.db.items.find_one({'_id': result.get('item_id')})
+            self.assertEqual(stored['details']['name'], 'my test item ' + str(x))
+            self.assertEqual(stored['details']['public_id'], getSpecificPublicID())
+        self.assertEqual(len(set(all_urls)), 3 * foto_limit)
+
+    @patch('app.main.views.get_s3_urls', side_effect=fake_s3_response)
+    def test_bulk_create_items_partial(self, mock_s3):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'items': [{'name': 'my test item',
+                                  'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                                  'category': 'computers-vintage:89898'},
+                                 {'name': 'myte',
+                                  'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                                  'category': 'computers-vintage:89898'}]}
+        response = self.client.post('/items/bulk', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        returned_data = response.json
+        self.assertEqual(returned_data.get('created_count'), 1)
+        self.assertEqual(returned_data['items'][0].get('status'), 'created')
+        self.assertEqual(returned_data['items'][1].get('status'), 'invalid')
+        self.assertEqual(returned_data['items'][1].get('error'), "'myte' is too short")
+        self.assertEqual(mongo.db.items.count_documents({}), 1)
+
+    def test_bulk_create_items_fail_too_many(self):
+        self.app.config['BULK_CREATE_LIMIT'] = 2
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'items': [{'name': 'my test item',
+                                  'description': 'lorem ipsum',
+                                  'category': 'computers-vintage:89898'}] * 3}
+        response = self.client.post('/items/bulk', json=create_json, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get('message'), 'Too many items, the most you can send is 2')
+
+    def test_bulk_create_items_fail_all_invalid(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.post('/items/bulk', json={'items': [{'name': 'nope'}]}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['items'][0].get('status'), 'invalid')
+        self.assertEqual(mongo.db.items.count_documents({}), 0)
+
+    def test_bulk_update_items(self):
+        when = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        mine, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        stale, data = create_item(name="name 2", public_id=getSpecificPublicID(), modified=when)
+        theirs, data = create_item(name="name 3")
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        edit = {'description': 'relisted lorem ipsum', 'category': 'consoles-vintage:3341'}
+        update_json = {'items': [dict(edit, item_id=mine, name='new name 1'),
+                                 dict(edit, item_id=stale, name='new name 2', etag='"m1"'),
+                                 dict(edit, item_id=theirs, name='new name 3'),
+                                 dict(edit, item_id=str(uuid.uuid4()), name='nope')]}
+        response = self.client.post('/items/bulk/update', json=update_json, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['status'] for item in response.json['items']],
+                         ['updated', 'conflict', 'not_found', 'invalid'])
+        self.assertEqual(response.json['updated_count'], 1)
+        self.assertEqual(mongo.db.items.find_one({'_id': mine})['details']['name'], 'new name 1')
+        self.assertEqual(mongo.db.items.find_one({'_id': stale})['details']['name'], 'name 2')
+        self.assertEqual(mongo.db.items.find_one({'_id': theirs})['details']['name'], 'name 3')
+
+        # the etag handed back is good for the next update
+        etag = response.json['items'][0]['etag']
+        update_json = {'items': [dict(edit, item_id=mine, name='newer name 1', etag=etag)]}
+        response = self.client.post('/items/bulk/update', json=update_json, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['items'][0]['status'], 'updated')
+
+    def test_bulk_update_items_fail_too_many(self):
+        self.app.config['BULK_UPDATE_LIMIT'] = 1
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        item = {'name': 'name 1', 'description': 'lorem ipsum', 'category': 'consoles-vintage:3341'}
+        update_json = {'items': [dict(item, item_id=str(uuid.uuid4())), dict(item, item_id=str(uuid.uuid4()))]}
+        response = self.client.post('/items/bulk/update', json=update_json, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_delete_items(self):
+        mine = [create_item(name="name "+str(x), public_id=getSpecificPublicID())[0] for x in range(2)]
+        theirs, data = create_item(name="name 3")
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        delete_json = {'item_ids': mine + [theirs, str(uuid.uuid4())]}
+        response = self.client.post('/items/bulk/delete', json=delete_json, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['status'] for item in response.json['items']],
+                         ['deleted', 'deleted', 'not_found', 'not_found'])
+        self.assertEqual(response.json['deleted_count'], 2)
+        self.assertEqual([doc['_id'] for doc in mongo.db.items.find()], [theirs])
+
+        response = self.client.post('/items/bulk/delete', json={'item_ids': []}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_delete_items_deleted_elsewhere(self):
+        mine = [create_item(name="name "+str(x), public_id=getSpecificPublicID())[0] for x in range(2)]
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        bulk_write = type(mongo.db.items).bulk_write
+
+        writes = []
+
+        def racing_delete(collection, requests, *args, **kwargs):
+            # another request gets to the second item just before we do
+            writes.append(len(requests))
+            if len(writes) == 1:
+                collection.delete_one({'_id': mine[1]})
+            return bulk_write(collection, requests, *args, **kwargs)
+
+        with patch.object(type(mongo.db.items), 'bulk_write', racing_delete):
+            response = self.client.post('/items/bulk/delete', json={'item_ids': mine}, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['status'] for item in response.json['items']], ['deleted', 'not_found'])
+        self.assertEqual(response.json['deleted_count'], 1)
+        events = mongo.db[EVENTS].find({'op': DELETED, 'item_id': {'$in': mine}})
+        self.assertEqual([event['item_id'] for event in events], [mine[0]])
+        # the deletes went in one write, then the relay cleared its marker
+        self.assertEqual(writes[0], 2)
+        self.assertEqual(len(writes), 2)
+
+    def test_bulk_delete_items_fail_fields(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.post('/items/bulk/delete', json={'item_ids': [item_id], 'fields': ['name']},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(mongo.db.items.count_documents({'_id': item_id}), 1)
+
+    def test_bulk_update_items_write_error(self):
+        ids = [create_item(name="name "+str(x), public_id=getSpecificPublicID())[0] for x in range(2)]
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        edit = {'name': 'new name', 'description': 'relisted lorem ipsum', 'category': 'consoles-vintage:3341'}
+        bulk_write = type(mongo.db.items).bulk_write
+        writes = []
+
+        def refused(collection, requests, *args, **kwargs):
+            # mongo turns down the first write and does the second
+            writes.append(len(requests))
+            if len(writes) > 1:
+                return bulk_write(collection, requests, *args, **kwargs)
+            result = bulk_write(collection, requests[1:], *args, **kwargs)
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 2, 'errmsg': 'bad update'}],
+                                  'nMatched': result.matched_count, 'nModified': result.modified_count})
+
+        with patch.object(type(mongo.db.items), 'bulk_write', refused):
+            response = self.client.post('/items/bulk/update', headers=headers,
+                                        json={'items': [dict(edit, item_id=item_id) for item_id in ids]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json['items'][0], {'index': 0, 'item_id': ids[0], 'status': 'failed',
+                                                     'error': 'bad update'})
+        self.assertEqual(response.json['items'][1]['status'], 'updated')
+        self.assertEqual(mongo.db.items.find_one({'_id': ids[0]})['details']['name'], 'name 0')
+
     def test_fetch_item_ok(self):
         item_id, data = create_item(name="name 1")
         headers = {'Content-type': 'application/json'}
@@ -157,6 +401,315 @@ class MyTest(FlaskTestCase):
         self.assertEqual(data.get('yarp'), returned_data.get('yarp'))
         self.assertEqual(data.get('category'), returned_data.get('category'))
 
+    def test_dates_same_format_on_every_route(self):
+        datein = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID(),
+                                    created=datein, modified=datein)
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        single = self.client.get('/items/'+item_id, headers=headers).json
+        listed = self.client.get('/items', headers=headers).json['items'][0]
+        fetched = self.client.post('/items/bulk/fetch', headers=headers, json={'item_ids': [item_id]}).json['items'][0]
+        for returned_data in (single, listed, fetched):
+            self.assertEqual(returned_data.get('created'), '2024-01-31T10:15:00.123000')
+            self.assertEqual(returned_data.get('modified'), '2024-01-31T10:15:00.123000')
+
+    def test_fetch_item_cached_until_edited(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).json.get('name'), 'name 1')
+
+        # changed behind our back - still served from the cache
+        mongo.db.items.update_one({'_id': item_id}, {'$set': {'details.name': 'sneaky name'}})
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).json.get('name'), 'name 1')
+        self.assertEqual(item_cache.stats()['hits'], 1)
+
+        edit_json = {'name': 'edited name', 'description': data['description'],
+                     'category': data['category'], 'created': 'whenever'}
+        edit_response = self.client.put('/items/'+item_id, json=edit_json, headers=headers)
+        self.assertEqual(edit_response.status_code, 200)
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).json.get('name'), 'edited name')
+
+    def test_fetch_item_cache_cleared_on_delete(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).status_code, 200)
+        self.assertEqual(self.client.delete('/items/'+item_id, headers=headers).status_code, 204)
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).status_code, 404)
+
+    def test_fetch_item_conditional(self):
+        datein = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        item_id, data = create_item(name="name 1", created=datein, modified=datein)
+        headers = {'Content-type': 'application/json'}
+        response = self.client.get('/items/'+item_id, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        self.assertEqual(response.headers.get('Last-Modified'), 'Wed, 31 Jan 2024 10:15:00 GMT')
+
+        # not cached so this only reads the modified date
+        item_cache.clear()
+        response = self.client.get('/items/'+item_id, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers.get('ETag'), etag)
+        self.assertEqual(item_cache.stats()['size'], 0)
+
+        response = self.client.get('/items/'+item_id, headers=dict(headers, **{'If-None-Match': '"m1234"'}))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/items/'+item_id,
+                                   headers=dict(headers, **{'If-Modified-Since': 'Wed, 31 Jan 2024 10:15:00 GMT'}))
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/items/'+item_id,
+                                   headers=dict(headers, **{'If-Modified-Since': 'Wed, 31 Jan 2024 10:14:59 GMT'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_item_if_match(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        etag = self.client.get('/items/'+item_id, headers=headers).headers.get('ETag')
+        edit_json = {'name': 'edited name', 'description': data['description'],
+                     'category': data['category'], 'created': 'whenever'}
+
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        new_etag = response.headers.get('ETag')
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).headers.get('ETag'), new_etag)
+
+        # someone else saved in between - the old etag is rejected
+        edit_json['name'] = 'lost update'
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 412)
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': '"nope"'}))
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(mongo.db.items.find_one({'_id': item_id})['details']['name'], 'edited name')
+
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': '*'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_item_keeps_created(self):
+        datein = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID(), created=datein)
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        edit_json = {'name': 'edited name', 'description': '$description', 'category': data['category'],
+                     'created': 'whenever'}
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['item_id'], item_id)
+        self.assertEqual(response.json['created'], '2024-01-31T10:15:00.123000')
+        details = mongo.db.items.find_one({'_id': item_id})['details']
+        self.assertEqual(details['created'], datein)
+        self.assertEqual(details['description'], '$description')
+        # it's a replace - fields they didn't send are gone
+        self.assertNotIn('yarp', details)
+
+    def test_edit_item_fail_reserved_keys(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        edit = {'name': 'edited name', 'description': data['description'], 'category': data['category']}
+        for extra in ({'details.name': 'sneaky'}, {'$where': 'x'}, {'_pending': []}, {'rand': 0.5}, {'_id': 'x'}):
+            response = self.client.put('/items/'+item_id, json=dict(edit, **extra), headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+        update_json = {'items': [dict(edit, item_id=item_id, _deleted=True)]}
+        response = self.client.post('/items/bulk/update', json=update_json, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['items'][0]['status'], 'invalid')
+        self.assertEqual(mongo.db.items.find_one({'_id': item_id})['details']['name'], 'name 1')
+
+        # what a GET hands back can be sent straight back
+        item = self.client.get('/items/'+item_id, headers=headers).json
+        response = self.client.put('/items/'+item_id, json=dict(item, name='edited name'), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('item_id', mongo.db.items.find_one({'_id': item_id})['details'])
+
+    def test_patch_item(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        etag = self.client.get('/items/'+item_id, headers=headers).headers.get('ETag')
+
+        response = self.client.patch('/items/'+item_id, json={'name': 'patched name', 'yarp': None},
+                                     headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['name'], 'patched name')
+        self.assertEqual(response.json['description'], data['description'])
+        self.assertNotIn('yarp', response.json)
+        self.assertNotEqual(response.headers.get('ETag'), etag)
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).json['name'], 'patched name')
+
+        # the old etag is stale now
+        response = self.client.patch('/items/'+item_id, json={'name': 'lost update'},
+                                     headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 412)
+
+    def test_patch_item_fail(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        other_id, data = create_item(name="name 2", public_id=getPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        for edit_json in ({}, {'name': None}, {'public_id': getPublicID()}, {'details.name': 'sneaky'}):
+            response = self.client.patch('/items/'+item_id, json=edit_json, headers=headers)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.patch('/items/'+other_id, json={'name': 'not mine'}, headers=headers)
+        self.assertEqual(response.status_code, 401)
+        response = self.client.patch('/items/'+str(uuid.uuid4()), json={'name': 'not there'}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(mongo.db.items.find_one({'_id': other_id})['details']['name'], 'name 2')
+
+    def test_bulk_fetch_items_conditional(self):
+        item_ids = [create_item(name="name " + str(x))[0] for x in range(3)]
+        headers = {'Content-type': 'application/json'}
+        create_json = {'item_ids': item_ids + [str(uuid.uuid4())]}
+        response = self.client.post('/items/bulk/fetch', headers=headers, json=create_json)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        conditional = dict(headers, **{'If-None-Match': etag})
+        response = self.client.post('/items/bulk/fetch', headers=conditional, json=create_json)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.post('/items/bulk/fetch?stream=1', headers=conditional, json=create_json)
+        self.assertEqual(response.status_code, 304)
+
+        mongo.db.items.update_one({'_id': item_ids[1]}, {'$set': {'details.modified': datetime.datetime.utcnow()}})
+        response = self.client.post('/items/bulk/fetch', headers=conditional, json=create_json)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get('ETag'), etag)
+
+    def test_bulk_fetch_items_compressed(self):
+        item_ids = [create_item(name="name " + str(x), description='lorem ipsum ' * 400)[0] for x in range(5)]
+        create_json = {'item_ids': item_ids}
+        plain = self.client.post('/items/bulk/fetch', json=create_json)
+        self.assertIsNone(plain.headers.get('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain.headers.get('Vary'))
+
+        response = self.client.post('/items/bulk/fetch', json=create_json,
+                                    headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertLess(len(response.data), len(plain.data) / 10)
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.json)
+        self.assertTrue(response.headers.get('ETag').startswith('W/'))
+
+        response = self.client.post('/items/bulk/fetch', json=create_json,
+                                    headers={'Accept-Encoding': 'gzip, zstd'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'zstd')
+        self.assertEqual(json.loads(zstandard.ZstdDecompressor().decompressobj().decompress(response.data)),
+                         plain.json)
+
+        # streamed responses are compressed as they go
+        response = self.client.post('/items/bulk/fetch?stream=1', json=create_json,
+                                    headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.json)
+
+    def test_small_responses_not_compressed(self):
+        response = self.client.get('/items/status', headers={'Content-type': 'application/json',
+                                                              'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+    def test_compressed_etag_still_works(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID(), description='lorem ipsum ' * 400)
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken', 'Accept-Encoding': 'gzip'}
+        response = self.client.get('/items/'+item_id, headers=headers)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        etag = response.headers.get('ETag')
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/items/'+item_id, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+        edit_json = {'name': 'edited name', 'description': data['description'],
+                     'category': data['category'], 'created': 'whenever'}
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_fetch_item_fields(self):
+        item_id, data = create_item(name="name 1", price=1000)
+        headers = {'Content-type': 'application/json'}
+        response = self.client.get('/items/'+item_id+'?fields=name,price', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(response.json, {'item_id': item_id, 'name': 'name 1', 'price': 1000})
+        self.assertIsNotNone(response.headers.get('ETag'))
+
+        # same again from the cache
+        self.client.get('/items/'+item_id, headers=headers)
+        response = self.client.get('/items/'+item_id+'?fields=name,price', headers=headers)
+        self.assertDictEqual(response.json, {'item_id': item_id, 'name': 'name 1', 'price': 1000})
+
+        response = self.client.get('/items/'+item_id+'?fields=name,rand', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get('error'), "'rand' is not a field you can ask for")
+
+    def test_fetch_item_fields_etag(self):
+        item_id, data = create_item(name="name 1", price=1000, public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json'}
+        full = self.client.get('/items/'+item_id, headers=headers).headers.get('ETag')
+        projected = self.client.get('/items/'+item_id+'?fields=name,price', headers=headers).headers.get('ETag')
+        self.assertNotEqual(projected, full)
+        # same fields in any order is the same body
+        response = self.client.get('/items/'+item_id+'?fields=price,name', headers=headers)
+        self.assertEqual(response.headers.get('ETag'), projected)
+
+        # a full item's etag doesn't stand in for a cut down one, or the other way round
+        response = self.client.get('/items/'+item_id+'?fields=name,price',
+                                   headers=dict(headers, **{'If-None-Match': full}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/items/'+item_id, headers=dict(headers, **{'If-None-Match': projected}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/items/'+item_id+'?fields=name,price',
+                                   headers=dict(headers, **{'If-None-Match': projected}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers.get('ETag'), projected)
+
+        # either is still good for an If-Match - it's the same item underneath
+        edit_json = {'name': 'edited name', 'description': data['description'], 'category': data['category']}
+        headers['x-access-token'] = 'somefaketoken'
+        response = self.client.put('/items/'+item_id, json=edit_json, headers=dict(headers, **{'If-Match': projected}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_items_by_user_fields(self):
+        for x in range(3):
+            create_item(name="name " + str(x), public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items?limit=2&fields=name,category', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        for item in response.json.get('items'):
+            self.assertEqual(sorted(item.keys()), ['category', 'item_id', 'name'])
+        next_url = response.json.get('next_url')
+        self.assertIn('fields=name,category', next_url)
+        response = self.client.get(next_url, headers=headers)
+        self.assertEqual(sorted(response.json['items'][0].keys()), ['category', 'item_id', 'name'])
+
+        response = self.client.get('/items?fields=name,&offset=0', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_fetch_items_fields(self):
+        item_ids = [create_item(name="name " + str(x))[0] for x in range(3)]
+        create_json = {'item_ids': item_ids, 'fields': ['name']}
+        response = self.client.post('/items/bulk/fetch', json=create_json)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get('items'),
+                         [{'item_id': item_id, 'name': 'name ' + str(x)} for x, item_id in enumerate(item_ids)])
+        self.assertIsNotNone(response.headers.get('ETag'))
+
+        streamed = self.client.post('/items/bulk/fetch?stream=1', json=create_json)
+        self.assertEqual(streamed.json.get('items'), response.json.get('items'))
+
+        # a different body from the full items, so a different etag
+        etag = response.headers.get('ETag')
+        full = self.client.post('/items/bulk/fetch', json={'item_ids': item_ids})
+        self.assertNotEqual(full.headers.get('ETag'), etag)
+        response = self.client.post('/items/bulk/fetch', json={'item_ids': item_ids},
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/items/bulk/fetch', json=create_json, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.post('/items/bulk/fetch', json={'item_ids': item_ids, 'fields': ['nope']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get('error'), "'nope' is not a field you can ask for")
+
     def test_fetch_item_fail_404(self):
         create_item(name="name 1")
         headers = {'Content-type': 'application/json'}
@@ -211,6 +764,42 @@ class MyTest(FlaskTestCase):
         self.assertEqual(returned_item1.get('name'), data1.get('name'))
         self.assertEqual(returned_item1.get('category'), data1.get('category'))
 
+    def test_bulk_fetch_items_in_request_order(self):
+        item_ids = [create_item(name="name " + str(x))[0] for x in range(4)]
+        missing_id = str(uuid.uuid4())
+        wanted = [item_ids[2], missing_id, item_ids[0], item_ids[3], item_ids[1]]
+
+        response = self.client.post('/items/bulk/fetch', json={'item_ids': wanted})
+        self.assertEqual(response.status_code, 200)
+        returned_data = response.json
+        self.assertEqual([item['item_id'] for item in returned_data.get('items')],
+                         [item_ids[2], item_ids[0], item_ids[3], item_ids[1]])
+        self.assertEqual(returned_data.get('missing'), [missing_id])
+
+    def test_bulk_fetch_items_streamed(self):
+        # over the non streaming cap, with chunks small enough that we get
+        # several of them and some chunks with nothing found at all
+        self.app.config['BULK_FETCH_MAX'] = 5
+        self.app.config['BULK_FETCH_BATCH_SIZE'] = 3
+        item_ids = [create_item(name="name " + str(x))[0] for x in range(7)]
+        missing_ids = [str(uuid.uuid4()) for _ in range(4)]
+        wanted = missing_ids[:3] + item_ids[:4] + [missing_ids[3]] + item_ids[4:]
+
+        response = self.client.post('/items/bulk/fetch', json={'item_ids': wanted})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        returned_data = response.json
+        self.assertEqual([item['item_id'] for item in returned_data.get('items')], item_ids)
+        self.assertEqual(returned_data['items'][0].get('name'), 'name 0')
+        self.assertEqual(returned_data.get('missing'), missing_ids)
+        self.assertIsNone(returned_data.get('error'))
+
+    def test_bulk_fetch_items_streamed_nothing_found(self):
+        missing_ids = [str(uuid.uuid4()) for _ in range(3)]
+        response = self.client.post('/items/bulk/fetch?stream=1', json={'item_ids': missing_ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(response.json, {'items': [], 'missing': missing_ids})
+
     def test_fail_bulk_fetch_bad_inputs_1(self):
         create_json = {'item_ids': ["some-blah", str(uuid.uuid4())]}
         headers = {'Content-type': 'application/json'}
@@ -266,7 +855,7 @@ class MyTest(FlaskTestCase):
             item_id, data = create_item(name="name " + str(x), public_id=getSpecificPublicID())
             test_data.append({"item_id": item_id, "data": data})
         headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
-        response = self.client.get('/items', headers=headers)
+        response = self.client.get('/items?offset=0', headers=headers)
         self.assertEqual(response.status_code, 200)
         returned_data = response.json
         self.assertEqual(len(returned_data.get('items')), 5)
@@ -287,6 +876,66 @@ class MyTest(FlaskTestCase):
 
         self.assertEqual(returned_data2.get('prev_url'), "/items?limit=5&offset=0&sort=id_asc")
 
+    def test_get_items_by_user_cursor_pagination_ok(self):
+        created_ids = []
+        for x in range(8):
+            item_id, data = create_item(name="name " + str(x), public_id=getSpecificPublicID())
+            created_ids.append(item_id)
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        page1 = response.json
+        self.assertEqual(len(page1.get('items')), 5)
+        self.assertIn('cursor=', page1.get('next_url'))
+        self.assertIsNone(page1.get('prev_url'))
+
+        response2 = self.client.get(page1.get('next_url'), headers=headers)
+        self.assertEqual(response2.status_code, 200)
+        page2 = response2.json
+        self.assertEqual(len(page2.get('items')), 3)
+        self.assertIsNone(page2.get('next_url'))
+
+        page_ids = [item['item_id'] for item in page1.get('items') + page2.get('items')]
+        self.assertEqual(page_ids, sorted(created_ids))
+
+        # and back again
+        response3 = self.client.get(page2.get('prev_url'), headers=headers)
+        self.assertEqual(response3.status_code, 200)
+        page3 = response3.json
+        self.assertEqual([item['item_id'] for item in page3.get('items')],
+                         [item['item_id'] for item in page1.get('items')])
+        self.assertIsNone(page3.get('prev_url'))
+        self.assertIsNotNone(page3.get('next_url'))
+
+    def test_get_items_by_user_sort_desc_ok(self):
+        created_ids = []
+        for x in range(3):
+            item_id, data = create_item(name="name " + str(x), public_id=getSpecificPublicID())
+            created_ids.append(item_id)
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items?limit=2&sort=id_desc', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        page1 = response.json
+        response2 = self.client.get(page1.get('next_url'), headers=headers)
+        page_ids = [item['item_id'] for item in page1.get('items') + response2.json.get('items')]
+        self.assertEqual(page_ids, sorted(created_ids, reverse=True))
+
+    def test_get_items_by_user_count_ok(self):
+        for x in range(7):
+            create_item(name="name " + str(x), public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items?count=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get('total_count'), 7)
+        response2 = self.client.get('/items', headers=headers)
+        self.assertIsNone(response2.json.get('total_count'))
+
+    def test_get_items_by_user_fail_bad_cursor(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.get('/items?cursor=WIBBLE', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get('message'), "Problem with your args")
+
     def test_get_items_by_user_fail_bad_offset_1(self):
         headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
         response = self.client.get('/items?limit=5&offset=WIBBLE&sort=id_asc', headers=headers)
@@ -426,6 +1075,59 @@ class MyTest(FlaskTestCase):
             del sorted_sofa_data[x]['modified']
             self.assertDictEqual(sorted_returned_items[x], sorted_sofa_data[x])
 
+    def test_get_items_by_category_fields(self):
+        for x in range(3):
+            create_item(name="name " + str(x), category="sofas-new:881")
+        headers = {'Content-type': 'application/json'}
+        response = self.client.get('/items/cat/sofas-new:881?fields=name', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json.get('items')), 3)
+        for item in response.json.get('items'):
+            self.assertEqual(sorted(item.keys()), ['item_id', 'name'])
+
+    def test_get_items_by_category_random_keys_ok(self):
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        created_ids = []
+        for x in range(25):
+            create_json = {'name': 'my test item ' + str(x),
+                           'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                           'category': 'sofas-new:881'}
+            response = self.client.post('/items', json=create_json, headers=headers)
+            created_ids.append(response.json.get('item_id'))
+        self.assertIsNotNone(mongo.db.items.find_one({'_id': created_ids[0]}).get('rand'))
+
+        response = self.client.get('/items/cat/sofas-new:881', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        returned_items = response.json.get('items')
+        self.assertEqual(len(returned_items), self.app.config['CATEGORY_SAMPLE_SIZE'])
+        returned_ids = [item['item_id'] for item in returned_items]
+        self.assertEqual(len(set(returned_ids)), len(returned_ids))
+        for item in returned_items:
+            self.assertIn(item['item_id'], created_ids)
+            self.assertNotIn('rand', item)
+
+    def test_sample_category_wraps_round(self):
+        for x in range(10):
+            mongo.db.items.insert_one({'_id': str(uuid.uuid4()),
+                                       'details': {'name': 'name ' + str(x), 'category': 'bikes:9000'},
+                                       'rand': x / 10.0})
+        items = sample_category(mongo.db.items, 'bikes:9000', 4, pivot=0.75)
+        self.assertEqual([item['rand'] for item in items], [0.8, 0.9, 0.0, 0.1])
+
+    def test_missing_random_keys(self):
+        for x in range(3):
+            mongo.db.items.insert_one({'_id': str(uuid.uuid4()),
+                                       'details': {'name': 'name ' + str(x), 'category': 'bikes:9000'}})
+        mongo.db.items.insert_one({'_id': str(uuid.uuid4()),
+                                   'details': {'name': 'name 3', 'category': 'bikes:9000'}, 'rand': 0.5})
+        # old items in a mixed category are never sampled until backfilled
+        self.assertEqual(len(sample_category(mongo.db.items, 'bikes:9000', 4)), 1)
+        self.assertEqual(missing_random_keys(mongo.db.items), 3)
+        # as backfill-rand does, bar $rand
+        mongo.db.items.update_many({'rand': {'$exists': False}}, {'$set': {'rand': 0.25}})
+        self.assertEqual(missing_random_keys(mongo.db.items), 0)
+        self.assertEqual(len(sample_category(mongo.db.items, 'bikes:9000', 4)), 4)
+
     def test_get_items_by_category_fail_bad_cat(self):
         create_item(name="fred astairmaster", category="stairlifts:8009")
         headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
@@ -442,6 +1144,107 @@ class MyTest(FlaskTestCase):
         returned_data = response.json
         self.assertEqual(returned_data.get('message'), "Nowt in that category lass")
 
+    def test_search_items_ok(self):
+        ensure_indexes(mongo.db, item_layout.mode)
+        best_id, data = create_item(name="atari console", description="boxed atari console")
+        create_item(name="sega console", description="works fine")
+        create_item(name="fred astairmaster", description="nothing to see")
+        headers = {'Content-type': 'application/json'}
+        response = self.client.get('/items/search?q=atari+console', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        items = response.json['items']
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['item_id'], best_id)
+        self.assertNotIn('_score', items[0])
+
+    def test_search_items_paging_and_category(self):
+        ensure_indexes(mongo.db, item_layout.mode)
+        for x in range(5):
+            create_item(name="atari console "+str(x))
+        create_item(name="atari console in another category", category="stairlifts:8009")
+        headers = {'Content-type': 'application/json'}
+        url = '/items/search?q=atari&limit=2&category=consoles-vintage:3341&fields=name'
+        seen = []
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['item_id'] for item in response.json['items'])
+            self.assertEqual(set(response.json['items'][0]), {'item_id', 'name'})
+            url = response.json.get('next_url')
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_search_items_fail_no_terms(self):
+        headers = {'Content-type': 'application/json'}
+        response = self.client.get('/items/search?q=+', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/items/search?q=atari&category=stairlifts:800b', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_item_events_feed(self):
+        mongo.db.item_events.drop()
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        response = self.client.post('/items', json=create_json, headers=headers)
+        item_id = response.json['item_id']
+        response = self.client.delete('/items/'+item_id, headers=headers)
+        self.assertEqual(response.status_code, 204)
+
+        response = self.client.get('/items/events', headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual([(event['op'], event['item_id']) for event in lines[0]['events']],
+                         [('created', item_id), ('deleted', item_id)])
+
+        # nothing new after the token
+        response = self.client.get('/items/events?after='+lines[0]['resume_token'],
+                                   headers={'Content-type': 'application/json'})
+        line = json.loads(response.get_data(as_text=True))
+        self.assertEqual(line, {'events': [], 'resume_token': lines[0]['resume_token']})
+        # markers and the tombstone are gone once relayed
+        self.assertIsNone(mongo.db.items.find_one({'_id': item_id}))
+        mongo.db.item_events.drop()
+
+    def test_item_events_left_for_relay(self):
+        mongo.db.item_events.drop()
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        create_json = {'name': 'my test item',
+                       'description': 'lorem ipsum lorem ipsum lorem ipsum lorem ipsum',
+                       'category': 'computers-vintage:89898'}
+        with patch('app.main.views.relay_events', side_effect=EventsNotRelayed(1, 'down')):
+            item_id = self.client.post('/items', json=create_json, headers=headers).json['item_id']
+            response = self.client.put('/items/'+item_id, json=dict(create_json, name='edited'), headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('_pending', response.json)
+            self.assertEqual(self.client.delete('/items/'+item_id, headers=headers).status_code, 204)
+
+        # the tombstone holds all three changes and reads as gone
+        self.assertEqual(len(mongo.db.items.find_one({'_id': item_id})['_pending']), 3)
+        self.assertEqual(self.client.get('/items/'+item_id, headers=headers).status_code, 404)
+        self.assertEqual(mongo.db.item_events.count_documents({}), 0)
+
+        later = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        relay_events(mongo.db, pending_markers(mongo.db.items, later))
+        self.assertEqual([event['op'] for event in mongo.db.item_events.find().sort('_id', 1)],
+                         ['created', 'updated', 'deleted'])
+        self.assertIsNone(mongo.db.items.find_one({'_id': item_id}))
+        mongo.db.item_events.drop()
+
+    def test_item_events_feed_bad_wait(self):
+        for wait in ('nan', 'inf', '-1'):
+            response = self.client.get('/items/events?wait='+wait, headers={'Content-type': 'application/json'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_item_events_feed_old_token(self):
+        old = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.app.config['EVENTS_RETENTION'] + 60)
+        response = self.client.get('/items/events?after='+resume_token(1, old),
+                                   headers={'Content-type': 'application/json'})
+        self.assertEqual(response.status_code, 410)
+
     # def test_edit_item_ok(self):
     #     item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
     #
@@ -497,8 +1300,67 @@ class MyTest(FlaskTestCase):
         edit_response = self.client.put('/items/'+str(uuid.uuid4()), json=data_to_edit, headers=headers)
         self.assertEqual(edit_response.status_code, 404)
 
+    def test_dual_layout_reads_both_shapes(self):
+        self.addCleanup(setattr, item_layout, 'mode', item_layout.mode)
+        item_layout.mode = DUAL
+        nested_id, data = create_item(name="nested", public_id=getSpecificPublicID(), category="sofas-new:881")
+        flat_id, data = create_item(name="flat", public_id=getSpecificPublicID(), category="sofas-new:881")
+        mongo.db.items.replace_one({'_id': flat_id}, flatten(mongo.db.items.find_one({'_id': flat_id})))
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+
+        response = self.client.get('/items?count=true', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(item['name'] for item in response.json['items']), ['flat', 'nested'])
+        self.assertEqual(response.json['items'][0].keys(), response.json['items'][1].keys())
+
+        response = self.client.get('/items/cat/sofas-new:881?fields=name', headers=headers)
+        self.assertEqual(sorted(response.json['items'], key=lambda item: item['name']),
+                         [{'item_id': flat_id, 'name': 'flat'}, {'item_id': nested_id, 'name': 'nested'}])
+
+        response = self.client.get('/items/'+flat_id, headers=headers)
+        self.assertEqual(response.json['name'], 'flat')
+        etag = response.headers.get('ETag')
+        response = self.client.get('/items/'+flat_id, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        # editing a nested item moves it over to the flat layout
+        etag = self.client.get('/items/'+nested_id, headers=headers).headers.get('ETag')
+        edit_json = {'name': 'edited', 'description': data['description'],
+                     'category': data['category'], 'created': 'whenever'}
+        response = self.client.put('/items/'+nested_id, json=edit_json, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        record = mongo.db.items.find_one({'_id': nested_id})
+        self.assertNotIn('details', record)
+        self.assertEqual(record['name'], 'edited')
+        self.assertIn('rand', record)
+
+        response = self.client.patch('/items/'+flat_id, json={'name': 'patched'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mongo.db.items.find_one({'_id': flat_id})['name'], 'patched')
+        other_id, data = create_item(name="nested", public_id=getSpecificPublicID())
+        response = self.client.patch('/items/'+other_id, json={'name': 'patched'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mongo.db.items.find_one({'_id': other_id})['details']['name'], 'patched')
+
+        response = self.client.delete('/items/'+flat_id, headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(mongo.db.items.find_one({'_id': flat_id}))
+
     def test_delete_item_ok(self):
         item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
         headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
         response = self.client.delete('/items/'+item_id, headers=headers)
-        self.assertEqual(response.status_code, 204)
\ No newline at end of file
+        self.assertEqual(response.status_code, 204)
+
+    def test_delete_item_removes_item(self):
+        item_id, data = create_item(name="name 1", public_id=getSpecificPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        response = self.client.delete('/items/'+item_id, headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(mongo.db.items.find_one({'_id': item_id}))
+
+    def test_delete_item_not_owner(self):
+        item_id, data = create_item(name="name 1", public_id=getPublicID())
+        headers = {'Content-type': 'application/json', 'x-access-token': 'somefaketoken'}
+        self.client.delete('/items/'+item_id, headers=headers)
+        self.assertIsNotNone(mongo.db.items.find_one({'_id': item_id}))
@@ -0,0 +1,47 @@
+# app/tests/test_assertions.py
+import uuid
+from unittest import TestCase
+from jsonschema.exceptions import ValidationError as JsonValidationError
+from app.assertions import assert_valid_schema, get_validator, _bulk_items_fast_check
+from app.layout import RESERVED
+
+
+###############################################################################
+#                          schema validation tests                            #
+###############################################################################
+
+class AssertionsTest(TestCase):
+
+    def test_validators_compiled_once(self):
+        self.assertIs(get_validator('item'), get_validator('item'))
+
+    def test_item_schemas_reject_reserved_keys(self):
+        item = {'name': 'name 1', 'description': 'lorem ipsum', 'category': 'bikes:9000'}
+        for key in RESERVED + ('$set', 'a.b'):
+            if key == 'item_id':
+                continue
+            with self.assertRaises(JsonValidationError):
+                assert_valid_schema(dict(item, **{key: 1}), 'item')
+        for key in RESERVED + ('$set', 'a.b', 'public_id', 'created', 'modified'):
+            with self.assertRaises(JsonValidationError):
+                assert_valid_schema({key: 1}, 'item_patch')
+
+    def test_fast_path_accepts_valid_ids(self):
+        data = {'item_ids': [str(uuid.uuid4()) for _ in range(100)]}
+        self.assertTrue(_bulk_items_fast_check(data))
+        self.assertIsNone(assert_valid_schema(data, 'bulk_items'))
+
+    def test_fast_path_defers_duplicates(self):
+        item_id = str(uuid.uuid4())
+        data = {'item_ids': [item_id, item_id]}
+        self.assertFalse(_bulk_items_fast_check(data))
+        with self.assertRaises(JsonValidationError) as cm:
+            assert_valid_schema(data, 'bulk_items')
+        self.assertIn('non-unique elements', cm.exception.message)
+
+    def test_fast_path_defers_too_many_ids(self):
+        max_items = get_validator('bulk_items').schema['properties']['item_ids']['maxItems']
+        data = {'item_ids': [str(uuid.uuid4()) for _ in range(max_items + 1)]}
+        self.assertFalse(_bulk_items_fast_check(data))
+        with self.assertRaises(JsonValidationError):
+            assert_valid_schema(data, 'bulk_items')
@@ -0,0 +1,213 @@
+# app/tests/test_cache.py
+import asyncio
+import datetime
+from unittest import TestCase
+from flask import Flask
+from mock import patch, MagicMock
+from .fixtures import getSpecificPublicID
+from app.cache import TTLCache, SharedCache, MemoryStore, PluggableCache
+from app.decorators import check_access
+from app.extensions import access_cache
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_response(status_code, json_data=None):
+    r = MagicMock()
+    r.status_code = status_code
+    r.json.return_value = json_data or {}
+    return r
+
+
+###############################################################################
+#                              ttl cache tests                                #
+###############################################################################
+
+class TTLCacheTest(TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=3, ttl=60, negative_ttl=5, timer=self.timer)
+
+    def test_hit_and_miss_counted(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_entries_expire(self):
+        self.cache.set('a', 1)
+        self.timer.now += 61
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_negative_entries_expire_sooner(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, negative=True)
+        self.timer.now += 6
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        # touch 'a' so 'b' is the least recently used
+        self.cache.get('a')
+        self.cache.set('d', 4)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(len(self.cache), 3)
+
+
+###############################################################################
+#                             shared cache tests                              #
+###############################################################################
+
+class SharedCacheTest(TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.store = MemoryStore(timer=self.timer)
+        self.cache = SharedCache(store=self.store, ttl=30, namespace='test:')
+
+    def test_docs_round_trip(self):
+        when = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        doc = {'_id': 'abc', 'details': {'name': 'thing', 'created': when}}
+        self.cache.set('abc', doc)
+        self.assertDictEqual(self.cache.get('abc'), doc)
+        # another worker with the same store sees it too
+        other = SharedCache(store=self.store, ttl=30, namespace='test:')
+        self.assertDictEqual(other.get('abc'), doc)
+
+    def test_entries_expire_and_delete(self):
+        self.cache.set('a', {'x': 1})
+        self.cache.set('b', {'x': 2})
+        self.cache.delete('b')
+        self.assertIsNone(self.cache.get('b'))
+        self.timer.now += 31
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_hit_rate(self):
+        self.cache.set('a', {'x': 1})
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('nope')
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.75)
+
+    def test_store_down_is_a_miss(self):
+        store = MagicMock()
+        store.get.side_effect = ConnectionError('nope')
+        store.set.side_effect = ConnectionError('nope')
+        cache = SharedCache(store=store, ttl=30)
+        cache.set('a', {'x': 1})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['errors'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class PluggableCacheTest(TestCase):
+
+    def make_app(self, **config):
+        app = Flask(__name__)
+        app.config.update(config)
+        return app
+
+    def test_backends(self):
+        cache = PluggableCache()
+        cache.init_app(self.make_app(ITEM_CACHE_BACKEND='local', ITEM_CACHE_SIZE=5), 'ITEM_CACHE')
+        self.assertIsInstance(cache.backend, TTLCache)
+        self.assertEqual(cache.backend.maxsize, 5)
+
+        cache.init_app(self.make_app(ITEM_CACHE_BACKEND='shared', ITEM_CACHE_URL='memory://'), 'ITEM_CACHE')
+        self.assertIsInstance(cache.backend, SharedCache)
+        cache.set('a', {'x': 1})
+        self.assertEqual(cache.get('a'), {'x': 1})
+
+        cache.init_app(self.make_app(ITEM_CACHE_BACKEND='none', ITEM_CACHE_SIZE=5), 'ITEM_CACHE')
+        cache.set('a', {'x': 1})
+        self.assertIsNone(cache.get('a'))
+
+    def test_shared_store_off_the_loop(self):
+        cache = PluggableCache()
+
+        async def round_trip():
+            await cache.set_async('a', {'x': 1})
+            value = await cache.get_async('a')
+            await cache.delete_async('a')
+            return value, await cache.get_async('a')
+
+        cache.init_app(self.make_app(ITEM_CACHE_BACKEND='shared', ITEM_CACHE_URL='memory://'), 'ITEM_CACHE')
+        with patch('app.cache.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+            self.assertEqual(asyncio.run(round_trip()), ({'x': 1}, None))
+        self.assertEqual(to_thread.call_count, 4)
+
+        cache.init_app(self.make_app(ITEM_CACHE_BACKEND='local'), 'ITEM_CACHE')
+        with patch('app.cache.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+            self.assertEqual(asyncio.run(round_trip()), ({'x': 1}, None))
+        to_thread.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            cache.init_app(self.make_app(ITEM_CACHE_BACKEND='memcached'), 'ITEM_CACHE')
+
+
+###############################################################################
+#                           access check cache tests                          #
+###############################################################################
+
+class CheckAccessTest(TestCase):
+
+    def setUp(self):
+        access_cache.clear()
+
+    @patch('app.decorators.call_requests')
+    def test_positive_result_cached(self, mock_call):
+        mock_call.return_value = fake_response(200, {'public_id': getSpecificPublicID()})
+        for _ in range(3):
+            pub_id, message, status = check_access('sometoken', 10)
+            self.assertEqual(pub_id, getSpecificPublicID())
+        self.assertEqual(mock_call.call_count, 1)
+
+    @patch('app.decorators.call_requests')
+    def test_cache_keyed_on_access_level(self, mock_call):
+        mock_call.return_value = fake_response(200, {'public_id': getSpecificPublicID()})
+        check_access('sometoken', 10)
+        check_access('sometoken', 99)
+        self.assertEqual(mock_call.call_count, 2)
+
+    @patch('app.decorators.call_requests')
+    def test_denial_cached(self, mock_call):
+        mock_call.return_value = fake_response(401)
+        for _ in range(2):
+            pub_id, message, status = check_access('badtoken', 10)
+            self.assertIsNone(pub_id)
+            self.assertEqual(message, 'Ooh you are naughty!')
+        self.assertEqual(mock_call.call_count, 1)
+
+    @patch('app.decorators.call_requests')
+    def test_auth_service_down_not_cached(self, mock_call):
+        mock_call.return_value = None
+        pub_id, message, status = check_access('sometoken', 10)
+        self.assertIsNone(pub_id)
+        self.assertEqual(status, 503)
+        check_access('sometoken', 10)
+        self.assertEqual(mock_call.call_count, 2)
+
+    @patch('app.decorators.call_requests')
+    def test_server_error_not_cached(self, mock_call):
+        mock_call.return_value = fake_response(503)
+        check_access('sometoken', 10)
+        check_access('sometoken', 10)
+        self.assertEqual(mock_call.call_count, 2)
@@ -0,0 +1,190 @@
+# app/tests/test_events.py
+import datetime
+from unittest import TestCase
+from app import create_app, mongo
+from app.config import TestConfig
+from app.events import EVENTS, PENDING, TOMBSTONE, CREATED, UPDATED, DELETED, EventsNotRelayed, new_marker, \
+    marked, with_marker, delete_request, live, event_docs, relay_events, pending_markers, resume_token, \
+    parse_feed_args, token_expired, compact_events
+from app.indexes import ensure_indexes
+from app.pagination import encode_cursor, NEXT
+from flask_testing import TestCase as FlaskTestCase
+from pymongo.errors import AutoReconnect
+from unittest.mock import patch
+
+
+###############################################################################
+#                              event helper tests                             #
+###############################################################################
+
+class EventHelpersTest(TestCase):
+
+    def test_event_docs_numbered_in_order(self):
+        at = datetime.datetime(2024, 1, 31)
+        first, second = new_marker(CREATED, 'p1'), new_marker(UPDATED, 'p1')
+        docs = event_docs([('a', first), ('b', second)], 7, at)
+        self.assertEqual([(doc['_id'], doc['item_id'], doc['op'], doc['marker']) for doc in docs],
+                         [(8, 'a', CREATED, first['id']), (9, 'b', UPDATED, second['id'])])
+
+    def test_with_marker(self):
+        marker = new_marker(UPDATED, 'p1')
+        self.assertEqual(with_marker({'$set': {'name': 'x'}}, marker),
+                         {'$set': {'name': 'x'}, '$push': {PENDING: marker}})
+        pipeline = with_marker([{'$set': {'name': 'x'}}], marker)
+        self.assertEqual(pipeline[-1]['$set'][PENDING]['$concatArrays'][1], {'$literal': [marker]})
+        # events off
+        self.assertEqual(with_marker({'$set': {'name': 'x'}}, None), {'$set': {'name': 'x'}})
+        self.assertEqual(marked({'_id': 'a'}, None), {'_id': 'a'})
+
+    def test_delete_request(self):
+        self.assertEqual(delete_request({'_id': 'a'}, None)._filter, {'_id': 'a'})
+        self.assertEqual(type(delete_request({'_id': 'a'}, None)).__name__, 'DeleteOne')
+        self.assertEqual(type(delete_request({'_id': 'a'}, new_marker(DELETED, 'p1'))).__name__, 'UpdateOne')
+
+    def test_resume_token_round_trip(self):
+        at = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        after, after_at, limit, wait = parse_feed_args({'after': resume_token(12, at)}, 500, 30)
+        self.assertEqual((after, after_at, limit, wait), (12, at, 500, 0))
+
+    def test_parse_feed_args(self):
+        self.assertEqual(parse_feed_args({}, 500, 30), (0, None, 500, 0))
+        # limit and wait are capped
+        self.assertEqual(parse_feed_args({'limit': '9999', 'wait': '600'}, 500, 30)[2:], (500, 30))
+        for args in ({'limit': '0'}, {'wait': '-1'}, {'wait': 'nan'}, {'wait': 'inf'}, {'after': 'rubbish'},
+                     {'after': encode_cursor({'k': 'abc', 't': 1, 'd': NEXT})}):
+            with self.assertRaises(ValueError):
+                parse_feed_args(args, 500, 30)
+
+    def test_token_expired(self):
+        now = datetime.datetime(2024, 1, 31)
+        self.assertFalse(token_expired(None, 60, now))
+        self.assertFalse(token_expired(now - datetime.timedelta(seconds=30), 60, now))
+        self.assertTrue(token_expired(now - datetime.timedelta(seconds=90), 60, now))
+
+
+class EventStoreTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        mongo.db[EVENTS].drop()
+        mongo.db.items.drop()
+        ensure_indexes(mongo.db)
+
+    def tearDown(self):
+        mongo.db[EVENTS].drop()
+        mongo.db.items.drop()
+
+    def change(self, item_id, op, public_id='p1', at=None):
+        # makes a change the way the views do and returns what to relay
+        marker = new_marker(op, public_id, at)
+        if op == CREATED:
+            mongo.db.items.insert_one(marked({'_id': item_id, 'details': {'public_id': public_id}}, marker))
+        elif op == UPDATED:
+            mongo.db.items.update_one({'_id': item_id}, with_marker({'$set': {'details.name': 'x'}}, marker))
+        else:
+            mongo.db.items.bulk_write([delete_request({'_id': item_id}, marker)])
+        return [(item_id, marker)]
+
+    def feed(self):
+        return [(event['_id'], event['op'], event['item_id']) for event in mongo.db[EVENTS].find().sort('_id', 1)]
+
+    def test_relay_numbers_carry_on(self):
+        relay_events(mongo.db, self.change('a', CREATED) + self.change('b', CREATED))
+        relay_events(mongo.db, self.change('a', UPDATED))
+        self.assertEqual(self.feed(), [(1, CREATED, 'a'), (2, CREATED, 'b'), (3, UPDATED, 'a')])
+        # nothing left on the items
+        self.assertEqual(mongo.db.items.count_documents({PENDING: {'$exists': True}}), 0)
+
+    def test_marker_saved_with_the_change(self):
+        self.change('a', CREATED)
+        self.change('a', UPDATED)
+        item = mongo.db.items.find_one({'_id': 'a'})
+        self.assertEqual([marker['op'] for marker in item[PENDING]], [CREATED, UPDATED])
+        self.assertEqual(item['details']['name'], 'x')
+
+    def test_tombstone_until_relayed(self):
+        relay_events(mongo.db, self.change('a', CREATED))
+        pending = self.change('a', DELETED)
+        tombstone = mongo.db.items.find_one({'_id': 'a'})
+        self.assertEqual(set(tombstone), {'_id', PENDING, TOMBSTONE})
+        self.assertIsNone(mongo.db.items.find_one(live({'_id': 'a'})))
+        relay_events(mongo.db, pending)
+        self.assertIsNone(mongo.db.items.find_one({'_id': 'a'}))
+        self.assertEqual(self.feed(), [(1, CREATED, 'a'), (2, DELETED, 'a')])
+
+    def test_tombstone_kept_while_other_changes_pending(self):
+        created = self.change('a', CREATED)
+        relay_events(mongo.db, self.change('a', DELETED))
+        self.assertIsNotNone(mongo.db.items.find_one({'_id': 'a'}))
+        relay_events(mongo.db, created)
+        self.assertIsNone(mongo.db.items.find_one({'_id': 'a'}))
+
+    def test_relay_takes_next_number_when_beaten_to_it(self):
+        pending = self.change('a', CREATED)
+        insert_many = type(mongo.db[EVENTS]).insert_many
+        calls = []
+
+        def racing_insert(collection, docs, **kwargs):
+            calls.append([doc['_id'] for doc in docs])
+            if len(calls) == 1:
+                # another relay got there first
+                collection.insert_one({'_id': docs[0]['_id'], 'op': CREATED, 'item_id': 'z', 'marker': 'z'})
+            return insert_many(collection, docs, **kwargs)
+
+        with patch.object(type(mongo.db[EVENTS]), 'insert_many', racing_insert):
+            written = relay_events(mongo.db, pending)
+        self.assertEqual(calls, [[1], [2]])
+        self.assertEqual([doc['_id'] for doc in written], [2])
+        self.assertEqual(self.feed(), [(1, CREATED, 'z'), (2, CREATED, 'a')])
+
+    def test_relayed_twice_is_one_event(self):
+        # as if the process died after the insert but before the markers
+        # were cleared
+        pending = self.change('a', CREATED) + self.change('b', CREATED)
+        with patch.object(type(mongo.db.items), 'bulk_write', side_effect=AutoReconnect('gone')):
+            with self.assertRaises(AutoReconnect):
+                relay_events(mongo.db, pending)
+        later = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        self.assertEqual(len(pending_markers(mongo.db.items, later)), 2)
+        self.assertEqual(relay_events(mongo.db, pending), [])
+        self.assertEqual(self.feed(), [(1, CREATED, 'a'), (2, CREATED, 'b')])
+        self.assertEqual(pending_markers(mongo.db.items, later), [])
+
+    def test_relay_gives_up_and_leaves_markers(self):
+        pending = self.change('a', CREATED)
+        with patch.object(type(mongo.db[EVENTS]), 'insert_many', side_effect=AutoReconnect('down')), \
+                patch('app.events.RETRY_DELAY', 0):
+            with self.assertRaises(EventsNotRelayed) as cm:
+                relay_events(mongo.db, pending)
+        self.assertEqual(cm.exception.count, 1)
+        self.assertEqual(self.feed(), [])
+        # relay-events picks it up later
+        later = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        relay_events(mongo.db, pending_markers(mongo.db.items, later))
+        self.assertEqual(self.feed(), [(1, CREATED, 'a')])
+
+    def test_pending_markers_oldest_first(self):
+        now = datetime.datetime.utcnow()
+        self.change('b', CREATED, at=now - datetime.timedelta(seconds=3))
+        self.change('a', CREATED, at=now - datetime.timedelta(seconds=2))
+        self.change('b', UPDATED, at=now - datetime.timedelta(seconds=1))
+        self.assertEqual([(item_id, marker['op']) for item_id, marker in pending_markers(mongo.db.items, now)],
+                         [('b', CREATED), ('a', CREATED), ('b', UPDATED)])
+        self.assertEqual(pending_markers(mongo.db.items, now - datetime.timedelta(hours=1)), [])
+
+    def test_compact_keeps_latest_per_item(self):
+        relay_events(mongo.db, self.change('a', CREATED) + self.change('b', CREATED))
+        relay_events(mongo.db, self.change('a', UPDATED))
+        relay_events(mongo.db, self.change('a', DELETED))
+        deleted = compact_events(mongo.db[EVENTS], datetime.datetime.utcnow() + datetime.timedelta(seconds=1))
+        self.assertEqual(deleted, 2)
+        self.assertEqual([(event['_id'], event['op']) for event in mongo.db[EVENTS].find().sort('_id', 1)],
+                         [(2, CREATED), (4, DELETED)])
+
+    def test_compact_leaves_recent_events(self):
+        relay_events(mongo.db, self.change('a', CREATED))
+        relay_events(mongo.db, self.change('a', UPDATED))
+        deleted = compact_events(mongo.db[EVENTS], datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+        self.assertEqual(deleted, 0)
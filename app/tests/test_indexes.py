@@ -0,0 +1,60 @@
+# app/tests/test_indexes.py
+from app import create_app, mongo
+from app.config import TestConfig
+from app.indexes import indexes_for, ensure_indexes, missing_indexes, plan_stages, _normalise_keys
+from app.layout import NESTED, DUAL
+from flask_testing import TestCase as FlaskTestCase
+
+
+###############################################################################
+#                           index management tests                            #
+###############################################################################
+
+class IndexesTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        mongo.db.items.drop()
+        mongo.db.item_events.drop()
+
+    def tearDown(self):
+        mongo.db.items.drop()
+        mongo.db.item_events.drop()
+
+    def test_all_missing_on_empty_collection(self):
+        self.assertEqual(len(missing_indexes(mongo.db)), sum(len(specs) for specs in indexes_for(NESTED).values()))
+
+    def test_ensure_indexes(self):
+        ensure_indexes(mongo.db)
+        self.assertEqual(missing_indexes(mongo.db), [])
+        # and again is fine
+        ensure_indexes(mongo.db)
+        self.assertEqual(missing_indexes(mongo.db), [])
+
+    def test_dual_layout_needs_flat_indexes_too(self):
+        ensure_indexes(mongo.db)
+        self.assertEqual([spec['name'] for collection, spec in missing_indexes(mongo.db, DUAL)],
+                         ['flat_public_id_id', 'flat_category_rand'])
+        ensure_indexes(mongo.db, DUAL)
+        self.assertEqual(missing_indexes(mongo.db, DUAL), [])
+
+    def test_text_index_keys(self):
+        # mongo reports text indexes by their _fts keys rather than the fields
+        text_spec = [spec for spec in indexes_for(NESTED)['items'] if spec['name'] == 'item_text'][0]
+        self.assertEqual(_normalise_keys(text_spec['keys']), _normalise_keys({'_fts': 'text', '_ftsx': 1}))
+
+    def test_plan_stages_flags_collscan(self):
+        explained = {'queryPlanner': {
+            'winningPlan': {'stage': 'LIMIT',
+                            'inputStage': {'stage': 'COLLSCAN'}},
+            'rejectedPlans': [{'stage': 'IXSCAN'}]}}
+        self.assertEqual(plan_stages(explained), ['LIMIT', 'COLLSCAN'])
+
+    def test_plan_stages_aggregate(self):
+        explained = {'stages': [
+            {'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'FETCH',
+                                                          'inputStage': {'stage': 'IXSCAN'}}}}},
+            {'$sample': {'size': 20}}]}
+        self.assertEqual(plan_stages(explained), ['FETCH', 'IXSCAN'])
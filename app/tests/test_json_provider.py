@@ -0,0 +1,68 @@
+# app/tests/test_json_provider.py
+import datetime
+import decimal
+import json
+from unittest import TestCase
+from bson import ObjectId
+from flask import Flask
+from app.json_provider import StdJSONProvider, OrjsonProvider, json_provider_class
+
+
+###############################################################################
+#                            json provider tests                              #
+###############################################################################
+
+class JsonProviderTest(TestCase):
+
+    def setUp(self):
+        # providers only keep a weak reference to the app
+        self.app = Flask(__name__)
+        self.std = StdJSONProvider(self.app)
+        self.fast = OrjsonProvider(self.app)
+
+    def test_dates_same_format_for_both(self):
+        when = datetime.datetime(2024, 1, 31, 10, 15, 0, 123000)
+        oid = ObjectId()
+        data = {'created': when, 'day': when.date(), 'price': decimal.Decimal('9.99'), 'oid': oid}
+        for provider in (self.std, self.fast):
+            self.assertDictEqual(json.loads(provider.dumps(data)),
+                                 {'created': '2024-01-31T10:15:00.123000',
+                                  'day': '2024-01-31',
+                                  'price': '9.99',
+                                  'oid': str(oid)})
+
+    def test_whole_second_dates_keep_microseconds(self):
+        data = {'created': datetime.datetime(2024, 1, 31, 10, 15, 0),
+                'aware': datetime.datetime(2024, 1, 31, 10, 15, 0, tzinfo=datetime.timezone.utc)}
+        for provider in (self.std, self.fast):
+            self.assertDictEqual(json.loads(provider.dumps(data)),
+                                 {'created': '2024-01-31T10:15:00.000000',
+                                  'aware': '2024-01-31T10:15:00.000000+00:00'})
+
+    def test_same_output_as_std(self):
+        data = {'name': 'café \U0001F600', 'count': 3, 'ok': True, 'nowt': None,
+                'list': [1.5, 'two'], 1: 'non string key'}
+        self.assertEqual(json.loads(self.fast.dumps(data)), json.loads(self.std.dumps(data)))
+
+    def test_falls_back_to_std_for_awkward_values(self):
+        # orjson won't do either of these
+        data = {'big': 2**70, 'lone': '\ud800'}
+        self.assertEqual(self.fast.dumps(data), self.std.dumps(data))
+        self.assertEqual(self.fast.loads(self.fast.dumps(data)), data)
+        self.assertEqual(self.fast.loads('{"n": Infinity}'), {'n': float('inf')})
+
+    def test_bad_json_raises_same_error(self):
+        with self.assertRaises(json.JSONDecodeError):
+            self.fast.loads('{"nope": ')
+        with self.assertRaises(TypeError):
+            self.fast.dumps({'thing': object()})
+
+    def test_response(self):
+        response = self.fast.response({'a': 1})
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(json.loads(response.get_data()), {'a': 1})
+
+    def test_provider_class_lookup(self):
+        self.assertIs(json_provider_class('std'), StdJSONProvider)
+        with self.assertRaises(ValueError):
+            json_provider_class('ujson')
@@ -0,0 +1,101 @@
+# app/tests/test_layout.py
+import datetime
+from unittest import TestCase
+from app import create_app, mongo
+from app.config import TestConfig
+from app.indexes import indexes_for, query_shapes
+from app.layout import Layout, NESTED, DUAL, FLAT, flatten, item_value, migrate_batch, nested_count
+from app.main.helpers import reshape_item, format_document
+from flask_testing import TestCase as FlaskTestCase
+
+
+def nested_doc(item_id, **details):
+    details.setdefault('name', 'thing')
+    return {'_id': item_id, 'details': details, 'rand': 0.5}
+
+
+###############################################################################
+#                               layout tests                                  #
+###############################################################################
+
+class LayoutTest(TestCase):
+
+    def test_match(self):
+        self.assertEqual(Layout(NESTED).match('public_id', 'abc'), {'details.public_id': 'abc'})
+        self.assertEqual(Layout(FLAT).match('public_id', 'abc'), {'public_id': 'abc'})
+        self.assertEqual(Layout(DUAL).match('public_id', 'abc'),
+                         {'$or': [{'public_id': 'abc'}, {'details.public_id': 'abc'}]})
+
+    def test_projection(self):
+        self.assertIsNone(Layout(DUAL).projection(None))
+        self.assertEqual(Layout(FLAT).projection(['name'], 'modified'), {'name': 1, 'modified': 1})
+        self.assertEqual(Layout(DUAL).projection(['name']), {'name': 1, 'details.name': 1})
+
+    def test_stored(self):
+        data = {'name': 'thing', '_id': 'sneaky', 'rand': 2, 'details': {}}
+        self.assertEqual(Layout(NESTED).stored('abc', {'name': 'thing'}, 0.5),
+                         {'_id': 'abc', 'details': {'name': 'thing'}, 'rand': 0.5})
+        self.assertEqual(Layout(FLAT).stored('abc', data, 0.5), {'_id': 'abc', 'name': 'thing', 'rand': 0.5})
+
+    def test_unknown_layout(self):
+        app = create_app(TestConfig)
+        app.config['ITEM_LAYOUT'] = 'sideways'
+        with self.assertRaises(ValueError):
+            Layout().init_app(app)
+
+    def test_flatten(self):
+        self.assertEqual(flatten(nested_doc('abc', category='cars:2000')),
+                         {'_id': 'abc', 'name': 'thing', 'category': 'cars:2000', 'rand': 0.5})
+
+    def test_both_shapes_read_the_same(self):
+        when = datetime.datetime(2024, 1, 31, 10, 15)
+        nested = nested_doc('abc', modified=when)
+        flat = flatten(nested)
+        self.assertEqual(item_value(nested, 'modified'), when)
+        self.assertEqual(item_value(flat, 'modified'), when)
+        self.assertEqual(format_document(nested), format_document(flat))
+        self.assertEqual(format_document(nested, ['name']), format_document(flat, ['name']))
+        # format_document leaves the (possibly cached) doc alone
+        self.assertIn('_id', flat)
+        self.assertEqual(reshape_item(flat), {'item_id': 'abc', 'name': 'thing', 'modified': when})
+
+    def test_indexes_for(self):
+        names = lambda layout: [spec['name'] for spec in indexes_for(layout)['items']]
+        self.assertEqual(names(NESTED), ['public_id_id', 'category_rand', 'item_text', 'pending_at'])
+        self.assertEqual(names(FLAT), ['flat_public_id_id', 'flat_category_rand', 'item_text', 'pending_at'])
+        self.assertEqual(len(names(DUAL)), 6)
+        self.assertEqual(query_shapes(FLAT)['count_items_by_user']['query'],
+                         {'public_id': '00000000-0000-4000-8000-000000000000'})
+
+
+###############################################################################
+#                              migration tests                                #
+###############################################################################
+
+class MigrationTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        mongo.db.items.drop()
+
+    def tearDown(self):
+        mongo.db.items.drop()
+
+    def test_migrate_in_batches(self):
+        mongo.db.items.insert_many([nested_doc('id-'+str(x)) for x in range(5)])
+        mongo.db.items.insert_one({'_id': 'id-9', 'name': 'already flat', 'rand': 0.1})
+
+        converted, after = migrate_batch(mongo.db.items, batch_size=2)
+        self.assertEqual((converted, after), (2, 'id-1'))
+        self.assertEqual(nested_count(mongo.db.items), 3)
+
+        # carries on from where it got to
+        converted, after = migrate_batch(mongo.db.items, after, batch_size=10)
+        self.assertEqual((converted, after), (3, 'id-4'))
+        self.assertEqual(migrate_batch(mongo.db.items, after), (0, None))
+
+        self.assertEqual(nested_count(mongo.db.items), 0)
+        self.assertEqual(mongo.db.items.find_one({'_id': 'id-3'}), {'_id': 'id-3', 'name': 'thing', 'rand': 0.5})
+        self.assertEqual(mongo.db.items.find_one({'_id': 'id-9'})['name'], 'already flat')
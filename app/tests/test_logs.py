@@ -0,0 +1,123 @@
+# app/tests/test_logs.py
+import json
+import logging
+import sys
+import threading
+from unittest import TestCase
+from app.logs import JsonFormatter, RequestSampler, LogQueueHandler, install_queue_handler
+
+
+class ListHandler(logging.Handler):
+    # keeps what it's given. blocks while gate is clear so the queue backs up
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.waiting = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record):
+        self.waiting.set()
+        self.gate.wait()
+        self.records.append(record)
+
+
+class FakeRule(object):
+    rule = '/items/<uuid:item_id>'
+
+
+class FakeRequest(object):
+    method = 'GET'
+    url_rule = FakeRule()
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+
+###############################################################################
+#                                  log tests                                  #
+###############################################################################
+
+class LogsTest(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_logs.' + self._testMethodName)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.target = ListHandler()
+
+    def tearDown(self):
+        self.target.gate.set()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def test_json_lines(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.logger.makeRecord('test_logs', logging.ERROR, 'views.py', 12, 'saved [%s]', ('abc',),
+                                            sys.exc_info())
+        record.route = '/items'
+        line = json.loads(JsonFormatter().format(record))
+        self.assertEqual(line['message'], 'saved [abc]')
+        self.assertEqual(line['level'], 'ERROR')
+        self.assertEqual(line['where'], 'views.py:12')
+        self.assertEqual(line['route'], '/items')
+        self.assertIn('ValueError: boom', line['exc'])
+
+    def test_records_written_by_listener(self):
+        handler = install_queue_handler(self.logger, [self.target], 100)
+        self.logger.info('item [%s] %s', 'abc', {'a': 1})
+        handler.stop()
+        self.assertEqual([record.getMessage() for record in self.target.records], ["item [abc] {'a': 1}"])
+
+    def test_full_queue_drops_and_counts(self):
+        handler = install_queue_handler(self.logger, [self.target], 2)
+        self.target.gate.clear()
+        self.logger.warning('stuck with the writer')
+        self.assertTrue(self.target.waiting.wait(5))
+        for x in range(10):
+            self.logger.warning('line %d', x)
+        self.assertEqual(handler.dropped, 8)
+        self.target.gate.set()
+        handler.stop()
+        self.assertEqual(len(self.target.records), 3)
+
+    def test_install_replaces_last_handler(self):
+        stderr = logging.StreamHandler()
+        self.logger.addHandler(stderr)
+        first = install_queue_handler(self.logger, [self.target], 100)
+        second = install_queue_handler(self.logger, [ListHandler()], 100)
+        self.assertEqual(self.logger.handlers, [second])
+        self.assertIsNone(first.listener)
+        self.assertIn(stderr, second.inherited)
+        self.assertNotIn(self.target, second.handlers + second.inherited)
+
+    def test_sampling_per_request(self):
+        sampler = RequestSampler(0, ['get_item'])
+        handler = install_queue_handler(self.logger, [self.target], 100, sampler)
+        sampler.start(FakeRequest('main.get_item'))
+        self.logger.info('sampled out')
+        self.logger.warning('always kept')
+        sampler.start(FakeRequest('main.fetch_items'))
+        self.logger.info('not sampled')
+        sampler.finish()
+        self.logger.info('outside a request')
+        handler.stop()
+        self.assertEqual([record.getMessage() for record in self.target.records],
+                         ['always kept', 'not sampled', 'outside a request'])
+        self.assertEqual(self.target.records[0].route, '/items/<uuid:item_id>')
+        self.assertFalse(hasattr(self.target.records[2], 'route'))
+
+    def test_after_fork_restarts_listener(self):
+        handler = LogQueueHandler([self.target], 100)
+        self.logger.addHandler(handler)
+        old_listener = handler.listener
+        handler.after_fork()
+        self.assertIsNot(handler.queue, old_listener.queue)
+        self.logger.info('in the child')
+        handler.stop()
+        old_listener.stop()
+        self.assertEqual([record.getMessage() for record in self.target.records], ['in the child'])
@@ -0,0 +1,87 @@
+# app/tests/test_metrics.py
+import requests
+from mock import patch, MagicMock
+from prometheus_client import REGISTRY
+from app import create_app
+from app.config import TestConfig
+from app.extensions import metrics, count_cache
+from app.metrics import MongoCommandTimer, command_collection
+from app.services import call_requests
+from flask_testing import TestCase as FlaskTestCase
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def command_event(name, command, request_id=1, duration_micros=2000):
+    event = MagicMock()
+    event.command_name = name
+    event.command = command
+    event.connection_id = ('localhost', 27017)
+    event.request_id = request_id
+    event.duration_micros = duration_micros
+    return event
+
+
+###############################################################################
+#                               metrics tests                                 #
+###############################################################################
+
+class MetricsTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def test_requests_counted_by_route(self):
+        before = sample('items_request_seconds_count', method='GET', route='/items/status', status='200')
+        self.client.get('/items/status', headers={'Content-type': 'application/json'})
+        self.assertEqual(sample('items_request_seconds_count', method='GET', route='/items/status', status='200'),
+                         before + 1)
+
+    def test_metrics_endpoint_is_plain_text(self):
+        self.client.get('/items/status', headers={'Content-type': 'application/json'})
+        response = self.client.get('/items/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'items_request_seconds_bucket{', response.data)
+
+    def test_cache_lookups_counted(self):
+        hits = sample('items_cache_lookups_total', cache='count_cache', result='hit')
+        misses = sample('items_cache_lookups_total', cache='count_cache', result='miss')
+        count_cache.get('nowt')
+        count_cache.set('somebody', 3)
+        count_cache.get('somebody')
+        self.assertEqual(sample('items_cache_lookups_total', cache='count_cache', result='hit'), hits + 1)
+        self.assertEqual(sample('items_cache_lookups_total', cache='count_cache', result='miss'), misses + 1)
+
+    def test_metrics_can_be_turned_off(self):
+        self.addCleanup(setattr, metrics, 'enabled', metrics.enabled)
+        config = type('NoMetrics', (TestConfig,), {'METRICS_ENABLED': False})
+        client = create_app(config).test_client()
+        self.assertEqual(client.get('/items/metrics').status_code, 404)
+
+    def test_mongo_commands_timed(self):
+        timer = MongoCommandTimer()
+        before = sample('items_mongo_command_seconds_count', command='find', collection='items')
+        timer.started(command_event('find', {'find': 'items', 'filter': {}}))
+        timer.succeeded(command_event('find', {}))
+        self.assertEqual(sample('items_mongo_command_seconds_count', command='find', collection='items'),
+                         before + 1)
+
+        errors = sample('items_mongo_command_errors_total', command='update', collection='items')
+        timer.started(command_event('update', {'update': 'items'}, request_id=2))
+        timer.failed(command_event('update', {}, request_id=2))
+        self.assertEqual(sample('items_mongo_command_errors_total', command='update', collection='items'),
+                         errors + 1)
+
+    def test_command_collection(self):
+        self.assertEqual(command_collection('getMore', {'getMore': 1234, 'collection': 'items'}), 'items')
+        self.assertEqual(command_collection('ping', {'ping': 1}), '')
+
+    @patch('app.services.get_session')
+    def test_outbound_errors_counted(self, mock_session):
+        before = sample('items_outbound_errors_total', service='auth')
+        mock_session.return_value.get.side_effect = requests.exceptions.ConnectTimeout('too slow')
+        call_requests('http://authy/check/10', {})
+        self.assertEqual(sample('items_outbound_errors_total', service='auth'), before + 1)
@@ -0,0 +1,96 @@
+# app/tests/test_ratelimit.py
+import uuid
+from unittest import TestCase
+from flask import Flask, g
+from mock import patch
+from app import create_app
+from app.config import TestConfig
+from app.ratelimit import BatchedStorage, rate_limit_key
+from app.aio.extensions import async_storage_uri, async_storage_options
+from flask_testing import TestCase as FlaskTestCase
+
+
+###############################################################################
+#                          batched storage tests                              #
+###############################################################################
+
+class BatchedStorageTest(TestCase):
+
+    def setUp(self):
+        self.storage = BatchedStorage('batched+memory://', sync_batch=5, sync_interval=60)
+
+    def test_first_hit_goes_to_shared_store(self):
+        self.assertEqual(self.storage.incr('k', 60), 1)
+        self.assertEqual(self.storage.shared.get('k'), 1)
+
+    def test_hits_synced_in_batches(self):
+        with patch.object(self.storage.shared, 'incr', wraps=self.storage.shared.incr) as shared_incr:
+            for hit in range(1, 11):
+                self.assertEqual(self.storage.incr('k', 60), hit)
+        # the first hit, then hits 2-6 in one go. 7-10 are still local
+        self.assertEqual(shared_incr.call_count, 2)
+        self.assertEqual(self.storage.shared.get('k'), 6)
+        self.assertEqual(self.storage.get('k'), 10)
+
+    def test_workers_see_each_others_hits_on_sync(self):
+        other = BatchedStorage('batched+memory://', sync_batch=5, sync_interval=60)
+        other.shared = self.storage.shared
+        for _ in range(6):
+            self.storage.incr('k', 60)
+        self.assertEqual(other.incr('k', 60), 7)
+
+    def test_synced_after_interval(self):
+        self.storage.sync_interval = 0
+        self.storage.incr('k', 60)
+        self.storage.incr('k', 60)
+        self.assertEqual(self.storage.shared.get('k'), 2)
+
+    def test_options_passed_to_shared_store(self):
+        with patch('app.ratelimit.storage_from_string') as storage_from_string:
+            BatchedStorage('batched+mongodb://db:27017', sync_batch=5, serverSelectionTimeoutMS=500)
+        storage_from_string.assert_called_once_with('mongodb://db:27017', serverSelectionTimeoutMS=500)
+
+    def test_clear(self):
+        self.storage.incr('k', 60)
+        self.storage.clear('k')
+        self.assertEqual(self.storage.get('k'), 0)
+
+
+###############################################################################
+#                             rate limit tests                                #
+###############################################################################
+
+class RateLimitKeyTest(TestCase):
+
+    def test_ip_then_user(self):
+        app = Flask(__name__)
+        with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+            self.assertEqual(rate_limit_key(), 'ip:10.0.0.1')
+            g.public_id = 'abc'
+            self.assertEqual(rate_limit_key(), 'user:abc')
+
+    def test_async_storage_uri(self):
+        self.assertEqual(async_storage_uri('memory://'), 'async+memory://')
+        self.assertEqual(async_storage_uri('batched+mongodb://db:27017'), 'async+mongodb://db:27017')
+        self.assertEqual(async_storage_uri('async+redis://cache:6379'), 'async+redis://cache:6379')
+
+    def test_async_storage_options(self):
+        options = {'sync_batch': 10, 'sync_interval': 1.0, 'serverSelectionTimeoutMS': 500, 'connectTimeoutMS': 500}
+        self.assertEqual(async_storage_options(options), {'serverSelectionTimeoutMS': 500, 'connectTimeoutMS': 500})
+
+
+class RouteLimitTest(FlaskTestCase):
+
+    def create_app(self):
+        config = type('LimitedConfig', (TestConfig,), {'RATELIMIT_STORAGE_URI': 'batched+memory://',
+                                                       'RATE_LIMIT_BULK_FETCH': '2 per minute'})
+        return create_app(config)
+
+    def test_bulk_fetch_limited(self):
+        headers = {'Content-type': 'application/json'}
+        fetch_json = {'item_ids': [str(uuid.uuid4())]}
+        for _ in range(2):
+            response = self.client.post('/items/bulk/fetch', headers=headers, json=fetch_json)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post('/items/bulk/fetch', headers=headers, json=fetch_json)
+        self.assertEqual(response.status_code, 429)
@@ -0,0 +1,61 @@
+# app/tests/test_search.py
+from unittest import TestCase
+from app.layout import Layout, DUAL
+from app.pagination import encode_cursor, decode_cursor, NEXT, PREV
+from app.main.helpers import parse_search_args, search_pipeline, search_page_result
+
+
+###############################################################################
+#                             search helper tests                             #
+###############################################################################
+
+class SearchHelpersTest(TestCase):
+
+    def test_parse_search_args(self):
+        self.assertEqual(parse_search_args({'q': ' atari '}, 5, 100, 50), ('atari', None, 5, None))
+        for args in ({}, {'q': '  '}, {'q': 'x' * 101}, {'q': 'atari', 'limit': '0'},
+                     {'q': 'atari', 'cursor': 'rubbish'},
+                     {'q': 'atari', 'cursor': encode_cursor({'k': 'abc', 'd': NEXT})},
+                     {'q': 'atari', 'cursor': encode_cursor({'k': [1.5, 'abc'], 'd': PREV})}):
+            with self.assertRaises(ValueError):
+                parse_search_args(args, 5, 100, 50)
+
+    def test_parse_search_args_caps_limit(self):
+        self.assertEqual(parse_search_args({'q': 'atari', 'limit': '1000000'}, 5, 100, 50)[2], 50)
+        self.assertEqual(parse_search_args({'q': 'atari', 'limit': '20'}, 5, 100, 50)[2], 20)
+
+    def test_parse_search_args_cursor_types(self):
+        cursor = parse_search_args({'q': 'atari', 'cursor': encode_cursor({'k': [2, 'abc'], 'd': NEXT})},
+                                   5, 100, 50)[3]
+        self.assertEqual(cursor['k'], [2, 'abc'])
+        for key in ([{'$gt': 0}, 'abc'], [True, 'abc'], ['1.5', 'abc'], [None, 'abc'],
+                    [1.5, {'$gt': ''}], [1.5, 7], [1.5, None]):
+            with self.assertRaises(ValueError):
+                parse_search_args({'q': 'atari', 'cursor': encode_cursor({'k': key, 'd': NEXT})}, 5, 100, 50)
+
+    def test_pipeline_with_cursor(self):
+        pipeline = search_pipeline('atari', 'cars:2000', {'k': [1.5, 'abc'], 'd': NEXT}, 10,
+                                   {'name': 1}, layout=Layout(DUAL))
+        self.assertEqual(pipeline[0], {'$match': {'$text': {'$search': 'atari'},
+                                                  '$or': [{'category': 'cars:2000'},
+                                                          {'details.category': 'cars:2000'}]}})
+        self.assertEqual(pipeline[2], {'$match': {'$or': [{'_score': {'$lt': 1.5}},
+                                                          {'_score': 1.5, '_id': {'$gt': 'abc'}}]}})
+        self.assertEqual(pipeline[-3:], [{'$sort': {'_score': -1, '_id': 1}},
+                                         {'$limit': 11},
+                                         {'$project': {'name': 1, '_score': 1}}])
+
+    def test_page_result(self):
+        docs = [{'_id': str(x), 'details': {'name': 'atari'}, '_score': 2.0 - x / 10.0} for x in range(3)]
+        return_data = search_page_result(docs, 'atari console', None, 2, ['name'])
+        self.assertEqual(return_data['items'], [{'item_id': '0', 'name': 'atari'},
+                                                {'item_id': '1', 'name': 'atari'}])
+        next_url = return_data['next_url']
+        self.assertTrue(next_url.startswith('/items/search?q=atari%20console&limit=2&cursor='))
+        self.assertTrue(next_url.endswith('&fields=name'))
+        token = next_url.split('cursor=')[1].split('&')[0]
+        self.assertEqual(decode_cursor(token)['k'], [1.9, '1'])
+
+    def test_last_page_has_no_next(self):
+        docs = [{'_id': 'a', 'name': 'atari', '_score': 1.0}]
+        self.assertNotIn('next_url', search_page_result(docs, 'atari', None, 2))
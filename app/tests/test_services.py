@@ -0,0 +1,52 @@
+# app/tests/test_services.py
+import requests
+from mock import patch
+from app import create_app, mongo, warm_up
+from app.config import TestConfig
+from app.services import get_session, call_requests, get_s3_urls
+from flask_testing import TestCase as FlaskTestCase
+
+
+###############################################################################
+#                         outbound http client tests                          #
+###############################################################################
+
+class ServicesTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def test_session_reused(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_session_rebuilt_after_fork(self):
+        session = get_session()
+        with patch('app.services.os.getpid', return_value=-1):
+            self.assertIsNot(get_session(), session)
+
+    def test_only_gets_retried(self):
+        retries = get_session().get_adapter('http://').max_retries
+        self.assertTrue(retries.is_retry('GET', 503))
+        self.assertFalse(retries.is_retry('POST', 503))
+
+    @patch('app.services.get_session')
+    def test_call_requests_fails_cleanly(self, mock_session):
+        mock_session.return_value.get.side_effect = requests.exceptions.ConnectTimeout('too slow')
+        self.assertIsNone(call_requests('http://authy/check/10', {}))
+
+    @patch('app.services.get_session')
+    def test_get_s3_urls_fails_cleanly(self, mock_session):
+        mock_session.return_value.post.side_effect = requests.exceptions.ConnectionError('nope')
+        self.assertIsNone(get_s3_urls(['a', 'b'], 'sometoken'))
+
+    def test_warm_up(self):
+        self.app.config['CHECK_INDEXES_ON_STARTUP'] = True
+        with patch('app.log_missing_indexes') as check_indexes:
+            warm_up(self.app)
+        check_indexes.assert_called_once()
+
+    def test_warm_up_without_mongo(self):
+        with patch.object(type(mongo.cx.admin), 'command', side_effect=Exception('no mongo')), \
+             patch('app.log_missing_indexes') as check_indexes:
+            warm_up(self.app)
+        check_indexes.assert_not_called()
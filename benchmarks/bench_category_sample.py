@@ -0,0 +1,80 @@
+# benchmarks/bench_category_sample.py
+# compares $match + $sample against the random key range queries in
+# app/sampling.py for categories of different sizes. needs a real mongo as
+# the whole point is to see what the server does - it seeds and then drops
+# its own collection
+#
+# run from the app root:
+#   python -m benchmarks.bench_category_sample --uri mongodb://localhost:27017/bench
+import argparse
+import random
+import statistics
+import time
+import uuid
+from pymongo import MongoClient, ASCENDING
+
+from app.sampling import sample_category
+
+COLLECTION = 'bench_category_sample'
+
+
+def seed(collection, category, count, batch_size=10000):
+    now = time.time()
+    docs = []
+    for x in range(count):
+        docs.append({'_id': str(uuid.uuid4()),
+                     'details': {'name': 'bench item ' + str(x),
+                                 'description': 'lorem ipsum ' * 40,
+                                 'category': category},
+                     'rand': random.random()})
+        if len(docs) == batch_size:
+            collection.insert_many(docs, ordered=False)
+            docs = []
+    if docs:
+        collection.insert_many(docs, ordered=False)
+    return time.time() - now
+
+
+def old_sample(collection, category, size):
+    return list(collection.aggregate([{'$match': {'details.category': category}},
+                                      {'$sample': {'size': size}}]))
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def run(uri, sizes, sample_size, repeat):
+    db = MongoClient(uri).get_default_database()
+    collection = db[COLLECTION]
+    collection.drop()
+    collection.create_index([('details.category', ASCENDING), ('rand', ASCENDING)])
+
+    try:
+        print("%-10s %16s %16s %16s %16s" % ('items', '$sample p50 ms', '$sample p99 ms',
+                                             'rand p50 ms', 'rand p99 ms'))
+        for size in sizes:
+            category = 'bench:' + str(size)
+            seed(collection, category, size)
+            old = timed(lambda: old_sample(collection, category, sample_size), repeat)
+            new = timed(lambda: sample_category(collection, category, sample_size), repeat)
+            print("%-10d %16.2f %16.2f %16.2f %16.2f" % (size, old[0], old[1], new[0], new[1]))
+    finally:
+        collection.drop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='category sampling benchmark')
+    parser.add_argument('--uri', required=True, help='mongo uri including a database name')
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated category sizes')
+    parser.add_argument('--sample-size', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.uri, [int(x) for x in args.sizes.split(',')], args.sample_size, args.repeat)
@@ -0,0 +1,41 @@
+# benchmarks/bench_compression.py
+# cpu cost against bytes saved for each codec and level in
+# app/compression.py, on the same item pages as bench_json
+#
+# run from the app root: python -m benchmarks.bench_compression
+import argparse
+import random
+import timeit
+from flask import Flask
+
+from app.compression import CODECS, compress_bytes
+from app.json_provider import OrjsonProvider
+from benchmarks.bench_json import item_page
+
+LEVELS = {'gzip': [1, 4, 6, 9], 'zstd': [1, 3, 9]}
+
+
+def run(number, sizes):
+    provider = OrjsonProvider(Flask(__name__))
+
+    print("%-6s %-6s %-6s %10s %10s %8s %10s %10s" %
+          ('items', 'codec', 'level', 'in (kb)', 'out (kb)', 'ratio', 'ms/resp', 'mb/s'))
+    for size in sizes:
+        body = provider.dumpb(item_page(size))
+        for encoding in CODECS:
+            for level in LEVELS[encoding]:
+                out = compress_bytes(encoding, level, body)
+                seconds = timeit.timeit(lambda: compress_bytes(encoding, level, body), number=number) / number
+                print("%-6d %-6s %-6d %10.0f %10.0f %7.1fx %10.2f %10.0f" %
+                      (size, encoding, level, len(body)/1024, len(out)/1024, len(body)/len(out),
+                       seconds*1000, len(body)/seconds/1024/1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='response compression micro-benchmark')
+    parser.add_argument('--number', type=int, default=50, help='calls per measurement')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000],
+                        help='items per page')
+    args = parser.parse_args()
+    random.seed(1)
+    run(args.number, args.sizes)
@@ -0,0 +1,277 @@
+# benchmarks/bench_endpoints.py
+# throughput and p50/p99 latency for the main endpoints at a few concurrency
+# levels, going through the whole flask app in process. authy and aws are
+# stubbed out (the access check hands back the token as the public_id, aws
+# answers after --s3-latency seconds) so only our own code and mongo are
+# measured. point --uri at a scratch mongo for real numbers - without it an
+# in-process mongomock is used, which is only good for spotting big
+# regressions in our own python. seeds and then drops its own collection
+#
+# results are written as json so runs can be compared:
+#   python -m benchmarks.bench_endpoints --uri mongodb://localhost:27017/bench --output before.json
+#   ... change things ...
+#   python -m benchmarks.bench_endpoints --uri mongodb://localhost:27017/bench --output after.json \
+#       --compare before.json
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch, MagicMock
+
+from app.config import Config
+
+CATEGORY = 'consoles-vintage:3341'
+
+
+class BenchConfig(Config):
+    LOG_FILENAME = os.devnull
+    LOG_LEVEL = 'ERROR'
+    PAGE_LIMIT = os.getenv('PAGE_LIMIT', 20)
+    FOTO_LIMIT = os.getenv('FOTO_LIMIT', 3)
+    AWS_S3_URL = 'http://aws.invalid/'
+    CHECK_ACCESS_URL = 'http://authy.invalid/'
+    RATELIMIT_ENABLED = False
+    CHECK_INDEXES_ON_STARTUP = False
+
+
+# -----------------------------------------------------------------------------
+# stubs and seed data
+# -----------------------------------------------------------------------------
+
+def fake_check_access(token, access_level):
+    return token, None, 200
+
+
+def fake_s3_urls(latency):
+    def get_s3_urls(foto_ids, token):
+        time.sleep(latency)
+        r = MagicMock()
+        r.status_code = 201
+        r.json.return_value = {'aws_urls': ['https://some.s3.url/'+foto_id for foto_id in foto_ids]}
+        return r
+    return get_s3_urls
+
+
+def item_data(public_id, x):
+    # same shape as create_item in app/tests/test_api.py
+    now = datetime.datetime.utcnow()
+    return {'name': 'bench item ' + str(x),
+            'description': 'blah lorem ipsum lorem ipsum lorem ipsum lorem ipsum ' * 4,
+            'category': CATEGORY,
+            'public_id': public_id,
+            'created': now,
+            'modified': now}
+
+
+def seed(mongo, item_layout, users, items_per_user, batch_size=5000):
+    # returns {public_id: [item ids]}
+    from app.sampling import new_random_key
+
+    item_ids = {}
+    docs = []
+    for _ in range(users):
+        public_id = str(uuid.uuid4())
+        item_ids[public_id] = []
+        for x in range(items_per_user):
+            item_id = str(uuid.uuid4())
+            item_ids[public_id].append(item_id)
+            docs.append(item_layout.stored(item_id, item_data(public_id, x), new_random_key()))
+            if len(docs) == batch_size:
+                mongo.db.items.insert_many(docs, ordered=False)
+                docs = []
+    if docs:
+        mongo.db.items.insert_many(docs, ordered=False)
+    return item_ids
+
+# -----------------------------------------------------------------------------
+# the requests - each takes a test client and the seeded ids and returns the
+# response
+# -----------------------------------------------------------------------------
+
+def get_items_by_user(client, item_ids):
+    public_id = random.choice(list(item_ids))
+    return client.get('/items?limit=20', headers={'Content-type': 'application/json',
+                                                   'x-access-token': public_id})
+
+
+def get_item(client, item_ids):
+    item_id = random.choice(item_ids[random.choice(list(item_ids))])
+    return client.get('/items/'+item_id, headers={'Content-type': 'application/json'})
+
+
+def fetch_items(client, item_ids):
+    every_id = [item_id for ids in item_ids.values() for item_id in ids]
+    wanted = random.sample(every_id, min(100, len(every_id)))
+    return client.post('/items/bulk/fetch', json={'item_ids': wanted},
+                       headers={'Content-type': 'application/json'})
+
+
+def create_item(client, item_ids):
+    public_id = random.choice(list(item_ids))
+    return client.post('/items', json={'name': 'bench created item',
+                                       'description': 'lorem ipsum lorem ipsum lorem ipsum',
+                                       'category': CATEGORY},
+                       headers={'Content-type': 'application/json', 'x-access-token': public_id})
+
+
+ENDPOINTS = {'get_items_by_user': get_items_by_user,
+             'get_item': get_item,
+             'fetch_items': fetch_items,
+             'create_item': create_item}
+
+# -----------------------------------------------------------------------------
+
+
+def percentile(timings, fraction):
+    # timings must be sorted
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def measure(app, fn, item_ids, concurrency, requests_per_worker):
+    # every worker gets its own test client and fires its requests back to
+    # back. returns the result row for this endpoint and concurrency
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        mine, failed = [], 0
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            response = fn(client, item_ids)
+            mine.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            timings.extend(mine)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {'requests': len(timings),
+            'errors': sum(errors),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(statistics.median(timings), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def use_mongomock():
+    # an in-process stand-in for when there's no mongo to hand
+    import mongomock
+    import flask_pymongo
+    flask_pymongo.MongoClient = lambda *args, **kwargs: mongomock.MongoClient()
+    BenchConfig.MONGO_URI = 'mongodb://localhost/bench_endpoints'
+
+
+def run(args):
+    if args.uri:
+        BenchConfig.MONGO_URI = args.uri
+    else:
+        use_mongomock()
+
+    from app import create_app, mongo
+    from app.extensions import item_layout
+    from app.indexes import ensure_indexes
+
+    app = create_app(BenchConfig)
+    results = []
+
+    with app.app_context(), \
+         patch('app.decorators.check_access', fake_check_access), \
+         patch('app.main.views.get_s3_urls', fake_s3_urls(args.s3_latency)):
+
+        mongo.db.items.drop()
+        ensure_indexes(mongo.db, item_layout.mode)
+        try:
+            item_ids = seed(mongo, item_layout, args.users, args.items_per_user)
+            print("%-18s %6s %9s %7s %10s %10s %10s" % ('endpoint', 'conc', 'requests', 'errors',
+                                                         'req/s', 'p50 ms', 'p99 ms'))
+            for name in args.endpoints:
+                # a few untimed requests so caches and pools are warm
+                measure(app, ENDPOINTS[name], item_ids, 1, args.warmup)
+                for concurrency in args.concurrency:
+                    row = measure(app, ENDPOINTS[name], item_ids, concurrency, args.requests)
+                    row = dict({'endpoint': name, 'concurrency': concurrency}, **row)
+                    results.append(row)
+                    print("%-18s %6d %9d %7d %10.1f %10.2f %10.2f" % (name, concurrency, row['requests'],
+                                                                       row['errors'], row['throughput_rps'],
+                                                                       row['p50_ms'], row['p99_ms']))
+        finally:
+            mongo.db.items.drop()
+
+    return {'meta': {'commit': git_commit(),
+                     'when': datetime.datetime.utcnow().isoformat(),
+                     'python': platform.python_version(),
+                     'mongo': args.uri.rsplit('@', 1)[-1] if args.uri else 'mongomock',
+                     'users': args.users,
+                     'items_per_user': args.items_per_user,
+                     'requests_per_worker': args.requests,
+                     's3_latency': args.s3_latency,
+                     'item_layout': item_layout.mode},
+            'results': results}
+
+
+def compare(report, baseline):
+    # % change against an earlier run for every endpoint and concurrency in
+    # both. positive is better for req/s, negative is better for latency
+    before = {(row['endpoint'], row['concurrency']): row for row in baseline['results']}
+    print("\nagainst %s (%s)" % (baseline['meta'].get('commit'), baseline['meta'].get('when')))
+    print("%-18s %6s %10s %10s %10s" % ('endpoint', 'conc', 'req/s', 'p50', 'p99'))
+    for row in report['results']:
+        old = before.get((row['endpoint'], row['concurrency']))
+        if old is None:
+            continue
+        change = lambda key: (row[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print("%-18s %6d %+9.1f%% %+9.1f%% %+9.1f%%" % (row['endpoint'], row['concurrency'],
+                                                      change('throughput_rps'), change('p50_ms'),
+                                                      change('p99_ms')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='endpoint benchmark')
+    parser.add_argument('--uri', default=None, help='mongo uri including a database name, mongomock if not set')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--items-per-user', type=int, default=100)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='comma separated, from ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated worker counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per worker')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='seconds the fake aws takes')
+    parser.add_argument('--output', default=None, help='write the results here as json')
+    parser.add_argument('--compare', default=None, help='json results from an earlier run')
+    args = parser.parse_args()
+    args.endpoints = args.endpoints.split(',')
+    args.concurrency = [int(x) for x in args.concurrency.split(',')]
+
+    random.seed(1)
+    report = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
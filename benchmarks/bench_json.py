@@ -0,0 +1,68 @@
+# benchmarks/bench_json.py
+# serialization throughput for realistic item pages with the bson provider
+# flask-pymongo installs (what we used to use), the standard library
+# provider and the orjson one from app/json_provider.py
+#
+# run from the app root: python -m benchmarks.bench_json
+import argparse
+import datetime
+import random
+import timeit
+import uuid
+from flask import Flask
+from flask_pymongo.helpers import BSONProvider
+
+from app.json_provider import StdJSONProvider, OrjsonProvider
+
+
+WORDS = ('vintage boxed working condition original collection only spare parts '
+         'mint rare signed delivery cable manual tested scratches great bargain '
+         'console cartridge lens camera sofa leather bike frame wheels engine').split()
+
+
+def description(max_chars=5000):
+    # random words rather than one repeated phrase so compression ratios
+    # are closer to real listings
+    words = []
+    length = random.randint(200, max_chars)
+    while sum(len(word)+1 for word in words) < length:
+        words.append(random.choice(WORDS) if random.random() < 0.8 else str(random.randint(1, 9999)))
+    return ' '.join(words)[:length]
+
+
+def item_page(num_items):
+    # roughly what GET /items and /items/bulk/fetch send back
+    now = datetime.datetime.utcnow()
+    return {'items': [{'item_id': str(uuid.uuid4()),
+                       'name': 'my test item ' + str(x),
+                       'description': description(),
+                       'category': 'computers-vintage:89898',
+                       'public_id': str(uuid.uuid4()),
+                       'created': now,
+                       'modified': now} for x in range(num_items)]}
+
+
+def run(number, sizes):
+    app = Flask(__name__)
+    providers = [('bson', BSONProvider(app)),
+                 ('std', StdJSONProvider(app)),
+                 ('orjson', OrjsonProvider(app))]
+
+    print("%-8s %-8s %10s %14s %14s" % ('items', 'provider', 'kb', 'dumps (/s)', 'loads (/s)'))
+    for size in sizes:
+        page = item_page(size)
+        for name, provider in providers:
+            body = provider.dumps(page)
+            dumps = timeit.timeit(lambda: provider.dumps(page), number=number)
+            loads = timeit.timeit(lambda: provider.loads(body), number=number)
+            print("%-8d %-8s %10.0f %14.0f %14.0f" % (size, name, len(body)/1024, number/dumps, number/loads))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='json provider micro-benchmark')
+    parser.add_argument('--number', type=int, default=200, help='calls per measurement')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 100, 1000],
+                        help='items per page')
+    args = parser.parse_args()
+    random.seed(1)
+    run(args.number, args.sizes)
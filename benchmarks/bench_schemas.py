@@ -0,0 +1,42 @@
+# benchmarks/bench_schemas.py
+# compares the old load-the-file-every-time validation with the precompiled
+# validators in app/assertions.py
+#
+# run from the app root: python -m benchmarks.bench_schemas
+import argparse
+import timeit
+import uuid
+from jsonschema import validate, Draft7Validator
+
+from app.assertions import assert_valid_schema, _load_json_schema, SCHEMA_FILES
+
+
+def old_assert_valid_schema(data, schema_type):
+    # what assert_valid_schema used to do on every call
+    schema = _load_json_schema(SCHEMA_FILES[schema_type])
+    return validate(data, schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+
+
+def payloads(num_ids):
+    item = {'name': 'my test item',
+            'description': 'lorem ipsum ' * 400,
+            'category': 'computers-vintage:89898',
+            'yarp': 'narp'}
+    bulk = {'item_ids': [str(uuid.uuid4()) for _ in range(num_ids)]}
+    return [('item', item), ('bulk_items', bulk)]
+
+
+def run(number, num_ids):
+    print("%-12s %14s %14s %8s" % ('schema', 'before (/s)', 'after (/s)', 'speedup'))
+    for schema_type, data in payloads(num_ids):
+        before = timeit.timeit(lambda: old_assert_valid_schema(data, schema_type), number=number)
+        after = timeit.timeit(lambda: assert_valid_schema(data, schema_type), number=number)
+        print("%-12s %14.0f %14.0f %7.1fx" % (schema_type, number/before, number/after, before/after))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='json schema validation micro-benchmark')
+    parser.add_argument('--number', type=int, default=2000, help='validations per measurement')
+    parser.add_argument('--ids', type=int, default=100, help='number of ids in the bulk payload')
+    args = parser.parse_args()
+    run(args.number, args.ids)
@@ -0,0 +1,144 @@
+# benchmarks/bench_search.py
+# latency of GET /items/search's query as the collection grows, against the
+# case-insensitive regex scan clients would otherwise be stuck with. needs a
+# real mongo for the text index - it seeds and then drops its own collection
+#
+# names and descriptions are made up from a few thousand words with a skewed
+# (zipf-ish) spread like real listings, plus a fixed number of items with a
+# rare term in them. 'rare' matches the same number of items at every size,
+# so its latency should stay flat. 'common' matches a share of the
+# collection, so mongo has more to score as it grows - that's the cost of
+# ranking and is what the numbers for it show
+#
+# run from the app root:
+#   python -m benchmarks.bench_search --uri mongodb://localhost:27017/bench
+import argparse
+import random
+import re
+import statistics
+import time
+import uuid
+from pymongo import MongoClient
+
+from app.indexes import ensure_indexes
+from app.layout import Layout, NESTED, FLAT
+from app.main.helpers import search_pipeline
+
+COLLECTION = 'items'
+RARE = 'zxspectrum'
+CATEGORY = 'consoles-vintage:3341'
+CATEGORIES = [CATEGORY] + ['bench-' + str(x) + ':' + str(1000 + x) for x in range(49)]
+
+
+def vocabulary(size):
+    # made up words of 3-10 letters, most common first
+    rnd = random.Random(1)
+    letters = 'abcdefghijklmnoprstuvwy'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(letters) for _ in range(rnd.randint(3, 10))))
+    return sorted(words, key=lambda word: rnd.random())
+
+
+def weights(size):
+    return [1.0 / (rank + 1) for rank in range(size)]
+
+
+def seed(collection, layout, count, words, word_weights, rare_count, batch_size=10000):
+    started = time.time()
+    rare_at = set(random.sample(range(count), min(rare_count, count)))
+    docs = []
+    for x in range(count):
+        name = random.choices(words, word_weights, k=4)
+        description = random.choices(words, word_weights, k=40)
+        if x in rare_at:
+            name[0] = RARE
+        data = {'name': ' '.join(name),
+                'description': ' '.join(description),
+                'category': random.choice(CATEGORIES),
+                'public_id': str(uuid.uuid4())}
+        docs.append(layout.stored(str(uuid.uuid4()), data, random.random()))
+        if len(docs) == batch_size:
+            collection.insert_many(docs, ordered=False)
+            docs = []
+    if docs:
+        collection.insert_many(docs, ordered=False)
+    return time.time() - started
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.99) - 1)]
+
+
+def text_search(collection, layout, terms, category, limit):
+    return list(collection.aggregate(search_pipeline(terms, category, limit=limit, layout=layout)))
+
+
+def regex_scan(collection, layout, terms, category, limit):
+    # roughly what filtering on the client amounts to, done in mongo
+    pattern = re.compile(re.escape(terms), re.IGNORECASE)
+    query = {'$or': [{path: pattern} for field in ('name', 'description') for path in layout.paths(field)]}
+    if category is not None:
+        query = {'$and': [query, layout.match('category', category)]}
+    return list(collection.find(query).limit(limit))
+
+
+def run(args):
+    db = MongoClient(args.uri).get_default_database()
+    collection = db[COLLECTION]
+    if collection.estimated_document_count() and not args.force:
+        raise SystemExit("[%s] already has docs in it - use a scratch database or --force" % COLLECTION)
+
+    layout = Layout(args.layout)
+    words = vocabulary(args.vocabulary)
+    word_weights = weights(len(words))
+    # the 20th most common word - in plenty of items but not all of them
+    queries = {'rare': RARE, 'common': words[20]}
+
+    collection.drop()
+    ensure_indexes(db, layout.mode)
+    print("%-10s %-8s %-10s %14s %14s %14s %14s" % ('items', 'query', 'category', 'text p50 ms', 'text p99 ms',
+                                                    'regex p50 ms', 'regex p99 ms'))
+
+    seeded = 0
+    try:
+        for size in args.sizes:
+            # the rare items all go in with the first lot so their number stays put
+            seed(collection, layout, size - seeded, words, word_weights, args.rare if seeded == 0 else 0)
+            seeded = size
+            for name, terms in queries.items():
+                for category in (None, CATEGORY):
+                    text = timed(lambda: text_search(collection, layout, terms, category, args.limit), args.repeat)
+                    if args.skip_regex:
+                        regex = (float('nan'), float('nan'))
+                    else:
+                        regex = timed(lambda: regex_scan(collection, layout, terms, category, args.limit),
+                                      max(1, args.repeat // 10))
+                    print("%-10d %-8s %-10s %14.2f %14.2f %14.2f %14.2f" % (size, name, 'yes' if category else 'no',
+                                                                          text[0], text[1], regex[0], regex[1]))
+    finally:
+        collection.drop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='text search benchmark')
+    parser.add_argument('--uri', required=True, help='mongo uri including a database name')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated collection sizes, smallest first')
+    parser.add_argument('--layout', default=NESTED, choices=[NESTED, FLAT])
+    parser.add_argument('--vocabulary', type=int, default=5000, help='distinct words to build items from')
+    parser.add_argument('--rare', type=int, default=50, help='items with the rare term in them')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--skip-regex', action='store_true', help="don't time the regex scans")
+    parser.add_argument('--force', action='store_true', help='drop the items collection even if it has docs')
+    args = parser.parse_args()
+    args.sizes = sorted(int(x) for x in args.sizes.split(','))
+    random.seed(1)
+    run(args)
@@ -0,0 +1,56 @@
+# benchmarks/bench_startup.py
+# how long 'import items' takes from cold (which includes create_app) and
+# which imports the time goes on. each run is a fresh interpreter so nothing
+# is cached in sys.modules. with gunicorn.conf.py's preload_app this is paid
+# once by the master rather than by every worker on every (re)start
+#
+# run from the app root: python -m benchmarks.bench_startup
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+TIMED_IMPORT = ("import time; started = time.perf_counter(); import items; "
+                "print((time.perf_counter() - started) * 1000)")
+
+
+def cold_import_ms(repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', TIMED_IMPORT], stderr=subprocess.DEVNULL)
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+    return statistics.median(timings), min(timings)
+
+
+def slowest_imports(top):
+    # -X importtime writes 'import time: self | cumulative | name' to stderr.
+    # a package's cumulative time includes everything it imported so the
+    # same time can show up at a few levels
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import items'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    rows = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='app import time')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    if 'MONGO_URI' not in os.environ:
+        # nothing connects at import time, it just has to be set
+        os.environ['MONGO_URI'] = 'mongodb://localhost:27017/bench_startup'
+
+    median, best = cold_import_ms(args.repeat)
+    print("import items: median %.1f ms, best %.1f ms over %d runs\n" % (median, best, args.repeat))
+    print("%12s %10s  %s" % ('cumulative', 'self', 'module'))
+    for cumulative, own, name in slowest_imports(args.top):
+        print("%9.1f ms %7.1f ms  %s" % (cumulative, own, name))
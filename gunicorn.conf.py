@@ -0,0 +1,76 @@
+# gunicorn.conf.py
+import gc
+import multiprocessing
+import os
+
+# -----------------------------------------------------------------------------
+# gunicorn settings and server hooks. run with 'gunicorn -c gunicorn.conf.py
+# items:app' (see run_app.sh). everything can be overridden from the
+# environment or the command line
+# -----------------------------------------------------------------------------
+
+def _cores():
+    # the cores we're allowed to use, which in a container can be fewer than
+    # the machine has
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+bind = '0.0.0.0:' + os.getenv('PORT', '8000')
+
+# GUNICORN_WORKLOAD=io (the default) is for the usual mix, where most of a
+# request is spent waiting on mongo, authy and aws - a process per core with
+# threads to overlap the waiting. cpu is for boxes doing mostly in-process
+# work (i.e. big bulk fetches) where threads just fight over the gil
+workload = os.getenv('GUNICORN_WORKLOAD', 'io')
+if workload == 'cpu':
+    worker_class = 'sync'
+    workers = int(os.getenv('GUNICORN_WORKERS', _cores() + 1))
+    threads = 1
+else:
+    worker_class = 'gthread'
+    workers = int(os.getenv('GUNICORN_WORKERS', _cores()))
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# the app picks its item cache backend from this - a per worker cache isn't
+# cleared by edits in the other workers. see ITEM_CACHE_BACKEND in config.py
+os.environ['APP_WORKERS'] = str(workers)
+
+# import and build the app once in the master - workers fork from it with
+# everything already loaded. see warm_up in app/__init__.py for the bits
+# that have to wait until after the fork
+preload_app = True
+
+# recycle workers now and then so a slow leak can't grow forever. the
+# jitter stops them all restarting at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# we sit behind a load balancer that reuses connections
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# worker heartbeats go through a file - keep it off a (possibly slow)
+# container filesystem
+worker_tmp_dir = os.getenv('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+
+def when_ready(server):
+    # the app is loaded and no worker has been forked yet. freezing moves
+    # everything allocated so far out of the gc's sight, so collections in
+    # the workers don't write to (and so copy) the pages they share with us
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from app import warm_up
+    warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    # tidy up after a dead worker's prometheus files - see app/metrics.py
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,5 @@
+# items_asgi.py
+
+from app.aio import create_async_app
+
+app = create_async_app()
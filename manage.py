@@ -1,11 +1,130 @@
 import os
+import sys
+import datetime
+import click
 from app.config import TestConfig
 from flask.cli import FlaskGroup
 
-from app import create_app
+from app import create_app, mongo
+from app.indexes import ensure_indexes, missing_indexes, explain_report
+from app.layout import NESTED, migrate_batch, nested_count
+from app.sampling import backfill_random_keys, missing_random_keys
+from app.events import EVENTS, compact_events, pending_markers, relay_events
 
 app = create_app()
-cli = FlaskGroup(app)
+cli = FlaskGroup(create_app=lambda: app)
+
+# -----------------------------------------------------------------------------
+# index management
+# -----------------------------------------------------------------------------
+
+@cli.command('create-indexes')
+def create_indexes():
+    """Create any missing indexes declared in app/indexes.py"""
+    for name in ensure_indexes(mongo.db, app.config['ITEM_LAYOUT']):
+        click.echo("ensured index [%s]" % name)
+
+
+@cli.command('check-indexes')
+def check_indexes():
+    """List declared indexes that don't exist yet"""
+    missing = missing_indexes(mongo.db, app.config['ITEM_LAYOUT'])
+    for collection, spec in missing:
+        click.echo("missing index [%s] on [%s] %s" % (spec['name'], collection, spec['keys']))
+    if missing:
+        sys.exit(1)
+    click.echo("all indexes present")
+
+
+@cli.command('explain-queries')
+def explain_queries():
+    """Run explain on each query shape the views use and flag collection scans"""
+    collscans = 0
+    for entry in explain_report(mongo.db, app.config['ITEM_LAYOUT']):
+        flag = 'COLLSCAN' if entry['collscan'] else 'ok'
+        collscans += entry['collscan']
+        click.echo("%-24s %-8s %s" % (entry['query'], flag, ' > '.join(entry['stages'])))
+    if collscans:
+        sys.exit(1)
+
+
+# -----------------------------------------------------------------------------
+# data fixes
+# -----------------------------------------------------------------------------
+
+@cli.command('backfill-rand')
+@click.option('--check', is_flag=True, help='only count items without a key, exiting non-zero if there are any')
+def backfill_rand(check):
+    """Give items created before category sampling used random keys a key"""
+    if check:
+        missing = missing_random_keys(mongo.db.items)
+        click.echo("[%d] items without a random key" % missing)
+        if missing:
+            sys.exit(1)
+        return
+    click.echo("backfilled [%d] items" % backfill_random_keys(mongo.db.items))
+
+
+@cli.command('migrate-layout')
+@click.option('--batch-size', default=500, help='docs converted per round trip')
+@click.option('--after', default=None, help='carry on from this _id')
+def migrate_layout(batch_size, after):
+    """Convert nested item docs to the flat layout - run with ITEM_LAYOUT=dual"""
+    if app.config['ITEM_LAYOUT'] == NESTED:
+        # servers still on nested can't read flat docs
+        click.echo("set ITEM_LAYOUT=dual everywhere before migrating")
+        sys.exit(1)
+
+    converted = 0
+    while True:
+        count, last_id = migrate_batch(mongo.db.items, after, batch_size)
+        if last_id is None:
+            break
+        converted += count
+        after = last_id
+        click.echo("converted [%d] items, up to [%s]" % (converted, after))
+
+    remaining = nested_count(mongo.db.items)
+    if remaining:
+        # edited while we were going - run it again to pick them up
+        click.echo("[%d] nested items left, run again" % remaining)
+        sys.exit(1)
+    click.echo("all items flat - ITEM_LAYOUT can go to flat")
+
+
+# -----------------------------------------------------------------------------
+# item change events
+# -----------------------------------------------------------------------------
+
+@cli.command('compact-events')
+@click.option('--older-than', default=None, type=int,
+              help='seconds, defaults to EVENTS_COMPACT_AFTER')
+def compact_item_events(older_than):
+    """Delete old events that have a newer event for the same item"""
+    if older_than is None:
+        older_than = app.config['EVENTS_COMPACT_AFTER']
+    before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+    click.echo("deleted [%d] superseded events" % compact_events(mongo.db[EVENTS], before))
+
+
+@cli.command('relay-events')
+@click.option('--older-than', default=None, type=float,
+              help='seconds, defaults to EVENTS_RELAY_AFTER')
+@click.option('--batch-size', default=500, help='items relayed per round')
+def relay_item_events(older_than, batch_size):
+    """Move item changes whose event wasn't relayed at the time into the feed"""
+    if older_than is None:
+        older_than = app.config['EVENTS_RELAY_AFTER']
+    before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+    relayed = 0
+    while True:
+        pending = pending_markers(mongo.db.items, before, batch_size)
+        if not pending:
+            break
+        relayed += len(relay_events(mongo.db, pending))
+        click.echo("relayed [%d] events" % relayed)
+    click.echo("nothing left to relay")
+
 
 if __name__ == '__main__':
     cli()
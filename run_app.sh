@@ -1,4 +1,9 @@
 #!/usr/bin/env bash
 
 source .env
-gunicorn -b 0.0.0.0:${PORT} items:app
\ No newline at end of file
+# workers share their prometheus metrics through files in here - it has to
+# start empty or we'd be adding to the last run's numbers
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/items_metrics}
+rm -rf ${PROMETHEUS_MULTIPROC_DIR} && mkdir -p ${PROMETHEUS_MULTIPROC_DIR}
+# bind address, workers etc. are in gunicorn.conf.py
+gunicorn -c gunicorn.conf.py items:app
@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+
+source .env
+# see run_app.sh
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/items_metrics}
+rm -rf ${PROMETHEUS_MULTIPROC_DIR} && mkdir -p ${PROMETHEUS_MULTIPROC_DIR}
+# the app picks its item cache backend from the worker count - see
+# ITEM_CACHE_BACKEND in app/config.py
+export APP_WORKERS=${WORKERS:-2}
+hypercorn -b 0.0.0.0:${PORT} -w ${APP_WORKERS} items_asgi:app